@@ -0,0 +1,83 @@
+"""Measure the evaluation speed of the Scheme interpreter.
+
+Runs each of a few small Scheme programs in a fresh global frame and reports
+the fastest of several runs.  Recursion is kept shallow, since the interpreter
+does not optimize tail calls.
+
+    python benchmarks/eval.py [-n RUNS] [--jit] [NAME ...]
+"""
+
+from __future__ import print_function  # Python 2 compatibility
+
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Repetition uses map over a list, since every call takes stack space
+PRELUDE = '''
+    (define (range a b) (if (>= a b) nil (cons a (range (+ a 1) b))))
+    (define (repeat k thunk) (map (lambda (i) (thunk)) (range 0 k)))
+'''
+
+PROGRAMS = {
+    # Builtins called from deeply nested procedures
+    'nested': '''
+        (define (outer a)
+          (define (middle b)
+            (define (inner c)
+              (define (loop n acc)
+                (if (= n 0) acc (loop (- n 1) (+ acc (car (cons c nil))))))
+              (loop 50 0))
+            (inner b))
+          (middle a))
+        (repeat 100 (lambda () (outer 1)))
+    ''',
+    'fib': '''
+        (define (fib n) (if (< n 2) n (+ (fib (- n 1)) (fib (- n 2)))))
+        (fib 18)
+    ''',
+    'lists': '''
+        (define (sum s) (if (null? s) 0 (+ (car s) (sum (cdr s)))))
+        (repeat 100 (lambda () (sum (map (lambda (x) (* x x)) (range 0 50)))))
+    ''',
+    'let': '''
+        (define (dist x1 y1 x2 y2)
+          (let ((dx (- x2 x1)) (dy (- y2 y1)))
+            (let ((d2 (+ (* dx dx) (* dy dy))))
+              (sqrt d2))))
+        (define (go k acc)
+          (if (= k 0) acc (go (- k 1) (+ acc (dist 0 0 k k)))))
+        (repeat 100 (lambda () (go 50 0)))
+    ''',
+}
+
+def best_of(runs, fn):
+    """Return the fastest of RUNS calls to FN, in seconds."""
+    best = float('inf')
+    for _ in range(runs):
+        start = time.time()
+        fn()
+        best = min(best, time.time() - start)
+    return best
+
+def main(runs=5, names=(), jit=False):
+    sys.path.insert(0, ROOT)
+    import scheme
+    for name in names or sorted(PROGRAMS):
+        program = scheme.Interpreter().parse(PRELUDE + PROGRAMS[name])
+        seconds = best_of(runs, lambda: scheme.Interpreter(jit=jit).eval(program))
+        print('{0:10} {1:8.1f} ms'.format(name, seconds * 1000))
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-n', '--runs', type=int, default=5,
+                        help='number of runs to take the best of')
+    parser.add_argument('--jit', action='store_true',
+                        help='compile frequently called procedures')
+    parser.add_argument('names', nargs='*', metavar='NAME',
+                        help='programs to run: ' + ', '.join(sorted(PROGRAMS)))
+    args = parser.parse_args()
+    main(args.runs, args.names, args.jit)
@@ -0,0 +1,69 @@
+"""Measure the start-up time of the Scheme interpreter.
+
+Reports the import time of the scheme module and its largest dependencies (as
+measured by python -X importtime), the time to create a global frame, and the
+wall-clock time to run a trivial headless script with scheme.py.
+
+    python benchmarks/startup.py [-n RUNS]
+"""
+
+from __future__ import print_function  # Python 2 compatibility
+
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def import_times():
+    """Return a list of (cumulative microseconds, module) for importing scheme,
+    sorted from slowest to fastest."""
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c',
+                           'import scheme'], cwd=ROOT, stderr=subprocess.PIPE,
+                          universal_newlines=True, check=True)
+    times = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times.append((int(cumulative), name.rstrip()))
+    return sorted(times, reverse=True)
+
+def best_of(runs, fn):
+    """Return the fastest of RUNS calls to FN, in seconds."""
+    best = float('inf')
+    for _ in range(runs):
+        start = time.time()
+        fn()
+        best = min(best, time.time() - start)
+    return best
+
+def main(runs=10):
+    times = import_times()
+    print('import scheme: {0:.1f} ms'.format(times[0][0] / 1000))
+    for cumulative, name in times[1:11]:
+        print('  {0:8.1f} ms  {1}'.format(cumulative / 1000, name))
+
+    sys.path.insert(0, ROOT)
+    import scheme
+    frame = best_of(runs, scheme.create_global_frame)
+    print('create_global_frame: {0:.1f} us'.format(frame * 1e6))
+
+    with tempfile.NamedTemporaryFile('w', suffix='.scm', delete=False) as f:
+        f.write('(define (square x) (* x x))\n(square 12)\n')
+    try:
+        command = [sys.executable, os.path.join(ROOT, 'scheme.py'), f.name]
+        run = best_of(runs, lambda: subprocess.run(
+            command, stdout=subprocess.DEVNULL, check=True))
+        print('python scheme.py script.scm: {0:.1f} ms'.format(run * 1000))
+    finally:
+        os.remove(f.name)
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-n', '--runs', type=int, default=10,
+                        help='number of runs to take the best of')
+    main(parser.parse_args().runs)
@@ -0,0 +1,80 @@
+"""Measure how evaluation scales with interpreters running on threads.
+
+Runs a Scheme program in one interpreter per thread, for each of several
+thread counts, and reports the programs evaluated per second and the speedup
+over one thread.  Interpreters share no state that evaluation changes, so on
+a free-threaded build of CPython (python3.13t and later, run with the GIL
+disabled) the speedup approaches the number of cores; with the GIL it stays
+near 1.
+
+    python benchmarks/threads.py [-n RUNS] [--jit] [THREADS ...]
+"""
+
+from __future__ import print_function  # Python 2 compatibility
+
+import os
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROGRAM = '''
+    (define (range a b) (if (>= a b) nil (cons a (range (+ a 1) b))))
+    (define (fib n) (if (< n 2) n (+ (fib (- n 1)) (fib (- n 2)))))
+    (define (sum s) (if (null? s) 0 (+ (car s) (sum (cdr s)))))
+    (+ (fib 15) (sum (map (lambda (x) (* x x)) (range 0 100))))
+'''
+
+def gil_enabled():
+    """Return whether the global interpreter lock is enabled."""
+    is_gil_enabled = getattr(sys, '_is_gil_enabled', None)
+    return True if is_gil_enabled is None else is_gil_enabled()
+
+def rate(threads, runs, jit):
+    """Return the number of times per second that THREADS threads, each with
+    its own interpreter, evaluate PROGRAM, when each evaluates it RUNS times."""
+    import scheme
+    program = scheme.Interpreter().parse(PROGRAM)
+    interpreters = [scheme.Interpreter(jit=jit) for _ in range(threads)]
+    start = threading.Barrier(threads + 1)
+    def work(interpreter):
+        start.wait()
+        for _ in range(runs):
+            interpreter.eval(program)
+    workers = [threading.Thread(target=work, args=(interpreter,))
+               for interpreter in interpreters]
+    for worker in workers:
+        worker.start()
+    start.wait()
+    began = time.time()
+    for worker in workers:
+        worker.join()
+    return threads * runs / (time.time() - began)
+
+def main(runs=20, counts=(), jit=False):
+    sys.path.insert(0, ROOT)
+    cores = os.cpu_count() or 1
+    if not counts:
+        counts = sorted(set([1, 2, 4, cores]))
+    print('GIL {0}, {1} cores'.format(
+        'enabled' if gil_enabled() else 'disabled', cores))
+    base = None
+    for threads in counts:
+        per_second = rate(threads, runs, jit)
+        base = base or per_second
+        print('{0:3} threads {1:9.1f} programs/s {2:6.2f}x'.format(
+            threads, per_second, per_second / base))
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-n', '--runs', type=int, default=20,
+                        help='evaluations of the program on each thread')
+    parser.add_argument('--jit', action='store_true',
+                        help='compile frequently called procedures')
+    parser.add_argument('threads', nargs='*', type=int, metavar='THREADS',
+                        help='thread counts to run (default: 1, 2, 4 and '
+                             'the number of cores)')
+    args = parser.parse_args()
+    main(args.runs, args.threads, args.jit)
@@ -2,6 +2,7 @@
 
 from __future__ import print_function  # Python 2 compatibility
 
+import collections
 import math
 import sys
 
@@ -27,8 +28,9 @@ class Buffer(object):
     In addition, Buffer provides a current method to look at the
     next item to be supplied, without sequencing past it.
 
-    The __str__ method prints all tokens read so far, up to the end of the
-    current line, and marks the current token with >>.
+    The __str__ method prints the tokens of the current line and up to
+    HISTORY lines before it, and marks the current token with >>.  Only those
+    lines are kept, so a Buffer uses constant memory however long its source.
 
     >>> buf = Buffer(iter([['(', '+'], [15], [12, ')']]))
     >>> buf.pop_first()
@@ -57,10 +59,18 @@ class Buffer(object):
     2: 15
     3: 12 ) >>
     >>> buf.pop_first()  # returns None
+
+    With a HISTORY of 0, only the current line is kept and printed.
+
+    >>> buf = Buffer(iter([['(', '+'], [15], [12, ')']]), history=0)
+    >>> for _ in range(4): _ = buf.pop_first()
+    >>> print(buf)
+    3: 12 >> )
     """
-    def __init__(self, source):
+    def __init__(self, source, history=3):
         self.index = 0
-        self.lines = []
+        self.lines = collections.deque(maxlen=history + 1)
+        self.line_number = 0  # The number of lines read from the source
         self.source = source
         self.current_line = ()
         self.current()
@@ -79,6 +89,7 @@ class Buffer(object):
             try:
                 self.current_line = next(self.source)
                 self.lines.append(self.current_line)
+                self.line_number += 1
             except StopIteration:
                 self.current_line = ()
                 return None
@@ -91,13 +102,14 @@ class Buffer(object):
     def __str__(self):
         """Return recently read contents; current element marked with >>."""
         # Format string for right-justified line numbers
-        n = len(self.lines)
+        n = self.line_number
         msg = '{0:>' + str(math.floor(math.log10(n))+1) + "}: "
 
-        # Up to three previous lines and current line are included in output
+        # The previous lines that are kept and the current line are included
         s = ''
-        for i in range(max(0, n-4), n-1):
-            s += msg.format(i+1) + ' '.join(map(str, self.lines[i])) + '\n'
+        previous = list(self.lines)[:-1]
+        for i, line in enumerate(previous, n - len(previous)):
+            s += msg.format(i) + ' '.join(map(str, line)) + '\n'
         s += msg.format(n)
         s += ' '.join(map(str, self.current_line[:self.index]))
         s += ' >> '
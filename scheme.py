@@ -1,8 +1,21 @@
 """A Scheme interpreter and its read-eval-print loop."""
 from __future__ import print_function  # Python 2 compatibility
 
+import collections
+import sys
+import weakref
+
+# When this file is run as a script, make "import scheme" in other modules
+# refer to it, rather than executing a second copy of the interpreter.
+if __name__ in ('__main__', '__mp_main__'):
+    sys.modules.setdefault('scheme', sys.modules[__name__])
+
 from scheme_builtins import *
 from scheme_reader import *
+from scheme_parallel import scheme_future, scheme_pmap, scheme_touch
+import scheme_parallel
+import scheme_pickle
+import scheme_ports
 from ucb import main, trace
 
 ##############
@@ -33,25 +46,33 @@ def scheme_eval(expr, env, _=None): # Optional third argument is ignored
         return SPECIAL_FORMS[first](rest, env)
     else:
         # BEGIN PROBLEM 4
-        operator = scheme_eval(first, env)
-        check_procedure(operator)
-        operands = rest.map(lambda x: scheme_eval(x, env))
-        return scheme_apply(operator, operands, env)
+        if scheme_symbolp(first):
+            operator = lookup_site(expr, env)
+        else:
+            operator = scheme_eval(first, env)
+        # Each call site caches the type of procedure that it last called
+        try:
+            kind, entry = expr.dispatch
+        except AttributeError:
+            kind = None
+        if type(operator) is not kind:
+            check_procedure(operator)
+            kind = type(operator)
+            entry = kind.eval_call
+            expr.dispatch = (kind, entry)
+        return entry(operator, rest, env)
         # END PROBLEM 4
 
 def self_evaluating(expr):
     """Return whether EXPR evaluates to itself."""
-    return (scheme_atomp(expr) and not scheme_symbolp(expr)) or expr is None
+    return ((scheme_atomp(expr) and not scheme_symbolp(expr)) or
+            scheme_vectorp(expr) or expr is None)
 
 def scheme_apply(procedure, args, env):
     """Apply Scheme PROCEDURE to argument values ARGS (a Scheme list) in
     environment ENV."""
     check_procedure(procedure)
-    if isinstance(procedure, BuiltinProcedure):
-        return procedure.apply(args, env)
-    else:
-        new_env = procedure.make_call_frame(args, env)
-        return eval_all(procedure.body, new_env)
+    return procedure.apply(args, env)
 
 
 def eval_all(expressions, env):
@@ -69,10 +90,61 @@ def eval_all(expressions, env):
 
     # END PROBLEM 7
 
+def eval_operands(operands, env):
+    """Return a Scheme list of the values of the Scheme list OPERANDS in ENV."""
+    return scheme_list(*operand_values(operands, env))
+
+def operand_values(operands, env):
+    """Return a Python list of the values of the Scheme list OPERANDS in ENV."""
+    values = []
+    while operands is not nil:
+        if scheme_symbolp(operands.first):
+            values.append(lookup_site(operands, env))
+        else:
+            values.append(scheme_eval(operands.first, env))
+        operands = operands.rest
+    return values
+
+def lookup_site(site, env):
+    """Return the value in ENV of the symbol SITE.first, where SITE is a Pair in
+    a Scheme expression.  SITE caches the global cell of the symbol, or the
+    version of the global frame in which the symbol had no global binding, so
+    that later lookups of a global need not search every enclosing frame.
+
+    >>> env = create_global_frame()
+    >>> site = read_line('(car x)')
+    >>> print(lookup_site(site, env))
+    #[car]
+    >>> site.cache[2].value is env.lookup('car')
+    True
+    """
+    globals = env.globals
+    try:
+        frame, version, cell = site.cache
+    except AttributeError:
+        frame = None
+    if frame is globals and (cell is not None or version == globals.version):
+        if cell is None or cell.shadowed:
+            return env.lookup(site.first)
+        return cell.value
+    cell = globals.global_cell(site.first)
+    site.cache = (globals, globals.version, cell)
+    if cell is None or cell.shadowed:
+        return env.lookup(site.first)
+    return cell.value
+
 ################
 # Environments #
 ################
 
+class Cell(object):
+    """The VALUE of a global binding, which is shared by every reference to it.
+    A cell is SHADOWED once its name is bound in any local frame."""
+
+    def __init__(self, value, shadowed=False):
+        self.value = value
+        self.shadowed = shadowed
+
 class Frame(object):
     """An environment frame binds Scheme symbols to Scheme values."""
 
@@ -80,6 +152,26 @@ class Frame(object):
         """An empty frame with parent frame PARENT (which may be None)."""
         self.bindings = {}
         self.parent = parent
+        self.captured = parent is None
+        self.watchers = None  # Closure frames to copy definitions to
+        if parent is None:
+            self.globals = self
+            self.cells = {}
+            self.local_names = set()  # Names bound in any local frame
+            self.version = 0  # Incremented when a new global name is bound
+            self.definitions = 0  # Incremented when any global name is bound
+            self.flat_closures = False
+            self.jit = False
+            self.output = scheme_ports.OutputPort()  # The current output port
+            self.graphics = Graphics()  # The turtle and pixels
+            self.free_frames = []  # See new_frame
+        else:
+            self.globals = parent.globals
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['watchers'] = None
+        return state
 
     def __repr__(self):
         if self.parent is None:
@@ -92,6 +184,61 @@ class Frame(object):
         # BEGIN PROBLEM 2
         self.bindings[symbol] = value
         # END PROBLEM 2
+        if self.parent is None:
+            self.definitions += 1
+            cell = self.cells.get(symbol)
+            if cell is not None:
+                cell.value = value
+            else:
+                self.version += 1
+        elif symbol not in self.globals.local_names:
+            self.globals.shadow(symbol)
+        if self.watchers is not None and symbol in self.watchers:
+            for frame, distance in list(self.watchers[symbol].items()):
+                frame.copy_binding(symbol, value, distance)
+
+    def watch(self, symbol, frame, distance):
+        """Copy later definitions of SYMBOL in this frame to the closure frame
+        FRAME (see scheme_closures), which is DISTANCE frames away."""
+        if self.watchers is None:
+            self.watchers = {}
+        if symbol not in self.watchers:
+            self.watchers[symbol] = weakref.WeakKeyDictionary()
+        self.watchers[symbol][frame] = distance
+
+    def copy_binding(self, symbol, value, distance):
+        """Bind SYMBOL to VALUE in this closure frame, unless it is bound to a
+        value from a frame nearer than DISTANCE frames away."""
+        if distance <= self.distances.get(symbol, distance):
+            self.distances[symbol] = distance
+            self.define(symbol, value)
+
+    def capture(self):
+        """Record that a value, such as a procedure or promise, refers to this
+        frame and its ancestors, so that they must not be reused."""
+        frame = self
+        while not frame.captured:
+            frame.captured = True
+            frame = frame.parent
+
+    def shadow(self, symbol):
+        """Record that SYMBOL is bound in a local frame of this global frame."""
+        self.local_names.add(symbol)
+        if symbol in self.cells:
+            self.cells[symbol].shadowed = True
+
+    def global_cell(self, symbol):
+        """Return the Cell of SYMBOL in this global frame, or None if SYMBOL is
+        not bound here."""
+        cell = self.cells.get(symbol)
+        if cell is None:
+            try:
+                value = self.bindings[symbol]
+            except KeyError:
+                return None
+            cell = Cell(value, symbol in self.local_names)
+            self.cells[symbol] = cell
+        return cell
 
     def lookup(self, symbol):
         """Return the value bound to SYMBOL. Errors if SYMBOL is not found."""
@@ -102,6 +249,10 @@ class Frame(object):
         elif symbol not in self.bindings and self.parent != None:
             return Frame.lookup(self.parent, symbol)
         # END PROBLEM 2
+        try:
+            return self.bindings[symbol]  # Creates a pending built-in procedure
+        except KeyError:
+            pass
         raise SchemeError('unknown identifier: {0}'.format(symbol))
 
 
@@ -118,7 +269,7 @@ class Frame(object):
         """
         # BEGIN PROBLEM 10
         "*** YOUR CODE HERE ***"
-        self_frame= Frame(self)
+        self_frame= new_frame(self)
         if len(vals)>len(formals) or len(vals)<len(formals):
             raise SchemeError
         while(vals!= nil and formals != nil):
@@ -129,12 +280,78 @@ class Frame(object):
 
         # END PROBLEM 10
 
+# The number of frames whose evaluation has ended and that were never captured
+# that each global frame keeps in its free_frames, to be reused instead of
+# allocating new frames.
+MAX_FREE_FRAMES = 256
+
+def new_frame(parent):
+    """Return an empty frame with parent frame PARENT, reusing a free frame of
+    its global frame if there is one."""
+    try:
+        frame = parent.globals.free_frames.pop()
+    except IndexError:
+        return Frame(parent)
+    frame.parent = parent
+    frame.globals = parent.globals
+    return frame
+
+def release_frame(frame):
+    """Make FRAME, whose evaluation has ended, available for reuse unless it
+    has been captured.
+
+    >>> env = create_global_frame()
+    >>> frame = new_frame(env)
+    >>> frame.define('x', 1)
+    >>> release_frame(frame)
+    >>> new_frame(env) is frame, frame.bindings
+    (True, {})
+    """
+    free_frames = frame.globals.free_frames
+    if not frame.captured and len(free_frames) < MAX_FREE_FRAMES:
+        frame.bindings.clear()
+        frame.parent = frame.globals = frame.watchers = None
+        free_frames.append(frame)
+
 ##############
 # Procedures #
 ##############
 
+def closure_env(site, formals, body, env):
+    """Return the environment of a procedure or promise with FORMALS and BODY
+    created in ENV by the expression SITE.  This is ENV, unless the global
+    frame uses flat closures (see scheme_closures)."""
+    if env.parent is None or not env.globals.flat_closures:
+        return env
+    import scheme_closures
+    return scheme_closures.closure_frame(site, formals, body, env)
+
+# The number of calls after which a procedure is compiled, if the global frame
+# uses the just-in-time compiler (see scheme_jit)
+JIT_THRESHOLD = 100
+
 class Procedure(object):
     """The supertype of all Scheme procedures."""
+    calls = 0  # The number of times that it has been interpreted
+    compiled = None  # A Python function of a Scheme list of arguments
+
+    def apply(self, args, env):
+        """Apply SELF to ARGS, a Scheme list, in ENV by evaluating its body in
+        a new frame."""
+        if self.compiled is not None:
+            return self.compiled(args)
+        self.calls += 1
+        if self.calls == JIT_THRESHOLD and env.globals.jit:
+            import scheme_jit
+            scheme_jit.compile_procedure(self)
+        new_env = self.make_call_frame(args, env)
+        value = eval_all(self.body, new_env)
+        release_frame(new_env)
+        return value
+
+    def eval_call(self, operands, env):
+        """Apply SELF to the values of the Scheme list OPERANDS in ENV."""
+        return self.apply(eval_operands(operands, env), env)
 
 def scheme_procedurep(x):
     return isinstance(x, Procedure)
@@ -166,6 +383,13 @@ class BuiltinProcedure(Procedure):
         while args is not nil:
             python_args.append(args.first)
             args = args.rest
+        return self.call(python_args, env)
+
+    def eval_call(self, operands, env):
+        return self.call(operand_values(operands, env), env)
+
+    def call(self, python_args, env):
+        """Apply SELF to PYTHON_ARGS, a Python list, in ENV."""
         # BEGIN PROBLEM 3
         if self.use_env:
             python_args.append(env)
@@ -186,6 +410,7 @@ class LambdaProcedure(Procedure):
         self.formals = formals
         self.body = body
         self.env = env
+        env.capture()
 
     def make_call_frame(self, args, env):
         """Make a frame that binds my formal parameters to ARGS, a Scheme list
@@ -196,6 +421,12 @@ class LambdaProcedure(Procedure):
 
         # END PROBLEM 11
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('calls', None)
+        state.pop('compiled', None)
+        return state
+
     def __str__(self):
         return str(Pair('lambda', Pair(self.formals, self.body)))
 
@@ -211,12 +442,35 @@ class MacroProcedure(LambdaProcedure):
         """Apply this macro to the operand expressions."""
         return complete_apply(self, operands, env)
 
+class BuiltinBindings(dict):
+    """The bindings of a global frame, in which the built-in procedures entered
+    by add_builtins are only created when their names are first looked up."""
+
+    def __init__(self):
+        dict.__init__(self)
+        self.pending = {}
+
+    def __missing__(self, symbol):
+        fn, proc_name = self.pending.pop(symbol)
+        value = self[symbol] = BuiltinProcedure(fn, fn in USES_ENV, proc_name)
+        return value
+
+    def materialize(self):
+        """Create all pending built-in procedures."""
+        for symbol in list(self.pending):
+            self[symbol]
+
 def add_builtins(frame, funcs_and_names):
     """Enter bindings in FUNCS_AND_NAMES into FRAME, an environment frame,
     as built-in procedures. Each item in FUNCS_AND_NAMES has the form
-    (NAME, PYTHON-FUNCTION, INTERNAL-NAME)."""
+    (NAME, PYTHON-FUNCTION, INTERNAL-NAME). If FRAME has BuiltinBindings, each
+    procedure is created when it is first looked up."""
+    pending = getattr(frame.bindings, 'pending', None)
     for name, fn, proc_name in funcs_and_names:
-        frame.define(name, BuiltinProcedure(fn, name=proc_name))
+        if pending is not None and name not in frame.bindings:
+            pending[name] = (fn, proc_name)
+        else:
+            frame.define(name, BuiltinProcedure(fn, fn in USES_ENV, proc_name))
 
 #################
 # Special Forms #
@@ -241,7 +495,8 @@ def do_define_form(expressions, env):
     elif isinstance(target, Pair) and scheme_symbolp(target.first):
         # BEGIN PROBLEM 9
         "*** YOUR CODE HERE ***"
-        value= LambdaProcedure(target.rest, expressions.rest, env)
+        closure = closure_env(expressions, target.rest, expressions.rest, env)
+        value= LambdaProcedure(target.rest, expressions.rest, closure)
         env.define(target.first,value)
         return target.first
         # END PROBLEM 9
@@ -268,6 +523,7 @@ def do_lambda_form(expressions, env):
     formals = expressions.first
     check_formals(formals)
     # BEGIN PROBLEM 8
+    env = closure_env(expressions, formals, expressions.rest, env)
     return LambdaProcedure(formals, expressions.rest, env)
     # END PROBLEM 8
 
@@ -337,7 +593,9 @@ def do_let_form(expressions, env):
     """Evaluate a let form."""
     check_form(expressions, 2)
     let_env = make_let_frame(expressions.first, env)
-    return eval_all(expressions.rest, let_env)
+    value = eval_all(expressions.rest, let_env)
+    release_frame(let_env)
+    return value
 
 def make_let_frame(bindings, env):
     """Create a child frame of ENV that contains the definitions given in
@@ -348,16 +606,18 @@ def make_let_frame(bindings, env):
         raise SchemeError('bad bindings list in let form')
     # BEGIN PROBLEM 14
     "*** YOUR CODE HERE ***"
-    first_bind,exp,arg=nil,nil,nil
-    
+    let_env = new_frame(env)
     while bindings is not nil:
-        first_bind=bindings.first
-        check_form(first_bind,2,2)
-        exp,arg= Pair(first_bind.first, exp),Pair(scheme_eval(first_bind.rest.first, env), arg) # creating a new pair object
-        check_formals(exp)
-        bindings=bindings.rest
-
-    return env.make_child_frame(exp, arg)
+        binding = bindings.first
+        check_form(binding, 2, 2)
+        name, value = binding.first, scheme_eval(binding.rest.first, env)
+        if not scheme_symbolp(name):
+            raise SchemeError('non-symbol: {0}'.format(name))
+        if name in let_env.bindings:
+            raise SchemeError('duplicate symbol: {0}'.format(name))
+        let_env.define(name, value)
+        bindings = bindings.rest
+    return let_env
     # END PROBLEM 14
 
 def do_define_macro(expressions, env):
@@ -511,6 +771,7 @@ class Promise(object):
     def __init__(self, expression, env):
         self.expression = expression
         self.env = env
+        env.capture()
 
     def evaluate(self):
         if self.expression is not None:
@@ -518,7 +779,7 @@ class Promise(object):
             if not (value is nil or isinstance(value, Pair)):
                 raise SchemeError("result of forcing a promise should be a pair or nil, but was %s" % value)
             self.value = value
-            self.expression = None
+            self.expression = self.env = None
         return self.value
 
     def __str__(self):
@@ -528,6 +789,7 @@ class Promise(object):
 def do_delay_form(expressions, env):
     """Evaluates a delay form."""
     check_form(expressions, 1, 1)
+    env = closure_env(expressions, nil, expressions, env)
     return Promise(expressions.first, env)
 
 def do_cons_stream_form(expressions, env):
@@ -621,13 +883,197 @@ def scheme_reduce(fn, s, env):
         s = s.rest
     return value
 
+def scheme_sort(s, less, *args):
+    """Return a copy of S, a list or vector, sorted stably by the procedure
+    LESS.  ARGS are an optional procedure KEY and the environment.  With a
+    KEY, elements are ordered by their keys, each computed once.
+
+    >>> env = create_global_frame()
+    >>> print(scheme_eval(read_line("(sort '((b 2) (a 3) (c 1)) < (lambda (x) (car (cdr x))))"), env))
+    ((c 1) (b 2) (a 3))
+    >>> scheme_eval(read_line("(sort #(3 1 2) (lambda (x y) (> x y)))"), env)
+    Vector([3, 2, 1])
+    """
+    if not 1 <= len(args) <= 2:
+        raise SchemeError('sort takes 2 or 3 arguments')
+    key, env = args[0] if len(args) == 2 else None, args[-1]
+    check_type(less, scheme_procedurep, 1, 'sort')
+    vector = scheme_vectorp(s)
+    if vector:
+        items = list(s.items)
+    else:
+        check_type(s, scheme_listp, 0, 'sort')
+        items = []
+        while s is not nil:
+            items.append(s.first)
+            s = s.rest
+    keys = items
+    if key is not None:
+        check_type(key, scheme_procedurep, 2, 'sort')
+        if type(key) is BuiltinProcedure and not key.use_env:
+            keys = [key.call([item], env) for item in items]
+        else:
+            keys = [complete_apply(key, Pair(item, nil), env) for item in items]
+    order = list(range(len(items)))
+    native = _NATIVE_ORDERS.get(getattr(less, 'fn', None))
+    if (native is not None and type(less) is BuiltinProcedure and
+            all(scheme_numberp(k) for k in keys)):
+        order.sort(key=keys.__getitem__, reverse=native == 'descending')
+    else:
+        order.sort(key=lambda i: _SortKey(keys[i], less, env))
+    items = [items[i] for i in order]
+    return Vector(items) if vector else scheme_list(*items)
+
+# Comparisons of numbers that sort performs with Python's own ordering
+_NATIVE_ORDERS = {scheme_lt: 'ascending', scheme_gt: 'descending'}
+
+class _SortKey(object):
+    """Orders VALUE before another _SortKey when the Scheme procedure LESS
+    applied to their values in ENV is true."""
+    __slots__ = ('value', 'less', 'env')
+
+    def __init__(self, value, less, env):
+        self.value, self.less, self.env = value, less, env
+
+    def __lt__(self, other):
+        args = Pair(self.value, Pair(other.value, nil))
+        return complete_apply(self.less, args, self.env) is not False
+
+#################
+# Continuations #
+#################
+
+# Continuations are one-shot escape continuations: calling one returns from the
+# call/cc that created it, which must not have returned already.
+
+class ControlFlow(Exception):
+    """An exception that transfers control within a Scheme program rather than
+    reporting an error, so that handlers of SchemeError do not catch it."""
+
+class ContinuationInvoked(ControlFlow):
+    """Raised to return VALUE from the call/cc that created CONTINUATION."""
+
+    def __init__(self, continuation, value):
+        ControlFlow.__init__(self, continuation, value)
+        self.continuation = continuation
+        self.value = value
+
+    def __str__(self):
+        return 'continuation invoked outside of its call/cc'
+
+class Continuation(BuiltinProcedure):
+    """An escape continuation created by call/cc."""
+
+    def __init__(self):
+        BuiltinProcedure.__init__(self, self.invoke, False, 'continuation')
+        self.active = True
+
+    def invoke(self, value=None):
+        if not self.active:
+            raise SchemeError('continuation invoked after its call/cc returned')
+        raise ContinuationInvoked(self, value)
+
+def scheme_call_cc(procedure, env):
+    """Apply PROCEDURE to an escape continuation for this call.
+
+    >>> env = create_global_frame()
+    >>> scheme_eval(read_line('(+ 1 (call/cc (lambda (k) (* 10 (k 2)))))'), env)
+    3
+
+    Calling a continuation returns through the procedures that handle errors,
+    such as load, without being reported:
+
+    >>> import os, tempfile
+    >>> filename = os.path.join(tempfile.mkdtemp(), 'escape.scm')
+    >>> with open(filename, 'w') as f:
+    ...     _ = f.write('(k 5)\\n(display "not reached")')
+    >>> interpreter = Interpreter()
+    >>> interpreter.eval('(call/cc (lambda (k) (load "{0}")))'.format(filename))
+    5
+    """
+    check_type(procedure, scheme_procedurep, 0, 'call/cc')
+    continuation = Continuation()
+    try:
+        return complete_apply(procedure, Pair(continuation, nil), env)
+    except ContinuationInvoked as invoked:
+        if invoked.continuation is not continuation:
+            raise
+        return invoked.value
+    finally:
+        continuation.active = False
+
+def scheme_dynamic_wind(before, thunk, after, env):
+    """Call BEFORE, THUNK and AFTER, calling AFTER however THUNK exits."""
+    for i, procedure in enumerate((before, thunk, after)):
+        check_type(procedure, scheme_procedurep, i, 'dynamic-wind')
+    complete_apply(before, nil, env)
+    try:
+        return complete_apply(thunk, nil, env)
+    finally:
+        complete_apply(after, nil, env)
+
+#################
+# Green Threads #
+#################
+
+# (spawn THUNK) starts a task that calls THUNK, scheduled by the scheduler of
+# the global frame (see scheme_tasks).  Tasks take turns running for a slice of
+# steps and switch at (yield) or when receiving from an empty channel.  Code
+# that is not running in a task runs the tasks when it yields or waits.
+
+class Channel(object):
+    """A queue of values sent from one task to another."""
+
+    def __init__(self):
+        self.items = collections.deque()
+        self.receivers = collections.deque()  # Blocked tasks
+
+    def __str__(self):
+        return '#[channel]'
+
+    def send(self, value):
+        self.items.append(value)
+        if self.receivers:
+            task = self.receivers.popleft()
+            task.scheduler.wake(task)
+
+def scheme_spawn(thunk, env):
+    import scheme_tasks
+    check_type(thunk, scheme_procedurep, 0, 'spawn')
+    return scheme_tasks.scheduler(env).spawn(thunk, env)
+
+def scheme_yield(env):
+    import scheme_tasks
+    scheme_tasks.scheduler(env).run_round()
+
+def scheme_make_channel():
+    return Channel()
+
+def scheme_channel_send(channel, value):
+    check_type(channel, lambda x: isinstance(x, Channel), 0, 'channel-send')
+    channel.send(value)
+
+def scheme_channel_receive(channel, env):
+    import scheme_tasks
+    check_type(channel, lambda x: isinstance(x, Channel), 0, 'channel-receive')
+    scheduler = scheme_tasks.scheduler(env)
+    while not channel.items:
+        if scheduler.running is not None or not scheduler.ready:
+            raise SchemeError('deadlock: no task can send on the channel')
+        scheduler.run_slice()
+    return channel.items.popleft()
+
 ################
 # Input/Output #
 ################
 
 def read_eval_print_loop(next_line, env, interactive=False, quiet=False,
-                         startup=False, load_files=(), report_errors=False):
-    """Read and evaluate input until an end of file or keyboard interrupt."""
+                         startup=False, load_files=(), report_errors=False,
+                         optimize=False):
+    """Read and evaluate input until an end of file or keyboard interrupt.
+    If OPTIMIZE, each expression is simplified by scheme_optimize first."""
+    if optimize:
+        import scheme_optimize
     if startup:
         for filename in load_files:
             scheme_load(filename, True, env)
@@ -636,32 +1082,65 @@ def read_eval_print_loop(next_line, env, interactive=False, quiet=False,
             src = next_line()
             while src.more_on_line:
                 expression = scheme_read(src)
+                if optimize:
+                    expression = scheme_optimize.optimize(expression, env)
                 result = scheme_eval(expression, env)
                 if not quiet and result is not None:
-                    print(repl_str(result))
+                    print(repl_str(result), file=env.globals.output)
+                env.globals.output.flush()
         except (SchemeError, SyntaxError, ValueError, RuntimeError) as err:
             if report_errors:
                 if isinstance(err, SyntaxError):
                     err = SchemeError(err)
                     raise err
-            if (isinstance(err, RuntimeError) and
-                'maximum recursion depth exceeded' not in getattr(err, 'args')[0]):
-                raise
-            elif isinstance(err, RuntimeError):
-                print('Error: maximum recursion depth exceeded')
-            else:
-                print('Error:', err)
+            report_error(err, _repl_output(env))
         except KeyboardInterrupt:  # <Control>-C
             if not startup:
                 raise
-            print()
-            print('KeyboardInterrupt')
+            output = _repl_output(env)
+            print(file=output)
+            print('KeyboardInterrupt', file=output)
+            output.flush()
             if not interactive:
                 return
         except EOFError:  # <Control>-D, etc.
-            print()
+            output = _repl_output(env)
+            print(file=output)
+            output.flush()
             return
 
+def _repl_output(env):
+    """Return the current output port of ENV, or a port to the standard output
+    if the program has closed it.
+
+    >>> env = create_global_frame()
+    >>> env.output = scheme_ports.StringPort()
+    >>> lines = ['(close-port (current-output-port)) (car nil)']
+    >>> read_eval_print_loop(lambda: buffer_lines(lines, None), env)
+    Error: argument 0 of car has wrong type (nil)
+    <BLANKLINE>
+    """
+    if env.globals.output.closed:
+        return scheme_ports.OutputPort()
+    return env.globals.output
+
+def report_error(err, port=None):
+    """Print the error ERR raised while evaluating to PORT, an output port, or
+    to the standard output if PORT is None.  Raise ERR instead if it is a
+    RuntimeError other than exceeding the recursion limit.  The error is
+    printed to the standard output if PORT is closed."""
+    if port is not None and port.closed:
+        port = None
+    if (isinstance(err, RuntimeError) and
+        'maximum recursion depth exceeded' not in getattr(err, 'args')[0]):
+        raise err
+    elif isinstance(err, RuntimeError):
+        print('Error: maximum recursion depth exceeded', file=port)
+    else:
+        print('Error:', err, file=port)
+    if port is not None:
+        port.flush()
+
 def scheme_load(*args):
     """Load a Scheme source file. ARGS should be of the form (SYM, ENV) or
     (SYM, QUIET, ENV). The file named SYM is loaded into environment ENV,
@@ -687,15 +1166,46 @@ def scheme_load(*args):
 def scheme_load_all(directory, env):
     """
     Loads all .scm files in the given directory, alphabetically. Used only
-        in tests/ code.
+        in tests/ code.  The files are read and parsed in parallel (see
+        scheme_parallel.parse_files) and then evaluated in order.  As with
+        load, (exit) ends only the file that calls it.
+
+    >>> import os, tempfile
+    >>> directory = tempfile.mkdtemp()
+    >>> for name, source in [('a.scm', '(define x 1) (display x)'),
+    ...                      ('b.scm', '(exit) (display "skipped")'),
+    ...                      ('c.scm', '(display (+ x 1)) (car nil) (display 3)'),
+    ...                      ('d.scm', '(sqrt -1) (display 4)'),
+    ...                      ('e.txt', '(display "not loaded")')]:
+    ...     with open(os.path.join(directory, name), 'w') as f:
+    ...         _ = f.write(source)
+    >>> Interpreter().eval('(load-all "{0}")'.format(directory))
+    12Error: argument 0 of car has wrong type (nil)
+    3Error: math domain error
+    4
     """
     assert scheme_stringp(directory)
     directory = eval(directory)
     import os
-    for x in sorted(os.listdir(".")):
-        if not x.endswith(".scm"):
-            continue
-        scheme_load(x, env)
+    try:
+        names = sorted(os.listdir(directory))
+    except OSError as exc:
+        raise SchemeError(str(exc))
+    filenames = [os.path.join(directory, x) for x in names if x.endswith(".scm")]
+    for forms in scheme_parallel.parse_files(filenames):
+        try:
+            for form in forms:
+                if isinstance(form, SyntaxError):
+                    raise SchemeError(form)
+                elif isinstance(form, ValueError):
+                    print('Error:', form, file=env.globals.output)
+                    continue
+                try:
+                    scheme_eval(form, env)
+                except (SchemeError, ValueError, RuntimeError) as err:
+                    report_error(err, env.globals.output)
+        except EOFError:  # (exit) ends the file
+            pass
 
 def scheme_open(filename):
     """If either FILENAME or FILENAME.scm is the name of a valid file,
@@ -710,9 +1220,57 @@ def scheme_open(filename):
     except IOError as exc:
         raise SchemeError(str(exc))
 
+IMAGE_HEADER = b'scheme-image 4\n'
+
+def scheme_save_image(filename, env):
+    """Save the bindings of the global frame of ENV, including procedures and
+    the frames they close over, to the file named by the string FILENAME.
+    Bindings whose values cannot be saved, such as ports to files, are
+    omitted with a warning that names them.
+
+    >>> import os, subprocess, tempfile
+    >>> image = os.path.join(tempfile.mkdtemp(), 'test.image')
+    >>> interp = Interpreter()
+    >>> interp.eval('(define (square x) (* x x)) (define n (square 4)) '
+    ...             '(define log (open-output-file "{0}.log"))'.format(image))
+    'log'
+    >>> interp.eval('(save-image "{0}")'.format(image))
+    warning: save-image omitted bindings that cannot be saved: log
+    >>> run = subprocess.run([sys.executable, __file__, '--image', image],
+    ...                      input='(square n)', stdout=subprocess.PIPE,
+    ...                      universal_newlines=True)
+    >>> run.stdout.split()
+    ['scm>', '256', 'scm>']
+    """
+    check_type(filename, scheme_stringp, 0, 'save-image')
+    omitted = []
+    data = scheme_pickle.dump_bindings(env, omitted)
+    try:
+        with open(eval(filename), 'wb') as outfile:
+            outfile.write(IMAGE_HEADER)
+            outfile.write(data)
+    except IOError as exc:
+        raise SchemeError(str(exc))
+    if omitted:
+        print('warning: save-image omitted bindings that cannot be saved:',
+              ', '.join(sorted(omitted)), file=env.globals.output)
+
+def load_image(filename, env):
+    """Define the bindings saved by save-image in FILENAME in the global frame
+    of ENV."""
+    try:
+        with open(filename, 'rb') as infile:
+            if infile.readline() != IMAGE_HEADER:
+                raise SchemeError('not a Scheme image: {0}'.format(filename))
+            data = infile.read()
+    except IOError as exc:
+        raise SchemeError(str(exc))
+    scheme_pickle.load_bindings(data, env)
+
 def create_global_frame():
     """Initialize and return a single-frame environment with built-in names."""
     env = Frame(None)
+    env.bindings = BuiltinBindings()
     env.define('eval',
                BuiltinProcedure(scheme_eval, True, 'eval'))
     env.define('apply',
@@ -729,10 +1287,243 @@ def create_global_frame():
                BuiltinProcedure(scheme_filter, True, 'filter'))
     env.define('reduce',
                BuiltinProcedure(scheme_reduce, True, 'reduce'))
+    env.define('sort',
+               BuiltinProcedure(scheme_sort, True, 'sort'))
+    env.define('future',
+               BuiltinProcedure(scheme_future, True, 'future'))
+    env.define('touch',
+               BuiltinProcedure(scheme_touch, True, 'touch'))
+    env.define('pmap',
+               BuiltinProcedure(scheme_pmap, True, 'pmap'))
+    env.define('display',
+               BuiltinProcedure(scheme_ports.scheme_display, True, 'display'))
+    env.define('print',
+               BuiltinProcedure(scheme_ports.scheme_print, True, 'print'))
+    env.define('newline',
+               BuiltinProcedure(scheme_ports.scheme_newline, True, 'newline'))
+    env.define('flush-output',
+               BuiltinProcedure(scheme_ports.scheme_flush_output, True,
+                                'flush-output'))
+    env.define('current-output-port',
+               BuiltinProcedure(scheme_ports.scheme_current_output_port, True,
+                                'current-output-port'))
+    env.define('with-output-to-string',
+               BuiltinProcedure(scheme_ports.scheme_with_output_to_string, True,
+                                'with-output-to-string'))
+    env.define('file->stream',
+               BuiltinProcedure(scheme_ports.scheme_file_to_stream, True,
+                                'file->stream'))
+    env.define('call/cc',
+               BuiltinProcedure(scheme_call_cc, True, 'call/cc'))
+    env.define('call-with-current-continuation',
+               BuiltinProcedure(scheme_call_cc, True, 'call/cc'))
+    env.define('dynamic-wind',
+               BuiltinProcedure(scheme_dynamic_wind, True, 'dynamic-wind'))
+    env.define('spawn',
+               BuiltinProcedure(scheme_spawn, True, 'spawn'))
+    env.define('yield',
+               BuiltinProcedure(scheme_yield, True, 'yield'))
+    env.define('make-channel',
+               BuiltinProcedure(scheme_make_channel, False, 'make-channel'))
+    env.define('channel-send',
+               BuiltinProcedure(scheme_channel_send, False, 'channel-send'))
+    env.define('channel-receive',
+               BuiltinProcedure(scheme_channel_receive, True, 'channel-receive'))
+    env.define('save-image',
+               BuiltinProcedure(scheme_save_image, True, 'save-image'))
     env.define('undefined', None)
     add_builtins(env, BUILTINS)
     return env
 
+#############
+# Embedding #
+#############
+
+class Symbol(str):
+    """The Python value of a Scheme symbol, which is distinct from the Python
+    value of a Scheme string, a str."""
+
+    def __repr__(self):
+        return 'Symbol({0})'.format(str.__repr__(self))
+
+class Program(object):
+    """A parsed Scheme program: a list of EXPRESSIONS that can be evaluated
+    any number of times, in any number of interpreters."""
+
+    def __init__(self, expressions):
+        self.expressions = expressions
+
+    def __len__(self):
+        return len(self.expressions)
+
+    def __iter__(self):
+        return iter(self.expressions)
+
+    def __str__(self):
+        return '\n'.join(repl_str(expr) for expr in self.expressions)
+
+    def __repr__(self):
+        return 'Program({0!r})'.format(self.expressions)
+
+class Interpreter(object):
+    """A Scheme interpreter with its own global frame, for use from Python.
+    Nothing is printed except by the output procedures of Scheme programs.
+
+    >>> interp = Interpreter()
+    >>> rule = interp.parse('(define (score x) (* x x)) (score n)')
+    >>> interp.define('n', 12)
+    >>> interp.eval(rule)
+    144
+    >>> interp.eval_many([rule, '(list 1 "two" (quote three) #t)'])
+    [144, Pair(1, Pair('"two"', Pair('three', Pair(True, nil))))]
+    >>> interp.to_python(interp.eval('(list 1 "two" (quote three) #t)'))
+    [1, 'two', Symbol('three'), True]
+    >>> print(interp.from_python([1, 'two', Symbol('three'), True]))
+    (1 "two" three #t)
+    >>> interp.to_python(interp.eval('(vector 1 (list "a") (vector))'))
+    (1, ['a'], ())
+    >>> print(interp.from_python((1, ['a'], ())))
+    #(1 ("a") #())
+    >>> interp.apply('score', 3)
+    9
+
+    Each interpreter keeps its state in its global frame, so interpreters on
+    different threads do not interfere:
+
+    >>> import threading
+    >>> def run(k, results):
+    ...     interp = Interpreter()
+    ...     interp.env.graphics.turtle_output = 'unused.svg'
+    ...     interp.define('k', k)
+    ...     for _ in range(20):
+    ...         results[k].append(interp.eval('''
+    ...             (define (count n) (if (= n 0) k (+ 1 (count (- n 1)))))
+    ...             (pixelsize (+ k 1))
+    ...             (forward k)
+    ...             (with-output-to-string (lambda ()
+    ...               (display (list (count 50) (screen_width)))))'''))
+    ...     results[k].append(interp.env.graphics.turtle.y)
+    >>> results = dict((k, []) for k in range(8))
+    >>> threads = [threading.Thread(target=run, args=(k, results)) for k in results]
+    >>> for thread in threads: thread.start()
+    >>> for thread in threads: thread.join()
+    >>> all(results[k] == ['"({0} {1})"'.format(50 + k, 800 // (k + 1))] * 20 +
+    ...     [20.0 * k] for k in results)
+    True
+    """
+
+    def __init__(self, env=None, optimize=False, flat_closures=False,
+                 jit=False):
+        self.env = create_global_frame() if env is None else env
+        self.optimize = optimize
+        if flat_closures:
+            self.env.globals.flat_closures = True
+        if jit:
+            self.env.globals.jit = True
+
+    def parse(self, source):
+        """Return a Program of all expressions in the string SOURCE, which are
+        simplified by scheme_optimize if this interpreter optimizes.
+
+        >>> try:
+        ...     Interpreter().parse("(define x 1) '")
+        ... except SchemeError as err:
+        ...     print(err)
+        unexpected end of file
+        """
+        expressions = []
+        try:
+            src = Buffer(tokenize_lines(source.splitlines()))
+            while src.current() is not None:
+                expressions.append(scheme_read(src))
+        except (SyntaxError, ValueError) as err:
+            raise SchemeError(err)
+        except EOFError:
+            raise SchemeError('unexpected end of file')
+        if self.optimize:
+            import scheme_optimize
+            expressions = [scheme_optimize.optimize(expr, self.env)
+                           for expr in expressions]
+        return Program(expressions)
+
+    def eval(self, program):
+        """Evaluate PROGRAM, a Program or source string, and return the value
+        of its last expression."""
+        if not isinstance(program, Program):
+            program = self.parse(program)
+        result = None
+        try:
+            for expr in program.expressions:
+                result = scheme_eval(expr, self.env)
+        finally:
+            self.env.globals.output.flush()
+        return result
+
+    def eval_many(self, programs):
+        """Evaluate each of PROGRAMS in turn and return a list of values."""
+        return [self.eval(program) for program in programs]
+
+    def define(self, name, value):
+        """Bind NAME to the Scheme value of the Python VALUE."""
+        self.env.define(name, self.from_python(value))
+
+    def lookup(self, name):
+        """Return the Scheme value bound to NAME."""
+        return self.env.lookup(name)
+
+    def apply(self, procedure, *args):
+        """Apply PROCEDURE, a Scheme procedure or the name of one, to the
+        Scheme values of the Python ARGS and return the result."""
+        if scheme_symbolp(procedure):
+            procedure = self.env.lookup(procedure)
+        check_procedure(procedure)
+        return complete_apply(procedure, self.from_python(list(args)), self.env)
+
+    def to_python(self, value):
+        """Return the Python value of the Scheme VALUE.  Lists become Python
+        lists, vectors become tuples, strings become str, symbols become
+        Symbol, and other values are unchanged."""
+        if value is nil:
+            return []
+        elif isinstance(value, Pair):
+            items = []
+            while isinstance(value, Pair):
+                items.append(self.to_python(value.first))
+                value = value.rest
+            return items
+        elif isinstance(value, Vector):
+            return tuple(self.to_python(item) for item in value.items)
+        elif scheme_stringp(value):
+            return eval(value)
+        elif scheme_symbolp(value):
+            return Symbol(value)
+        return value
+
+    def from_python(self, value):
+        """Return the Scheme value of the Python VALUE.  Lists become Scheme
+        lists, tuples become vectors, dictionaries become lists of (key value)
+        lists, Symbol becomes a Scheme symbol, other str becomes a Scheme
+        string, and Python functions become procedures."""
+        import json
+        if isinstance(value, list):
+            result = nil
+            for item in reversed(value):
+                result = Pair(self.from_python(item), result)
+            return result
+        elif isinstance(value, tuple):
+            return Vector([self.from_python(item) for item in value])
+        elif isinstance(value, dict):
+            return self.from_python([[k, v] for k, v in value.items()])
+        elif isinstance(value, Symbol):
+            return str(value)
+        elif isinstance(value, str):
+            return json.dumps(value)
+        elif callable(value) and not scheme_procedurep(value):
+            def fn(*args):
+                return self.from_python(value(*map(self.to_python, args)))
+            return BuiltinProcedure(fn, name=getattr(value, '__name__', 'builtin'))
+        return value
+
 @main
 def run(*argv):
     import argparse
@@ -742,8 +1533,43 @@ def run(*argv):
     parser.add_argument('file', nargs='?',
                         type=argparse.FileType('r'), default=None,
                         help='Scheme file to run')
+    parser.add_argument('--image', metavar='FILE', default=None,
+                        help='start from an image written by save-image')
+    parser.add_argument('--serve', metavar='ADDRESS', default=None,
+                        help='serve sessions on HOST:PORT or a Unix socket, '
+                             'each starting from the loaded file and image')
+    parser.add_argument('--timeout', type=float, default=10,
+                        help='time limit in seconds for each served request')
+    parser.add_argument('--optimize', '-O', action='store_true',
+                        help='fold constant expressions before evaluating')
+    parser.add_argument('--flat-closures', action='store_true',
+                        help='make closures capture only their free variables')
+    parser.add_argument('--jit', action='store_true',
+                        help='compile frequently called procedures to Python')
+    parser.add_argument('--compile', metavar='FILE', default=None,
+                        help='compile a Scheme file to a Python module')
+    parser.add_argument('-o', '--output', metavar='FILE', default=None,
+                        help='the module to write with --compile')
+    parser.add_argument('--module', metavar='FILE', action='append',
+                        default=[], help='install a module written by '
+                                         '--compile before starting')
+    parser.add_argument('--pixels-png', metavar='FILE', default=None,
+                        help='draw pixels without a display and write them '
+                             'to a PNG file at exit')
+    parser.add_argument('--headless-turtle', metavar='FILE', default=None,
+                        help='draw turtle graphics without a display and '
+                             'write them to an SVG or PNG file at exit')
+    parser.add_argument('--screen-size', metavar='WIDTHxHEIGHT', default=None,
+                        help='the size of the screen when there is no display')
     args = parser.parse_args()
 
+    if args.compile is not None:
+        import scheme_compiler
+        try:
+            scheme_compiler.compile_file(args.compile, args.output)
+        except SchemeError as err:
+            parser.error(err)
+        return
 
     next_line = buffer_input
     interactive = True
@@ -758,6 +1584,40 @@ def run(*argv):
                 return buffer_lines(lines)
             interactive = False
 
-    read_eval_print_loop(next_line, create_global_frame(), startup=True,
-                         interactive=interactive, load_files=load_files)
-    tscheme_exitonclick()
+    env = create_global_frame()
+    env.flat_closures = args.flat_closures
+    env.jit = args.jit
+    env.output.line_buffered = interactive
+    env.graphics.pixels_png = args.pixels_png
+    env.graphics.turtle_output = args.headless_turtle
+    if args.screen_size is not None:
+        try:
+            width, height = map(int, args.screen_size.lower().split('x'))
+        except ValueError:
+            parser.error('invalid screen size: ' + args.screen_size)
+        env.graphics.screen_size = (width, height)
+    if args.image is not None:
+        try:
+            load_image(args.image, env)
+        except SchemeError as err:
+            parser.error(err)
+    if args.module:
+        import scheme_compiler
+        for module in args.module:
+            try:
+                scheme_compiler.load_module(module, env)
+            except SchemeError as err:
+                parser.error(err)
+
+    if args.serve is not None:
+        import scheme_server
+        if args.file is not None:
+            args.file.close()
+            scheme_load(args.file.name, True, env)
+        scheme_server.serve(args.serve, env, args.timeout)
+        return
+
+    read_eval_print_loop(next_line, env, startup=True,
+                         interactive=interactive, load_files=load_files,
+                         optimize=args.optimize)
+    tscheme_exitonclick(env)
@@ -6,14 +6,9 @@ import math
 import numbers
 import operator
 import sys
-from scheme_reader import Pair, nil, repl_str
-import scheme
-
-try:
-    import turtle
-    import tkinter
-except:
-    print("warning: could not import the turtle module.", file=sys.stderr)
+from scheme_reader import Pair, Vector, nil, repl_str
+import scheme_pixels
+import scheme_turtle
 
 class SchemeError(Exception):
     """Exception indicating an error in a Scheme program."""
@@ -34,6 +29,25 @@ def builtin(*names):
         return fn
     return add
 
+# Python functions of built-in procedures whose values depend only on their
+# arguments and that have no side effects.  Calls to them with constant
+# arguments may be evaluated in advance by scheme_optimize.
+PURE = set()
+
+def pure(fn):
+    """An annotation marking a Python function as pure."""
+    PURE.add(fn)
+    return fn
+
+# Python functions of built-in procedures that are passed the environment of
+# each call as their last argument.
+USES_ENV = set()
+
+def uses_env(fn):
+    """An annotation marking a Python function that is passed the environment."""
+    USES_ENV.add(fn)
+    return fn
+
 def check_type(val, predicate, k, name):
     """Returns VAL.  Raises a SchemeError if not PREDICATE(VAL)
     using "argument K of NAME" to describe the offending value."""
@@ -43,6 +57,7 @@ def check_type(val, predicate, k, name):
     return val
 
 @builtin("boolean?")
+@pure
 def scheme_booleanp(x):
     return x is True or x is False
 
@@ -55,19 +70,35 @@ def scheme_falsep(val):
     return val is False
 
 @builtin("not")
+@pure
 def scheme_not(x):
     return not scheme_truep(x)
 
 @builtin("equal?")
+@pure
 def scheme_equalp(x, y):
-    if scheme_pairp(x) and scheme_pairp(y):
-        return scheme_equalp(x.first, y.first) and scheme_equalp(x.rest, y.rest)
+    """Return whether X and Y are equal, walking lists with a loop.
+
+    >>> big = scheme_list(*range(10 ** 6))
+    >>> scheme_equalp(big, scheme_list(*range(10 ** 6)))
+    True
+    >>> scheme_equalp(big, scheme_append(big, scheme_list(0)))
+    False
+    """
+    while scheme_pairp(x) and scheme_pairp(y):
+        if not scheme_equalp(x.first, y.first):
+            return False
+        x, y = x.rest, y.rest
+    if scheme_vectorp(x) and scheme_vectorp(y):
+        return (len(x.items) == len(y.items) and
+                all(scheme_equalp(a, b) for a, b in zip(x.items, y.items)))
     elif scheme_numberp(x) and scheme_numberp(y):
         return x == y
     else:
         return type(x) == type(y) and x == y
 
 @builtin("eq?")
+@pure
 def scheme_eqp(x, y):
     if scheme_numberp(x) and scheme_numberp(y):
         return x == y
@@ -77,6 +108,7 @@ def scheme_eqp(x, y):
         return x is y
 
 @builtin("pair?")
+@pure
 def scheme_pairp(x):
     return type(x).__name__ == 'Pair'
 
@@ -100,10 +132,12 @@ def scheme_cdr_stream(x):
     return scheme_force(x.rest)
 
 @builtin("null?")
+@pure
 def scheme_nullp(x):
     return type(x).__name__ == 'nil'
 
 @builtin("list?")
+@pure
 def scheme_listp(x):
     """Return whether x is a well-formed list. Assumes no cycles."""
     while x is not nil:
@@ -113,6 +147,7 @@ def scheme_listp(x):
     return True
 
 @builtin("length")
+@pure
 def scheme_length(x):
     check_type(x, scheme_listp, 0, 'length')
     if x is nil:
@@ -124,11 +159,13 @@ def scheme_cons(x, y):
     return Pair(x, y)
 
 @builtin("car")
+@pure
 def scheme_car(x):
     check_type(x, scheme_pairp, 0, 'car')
     return x.first
 
 @builtin("cdr")
+@pure
 def scheme_cdr(x):
     check_type(x, scheme_pairp, 0, 'cdr')
     return x.rest
@@ -170,20 +207,90 @@ def scheme_append(*vals):
             result = r
     return result
 
+# Vectors
+@builtin("vector?")
+@pure
+def scheme_vectorp(x):
+    return isinstance(x, Vector)
+
+def _exact_integerp(k):
+    return scheme_numberp(k) and isinstance(k, numbers.Integral)
+
+def _check_index(v, k, name):
+    check_type(k, _exact_integerp, 1, name)
+    if not 0 <= k < len(v.items):
+        raise SchemeError('index {0} out of range for {1}'.format(k, name))
+    return k
+
+@builtin("make-vector")
+def scheme_make_vector(k, fill=None):
+    check_type(k, lambda k: _exact_integerp(k) and k >= 0, 0, 'make-vector')
+    return Vector([fill] * k)
+
+@builtin("vector")
+def scheme_vector(*vals):
+    return Vector(list(vals))
+
+@builtin("vector-ref")
+def scheme_vector_ref(v, k):
+    check_type(v, scheme_vectorp, 0, 'vector-ref')
+    return v.items[_check_index(v, k, 'vector-ref')]
+
+@builtin("vector-set!")
+def scheme_vector_set(v, k, val):
+    """Replace element K of vector V with VAL in constant time.
+
+    >>> v = scheme_make_vector(3, 0)
+    >>> scheme_vector_set(v, 1, 'a')
+    >>> v
+    Vector([0, 'a', 0])
+    """
+    check_type(v, scheme_vectorp, 0, 'vector-set!')
+    v.items[_check_index(v, k, 'vector-set!')] = val
+
+@builtin("vector-length")
+@pure
+def scheme_vector_length(v):
+    check_type(v, scheme_vectorp, 0, 'vector-length')
+    return len(v.items)
+
+@builtin("vector->list")
+def scheme_vector_to_list(v):
+    check_type(v, scheme_vectorp, 0, 'vector->list')
+    return scheme_list(*v.items)
+
+@builtin("list->vector")
+def scheme_list_to_vector(s):
+    check_type(s, scheme_listp, 0, 'list->vector')
+    items = []
+    while s is not nil:
+        items.append(s.first)
+        s = s.rest
+    return Vector(items)
+
+@builtin("vector-fill!")
+def scheme_vector_fill(v, fill):
+    check_type(v, scheme_vectorp, 0, 'vector-fill!')
+    v.items[:] = [fill] * len(v.items)
+
 @builtin("string?")
+@pure
 def scheme_stringp(x):
     return isinstance(x, str) and x.startswith('"')
 
 @builtin("symbol?")
+@pure
 def scheme_symbolp(x):
     return isinstance(x, str) and not scheme_stringp(x)
 
 
 @builtin("number?")
+@pure
 def scheme_numberp(x):
     return isinstance(x, numbers.Real) and not scheme_booleanp(x)
 
 @builtin("integer?")
+@pure
 def scheme_integerp(x):
     return scheme_numberp(x) and (isinstance(x, numbers.Integral) or int(x) == x)
 
@@ -206,10 +313,12 @@ def _arith(fn, init, vals):
     return s
 
 @builtin("+")
+@pure
 def scheme_add(*vals):
     return _arith(operator.add, 0, vals)
 
 @builtin("-")
+@pure
 def scheme_sub(val0, *vals):
     _check_nums(val0, *vals) # fixes off-by-one error
     if len(vals) == 0:
@@ -217,10 +326,12 @@ def scheme_sub(val0, *vals):
     return _arith(operator.sub, val0, vals)
 
 @builtin("*")
+@pure
 def scheme_mul(*vals):
     return _arith(operator.mul, 1, vals)
 
 @builtin("/")
+@pure
 def scheme_div(val0, *vals):
     _check_nums(val0, *vals) # fixes off-by-one error
     try:
@@ -231,15 +342,18 @@ def scheme_div(val0, *vals):
         raise SchemeError(err)
 
 @builtin("expt")
+@pure
 def scheme_expt(val0, val1):
     _check_nums(val0, val1)
     return pow(val0, val1)
 
 @builtin("abs")
+@pure
 def scheme_abs(val0):
     return abs(val0)
 
 @builtin("quotient")
+@pure
 def scheme_quo(val0, val1):
     _check_nums(val0, val1)
     try:
@@ -248,6 +362,7 @@ def scheme_quo(val0, val1):
         raise SchemeError(err)
 
 @builtin("modulo")
+@pure
 def scheme_modulo(val0, val1):
     _check_nums(val0, val1)
     try:
@@ -256,6 +371,7 @@ def scheme_modulo(val0, val1):
         raise SchemeError(err)
 
 @builtin("remainder")
+@pure
 def scheme_remainder(val0, val1):
     _check_nums(val0, val1)
     try:
@@ -280,44 +396,52 @@ for _name in ["acos", "acosh", "asin", "asinh", "atan", "atan2", "atanh",
               "ceil", "copysign", "cos", "cosh", "degrees", "floor", "log",
               "log10", "log1p", "radians", "sin", "sinh", "sqrt",
               "tan", "tanh", "trunc"]:
-    builtin(_name)(number_fn(math, _name))
-builtin("log2")(number_fn(math, "log2", lambda x: math.log(x, 2)))  # Python 2 compatibility
+    builtin(_name)(pure(number_fn(math, _name)))
+builtin("log2")(pure(number_fn(math, "log2", lambda x: math.log(x, 2))))  # Python 2 compatibility
 
 def _numcomp(op, x, y):
     _check_nums(x, y)
     return op(x, y)
 
 @builtin("=")
+@pure
 def scheme_eq(x, y):
     return _numcomp(operator.eq, x, y)
 
 @builtin("<")
+@pure
 def scheme_lt(x, y):
     return _numcomp(operator.lt, x, y)
 
 @builtin(">")
+@pure
 def scheme_gt(x, y):
     return _numcomp(operator.gt, x, y)
 
 @builtin("<=")
+@pure
 def scheme_le(x, y):
     return _numcomp(operator.le, x, y)
 
 @builtin(">=")
+@pure
 def scheme_ge(x, y):
     return _numcomp(operator.ge, x, y)
 
 @builtin("even?")
+@pure
 def scheme_evenp(x):
     _check_nums(x)
     return x % 2 == 0
 
 @builtin("odd?")
+@pure
 def scheme_oddp(x):
     _check_nums(x)
     return x % 2 == 1
 
 @builtin("zero?")
+@pure
 def scheme_zerop(x):
     _check_nums(x)
     return x == 0
@@ -327,25 +451,11 @@ def scheme_zerop(x):
 ##
 
 @builtin("atom?")
+@pure
 def scheme_atomp(x):
     return (scheme_booleanp(x) or scheme_numberp(x) or scheme_symbolp(x) or
             scheme_nullp(x) or scheme_stringp(x))
 
-@builtin("display")
-def scheme_display(val):
-    if scheme_stringp(val):
-        val = eval(val)
-    print(repl_str(val), end="")
-
-@builtin("print")
-def scheme_print(val):
-    print(repl_str(val))
-
-@builtin("newline")
-def scheme_newline():
-    print()
-    sys.stdout.flush()
-
 @builtin("error")
 def scheme_error(msg=None):
     msg = "" if msg is None else repl_str(msg)
@@ -359,110 +469,141 @@ def scheme_exit():
 ## Turtle graphics (non-standard)
 ##
 
-_turtle_screen_on = False
-
-def turtle_screen_on():
-    return _turtle_screen_on
-
-def _tscheme_prep():
-    global _turtle_screen_on
-    if not _turtle_screen_on:
-        _turtle_screen_on = True
-        turtle.title("Scheme Turtles")
-        turtle.mode('logo')
+class Graphics(object):
+    """The turtle and pixels of one interpreter, which each global frame has.
+    Without a display, pixels are written to the PNG file PIXELS_PNG and the
+    turtle's drawing to the SVG or PNG file TURTLE_OUTPUT (see scheme_turtle),
+    on a screen of SCREEN_SIZE."""
+
+    def __init__(self):
+        self.pixels_png = None
+        self.turtle_output = None
+        self.screen_size = scheme_pixels.SCREEN_SIZE
+        self.turtle = None  # The turtle module or a Recorder, once prepared
+        self.screen_on = False
+        self.pixel_size = 1
+        self.framebuffer = None  # The framebuffer of pixel, once drawn in
+
+def turtle_screen_on(env):
+    return env.globals.graphics.screen_on
+
+def _tscheme_prep(env):
+    """Return the turtle of the global frame of ENV, opening its screen."""
+    graphics = env.globals.graphics
+    if graphics.turtle is None and graphics.turtle_output is not None:
+        graphics.turtle = scheme_turtle.Recorder(graphics.turtle_output,
+                                                 graphics.screen_size)
+    elif graphics.turtle is None:
+        # The graphics modules are slow to import, so they are imported when
+        # the first turtle procedure is called.
+        try:
+            import turtle
+            import tkinter
+        except ImportError:
+            raise SchemeError("could not import the turtle module")
+        graphics.turtle = turtle
+    if not graphics.screen_on:
+        graphics.screen_on = True
+        graphics.turtle.title("Scheme Turtles")
+        graphics.turtle.mode('logo')
+    return graphics.turtle
 
 @builtin("forward", "fd")
-def tscheme_forward(n):
+@uses_env
+def tscheme_forward(n, env):
     """Move the turtle forward a distance N units on the current heading."""
     _check_nums(n)
-    _tscheme_prep()
-    turtle.forward(n)
+    _tscheme_prep(env).forward(n)
 
 @builtin("backward", "back", "bk")
-def tscheme_backward(n):
+@uses_env
+def tscheme_backward(n, env):
     """Move the turtle backward a distance N units on the current heading,
     without changing direction."""
     _check_nums(n)
-    _tscheme_prep()
-    turtle.backward(n)
+    _tscheme_prep(env).backward(n)
 
 @builtin("left", "lt")
-def tscheme_left(n):
+@uses_env
+def tscheme_left(n, env):
     """Rotate the turtle's heading N degrees counterclockwise."""
     _check_nums(n)
-    _tscheme_prep()
-    turtle.left(n)
+    _tscheme_prep(env).left(n)
 
 @builtin("right", "rt")
-def tscheme_right(n):
+@uses_env
+def tscheme_right(n, env):
     """Rotate the turtle's heading N degrees clockwise."""
     _check_nums(n)
-    _tscheme_prep()
-    turtle.right(n)
+    _tscheme_prep(env).right(n)
 
 @builtin("circle")
-def tscheme_circle(r, extent=None):
+@uses_env
+def tscheme_circle(r, *args):
     """Draw a circle with center R units to the left of the turtle (i.e.,
     right if N is negative.  If EXTENT is not None, then draw EXTENT degrees
     of the circle only.  Draws in the clockwise direction if R is negative,
     and otherwise counterclockwise, leaving the turtle facing along the
-    arc at its end."""
+    arc at its end.  ARGS has the form (ENV) or (EXTENT, ENV)."""
+    if len(args) > 2:
+        raise SchemeError('too many arguments to circle')
+    extent, env = args if len(args) == 2 else (None, args[0])
     if extent is None:
         _check_nums(r)
     else:
         _check_nums(r, extent)
-    _tscheme_prep()
-    turtle.circle(r, extent and extent)
+    _tscheme_prep(env).circle(r, extent and extent)
 
 @builtin("setposition", "setpos", "goto")
-def tscheme_setposition(x, y):
+@uses_env
+def tscheme_setposition(x, y, env):
     """Set turtle's position to (X,Y), heading unchanged."""
     _check_nums(x, y)
-    _tscheme_prep()
-    turtle.setposition(x, y)
+    _tscheme_prep(env).setposition(x, y)
 
 @builtin("setheading", "seth")
-def tscheme_setheading(h):
+@uses_env
+def tscheme_setheading(h, env):
     """Set the turtle's heading H degrees clockwise from north (up)."""
     _check_nums(h)
-    _tscheme_prep()
-    turtle.setheading(h)
+    _tscheme_prep(env).setheading(h)
 
 @builtin("penup", "pu")
-def tscheme_penup():
+@uses_env
+def tscheme_penup(env):
     """Raise the pen, so that the turtle does not draw."""
-    _tscheme_prep()
-    turtle.penup()
+    _tscheme_prep(env).penup()
 
 @builtin("pendown", "pd")
-def tscheme_pendown():
+@uses_env
+def tscheme_pendown(env):
     """Lower the pen, so that the turtle starts drawing."""
-    _tscheme_prep()
-    turtle.pendown()
+    _tscheme_prep(env).pendown()
 
 @builtin("showturtle", "st")
-def tscheme_showturtle():
+@uses_env
+def tscheme_showturtle(env):
     """Make turtle visible."""
-    _tscheme_prep()
-    turtle.showturtle()
+    _tscheme_prep(env).showturtle()
 
 @builtin("hideturtle", "ht")
-def tscheme_hideturtle():
+@uses_env
+def tscheme_hideturtle(env):
     """Make turtle visible."""
-    _tscheme_prep()
-    turtle.hideturtle()
+    _tscheme_prep(env).hideturtle()
 
 @builtin("clear")
-def tscheme_clear():
+@uses_env
+def tscheme_clear(env):
     """Clear the drawing, leaving the turtle unchanged."""
-    _tscheme_prep()
-    turtle.clear()
+    _tscheme_prep(env).clear()
 
 @builtin("color")
-def tscheme_color(c):
+@uses_env
+def tscheme_color(c, env):
     """Set the color to C, a string such as '"red"' or '"#ffc0c0"' (representing
     hexadecimal red, green, and blue values."""
-    _tscheme_prep()
+    turtle = _tscheme_prep(env)
     check_type(c, scheme_stringp, 0, "color")
     turtle.color(eval(c))
 
@@ -477,74 +618,120 @@ def tscheme_rgb(red, green, blue):
     return '"#%02x%02x%02x"' % scaled
 
 @builtin("begin_fill")
-def tscheme_begin_fill():
+@uses_env
+def tscheme_begin_fill(env):
     """Start a sequence of moves that outline a shape to be filled."""
-    _tscheme_prep()
-    turtle.begin_fill()
+    _tscheme_prep(env).begin_fill()
 
 @builtin("end_fill")
-def tscheme_end_fill():
+@uses_env
+def tscheme_end_fill(env):
     """Fill in shape drawn since last begin_fill."""
-    _tscheme_prep()
-    turtle.end_fill()
+    _tscheme_prep(env).end_fill()
 
 @builtin("bgcolor")
-def tscheme_bgcolor(c):
-    _tscheme_prep()
+@uses_env
+def tscheme_bgcolor(c, env):
+    turtle = _tscheme_prep(env)
     check_type(c, scheme_stringp, 0, "bgcolor")
     turtle.bgcolor(eval(c))
 
 @builtin("exitonclick")
-def tscheme_exitonclick():
-    """Wait for a click on the turtle window, and then close it."""
-    global _turtle_screen_on
-    if _turtle_screen_on:
-        print("Close or click on turtle window to complete exit")
-        turtle.exitonclick()
-        _turtle_screen_on = False
+@uses_env
+def tscheme_exitonclick(env):
+    """Wait for a click on the turtle window, and then close it.  Pixels are
+    flushed to the window first, or written to a file if headless."""
+    graphics = env.globals.graphics
+    if graphics.framebuffer is not None:
+        if graphics.pixels_png is not None:
+            scheme_pixels.write_png(graphics.framebuffer, graphics.pixels_png)
+        else:
+            graphics.framebuffer.flush()
+    if graphics.screen_on:
+        if graphics.turtle_output is None:
+            output = env.globals.output
+            print("Close or click on turtle window to complete exit",
+                  file=output)
+            output.flush()
+        graphics.turtle.exitonclick()
+        graphics.screen_on = False
 
 @builtin("speed")
-def tscheme_speed(s):
+@uses_env
+def tscheme_speed(s, env):
     """Set the turtle's animation speed as indicated by S (an integer in
     0-10, with 0 indicating no animation (lines draw instantly), and 1-10
     indicating faster and faster movement."""
     check_type(s, scheme_integerp, 0, "speed")
-    _tscheme_prep()
-    turtle.speed(s)
+    _tscheme_prep(env).speed(s)
 
 @builtin("pixel")
-def tscheme_pixel(x, y, c):
-    """Draw a filled box of pixels (default 1 pixel) at (X, Y) in color C."""
+@uses_env
+def tscheme_pixel(x, y, c, env):
+    """Draw a filled box of pixels (default 1 pixel) at (X, Y) in color C.
+    The box is drawn in an off-screen framebuffer (see scheme_pixels)."""
     check_type(c, scheme_stringp, 0, "pixel")
-    color = eval(c)
-    canvas = turtle.getcanvas()
-    w, h = canvas.winfo_width(), canvas.winfo_height()
-    if not hasattr(tscheme_pixel, 'image'):
-        _tscheme_prep()
-        tscheme_pixel.image = tkinter.PhotoImage(width=w, height=h)
-        canvas.create_image((0, 0), image=tscheme_pixel.image, state="normal")
-    size = tscheme_pixel.size
-    for dx in range(size):
-        for dy in range(size):
-            screenx, screeny = x * size + dx, h-(y * size + dy)
-            if 0 < screenx < w and 0 < screeny < h:
-                tscheme_pixel.image.put(color, (screenx, screeny))
-
-tscheme_pixel.size = 1
+    _check_nums(x, y)
+    framebuffer = _pixel_framebuffer(env)
+    color = scheme_pixels.rgb(eval(c), framebuffer.image)
+    if color is None:
+        raise SchemeError("unknown color: " + c)
+    size = env.globals.graphics.pixel_size
+    framebuffer.fill(int(x * size), int(y * size), size, color)
+    if framebuffer.calls >= scheme_pixels.FLUSH_INTERVAL:
+        framebuffer.flush()
+
+def _pixel_framebuffer(env):
+    """Return the framebuffer of pixel in the global frame of ENV, creating it
+    the first time with the size of the screen."""
+    graphics = env.globals.graphics
+    if graphics.framebuffer is None:
+        if graphics.pixels_png is not None:
+            framebuffer = scheme_pixels.Framebuffer(*graphics.screen_size)
+        elif graphics.turtle_output is not None:
+            framebuffer = scheme_pixels.Framebuffer(*graphics.screen_size)
+            _tscheme_prep(env).add_image(framebuffer)
+        else:
+            import tkinter
+            canvas = _tscheme_prep(env).getcanvas()
+            w, h = canvas.winfo_width(), canvas.winfo_height()
+            image = tkinter.PhotoImage(width=w, height=h)
+            canvas.create_image((0, 0), image=image, state="normal")
+            framebuffer = scheme_pixels.Framebuffer(w, h, image)
+        graphics.framebuffer = framebuffer
+    return graphics.framebuffer
+
+@builtin("pixelflush")
+@uses_env
+def tscheme_pixelflush(env):
+    """Show the pixels drawn since the last flush in the turtle window."""
+    framebuffer = env.globals.graphics.framebuffer
+    if framebuffer is not None:
+        framebuffer.flush()
+
 @builtin("pixelsize")
-def tscheme_pixelsize(size):
+@uses_env
+def tscheme_pixelsize(size, env):
     """Change pixel size to SIZE."""
     _check_nums(size)
     if size <= 0 or not isinstance(size, numbers.Integral):
         raise SchemeError("Invalid pixel size: " + repl_str(size))
-    tscheme_pixel.size = size
+    env.globals.graphics.pixel_size = size
 
 @builtin("screen_width")
-def tscheme_screen_width():
+@uses_env
+def tscheme_screen_width(env):
     """Screen width in pixels of the current size (default 1)."""
-    return turtle.getcanvas().winfo_width() // tscheme_pixel.size
+    graphics = env.globals.graphics
+    if graphics.pixels_png is not None:
+        return graphics.screen_size[0] // graphics.pixel_size
+    return _tscheme_prep(env).getcanvas().winfo_width() // graphics.pixel_size
 
 @builtin("screen_height")
-def tscheme_screen_height():
+@uses_env
+def tscheme_screen_height(env):
     """Screen height in pixels of the current size (default 1)."""
-    return turtle.getcanvas().winfo_height() // tscheme_pixel.size
\ No newline at end of file
+    graphics = env.globals.graphics
+    if graphics.pixels_png is not None:
+        return graphics.screen_size[1] // graphics.pixel_size
+    return _tscheme_prep(env).getcanvas().winfo_height() // graphics.pixel_size
\ No newline at end of file
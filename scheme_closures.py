@@ -0,0 +1,188 @@
+"""Flat closures, which capture only the variables that they refer to.
+
+    python scheme.py --flat-closures program.scm
+
+Normally a procedure or promise refers to the whole frame in which it was
+created, and so to every enclosing frame, which keeps all of their bindings
+alive.  With flat closures, it refers instead to a new frame whose parent is
+the global frame and which holds just its free variables: the names used in
+its body that are bound in a local frame where it is created.
+
+Since a local name may be bound or rebound by define after a closure is
+created, the frames from which a closure copied its free variables write
+later definitions of those names through to it.  Each closure frame records
+how far away each of its variables was found, so that a definition in a frame
+farther away than the current one does not overwrite it.
+
+Names that are used only through eval, or by a mu procedure called from the
+body, are not free variables, so they are not visible in flat closures.
+
+    >>> import scheme
+    >>> interpreter = scheme.Interpreter(flat_closures=True)
+    >>> adder = interpreter.eval('''
+    ...     (define (make-adder n)
+    ...       (define unused (list 1 2 3))
+    ...       (lambda (x) (+ x n)))
+    ...     (make-adder 5)''')
+    >>> adder.env.bindings
+    {'n': 5}
+    >>> interpreter.apply(adder, 1)
+    6
+"""
+
+from __future__ import print_function  # Python 2 compatibility
+
+from scheme import Frame, Pair, SPECIAL_FORMS, nil, scheme_symbolp
+from scheme_optimize import SIMPLIFIED
+
+def closure_frame(site, formals, body, env):
+    """Return a flat frame for a closure with FORMALS (a Scheme list) and BODY
+    (a Scheme list of expressions) created in ENV.  SITE is a Pair of the
+    expression that creates the closure, in which its free variables are
+    cached."""
+    try:
+        names = site.free_variables
+    except AttributeError:
+        names = site.free_variables = free_variables(formals, body)
+    flat = Frame(env.globals)
+    flat.distances = {}
+    for name in names:
+        frame, distance = env, 0
+        while frame.parent is not None:
+            frame.watch(name, flat, distance)
+            if name in frame.bindings:
+                flat.copy_binding(name, frame.bindings[name], distance)
+                break
+            frame, distance = frame.parent, distance + 1
+    return flat
+
+def free_variables(formals, body):
+    """Return a tuple of the names used in BODY that are not bound by FORMALS
+    or by define forms in BODY.
+
+    >>> import scheme
+    >>> body = scheme.read_line("((define (f y) (g x y)) (let ((z 1)) (f z w)))")
+    >>> sorted(free_variables(scheme.read_line('(x)'), body))
+    ['g', 'w']
+    """
+    names = set()
+    bound = _bound_names(formals, body)
+    for expr in _items(body):
+        _add_free(expr, bound, names)
+    return tuple(sorted(names))
+
+def _items(s):
+    while isinstance(s, Pair):
+        yield s.first
+        s = s.rest
+
+def _bound_names(formals, body):
+    """The names bound in the frame of a procedure with FORMALS and BODY."""
+    bound = set()
+    while isinstance(formals, Pair):
+        bound.add(formals.first)
+        formals = formals.rest
+    if scheme_symbolp(formals):  # A variadic formal parameter
+        bound.add(formals)
+    for expr in _items(body):
+        _add_defined(expr, bound)
+    return bound
+
+def _add_defined(expr, names):
+    """Add the names that EXPR defines in the frame where it is evaluated."""
+    if not isinstance(expr, Pair) or not scheme_symbolp(expr.first):
+        return
+    if expr.first == 'define' and isinstance(expr.rest, Pair):
+        target = expr.rest.first
+        if isinstance(target, Pair):
+            target = target.first
+        if scheme_symbolp(target):
+            names.add(target)
+    if expr.first in ('lambda', 'mu', 'let', 'quote', 'quasiquote'):
+        return  # These define nothing in the frame of their evaluation
+    for item in _items(expr.rest):
+        _add_defined(item, names)
+
+def _add_free(expr, bound, names):
+    """Add the names that EXPR uses and that are not in BOUND to NAMES."""
+    if scheme_symbolp(expr):
+        if expr not in bound:
+            names.add(expr)
+        return
+    if not isinstance(expr, Pair):
+        return
+    first, rest = expr.first, expr.rest
+    if scheme_symbolp(first) and first in SPECIAL_FORMS and first not in bound:
+        form = _FORMS.get(first)
+        if form is not None:
+            form(rest, bound, names)
+            return
+    for item in _items(expr):
+        _add_free(item, bound, names)
+
+def _add_free_quote(rest, bound, names):
+    pass
+
+def _add_free_quasiquote(rest, bound, names, level=1):
+    for item in _items(rest):
+        if isinstance(item, Pair):
+            if item.first == 'unquote' and level == 1:
+                for expr in _items(item.rest):
+                    _add_free(expr, bound, names)
+            elif item.first in ('unquote', 'quasiquote'):
+                change = 1 if item.first == 'quasiquote' else -1
+                _add_free_quasiquote(item.rest, bound, names, level + change)
+            else:
+                _add_free_quasiquote(item, bound, names, level)
+
+def _add_free_procedure(formals, body, bound, names):
+    inner = bound | _bound_names(formals, body)
+    for expr in _items(body):
+        _add_free(expr, inner, names)
+
+def _add_free_lambda(rest, bound, names):
+    if isinstance(rest, Pair):
+        _add_free_procedure(rest.first, rest.rest, bound, names)
+
+def _add_free_define(rest, bound, names):
+    if not isinstance(rest, Pair):
+        return
+    target = rest.first
+    if isinstance(target, Pair):
+        _add_free_procedure(target.rest, rest.rest, bound, names)
+    else:
+        for expr in _items(rest.rest):
+            _add_free(expr, bound, names)
+
+def _add_free_let(rest, bound, names):
+    if not isinstance(rest, Pair):
+        return
+    formals = []
+    for binding in _items(rest.first):
+        if isinstance(binding, Pair):
+            formals.append(binding.first)
+            for expr in _items(binding.rest):
+                _add_free(expr, bound, names)
+    inner = bound | _bound_names(nil, rest.rest) | set(formals)
+    for expr in _items(rest.rest):
+        _add_free(expr, inner, names)
+
+def _add_free_cond(rest, bound, names):
+    for clause in _items(rest):
+        for expr in _items(clause):
+            if expr != 'else':
+                _add_free(expr, bound, names)
+
+def _add_free_simplified(rest, bound, names):
+    _add_free(rest.first.original, bound, names)
+
+_FORMS = {
+    'cond': _add_free_cond,
+    'define': _add_free_define,
+    'lambda': _add_free_lambda,
+    'let': _add_free_let,
+    'mu': _add_free_lambda,
+    'quasiquote': _add_free_quasiquote,
+    'quote': _add_free_quote,
+    SIMPLIFIED: _add_free_simplified,
+}
@@ -0,0 +1,258 @@
+"""An ahead-of-time compiler from Scheme files to Python modules.
+
+    python scheme.py --compile lib.scm -o lib_scm.py
+    python scheme.py --module lib_scm.py program.scm
+
+Each procedure defined at the top level of the file is translated to Python as
+the just-in-time compiler translates hot procedures (see scheme_jit).  The
+module also records every top-level expression of the file, so loading it,
+with --module or load_module, evaluates those expressions in order in a global
+frame without reading any Scheme source, and the procedures that they define
+run their compiled code.  Python caches the bytecode of the module like that of
+any other.
+
+A module is Python code, so it is never loaded by Scheme code: load reads only
+Scheme source, and sessions served by scheme_server cannot install modules.
+
+Compiled code is linked to a global frame when its procedure is first called.
+Every global name that it refers to must be bound by then, or the call is
+interpreted and linking is tried again on the next call.
+
+    >>> import os, scheme, tempfile
+    >>> directory = tempfile.mkdtemp()
+    >>> source, module = [os.path.join(directory, name)
+    ...                   for name in ('lib.scm', 'lib_scm.py')]
+    >>> with open(source, 'w') as f:
+    ...     _ = f.write('(define (square x) (* x x))\\n(define nine (square 3))')
+    >>> compile_file(source, module)
+    >>> interpreter = scheme.Interpreter()
+    >>> load_module(module, interpreter.env)
+    >>> interpreter.eval('(list nine (square 5))')
+    Pair(9, Pair(25, nil))
+    >>> interpreter.lookup('square').compiled is not None
+    True
+"""
+
+from __future__ import print_function  # Python 2 compatibility
+
+import os
+
+from scheme import (BuiltinProcedure, LambdaProcedure, Pair, SchemeError,
+                    Vector, create_global_frame, eval_all, nil, release_frame,
+                    scheme_eval, scheme_read, scheme_symbolp)
+from scheme_reader import Buffer, tokenize_lines
+import scheme_builtins
+import scheme_jit
+
+FORMAT = 1  # The version of the modules written by compile_source
+
+def compile_file(filename, output=None):
+    """Compile the Scheme file FILENAME to a Python module named OUTPUT, which
+    is FILENAME with _scm.py in place of .scm by default."""
+    if output is None:
+        output = os.path.splitext(filename)[0] + '_scm.py'
+    try:
+        with open(filename) as infile:
+            source = infile.read()
+    except IOError as exc:
+        raise SchemeError(str(exc))
+    module = compile_source(source, os.path.basename(filename))
+    with open(output, 'w') as outfile:
+        outfile.write(module)
+
+def compile_source(source, name):
+    """Return the source of a Python module compiled from SOURCE, the contents
+    of a Scheme file called NAME."""
+    try:
+        src = Buffer(tokenize_lines(source.splitlines()))
+        exprs = []
+        while src.current() is not None:
+            exprs.append(scheme_read(src))
+    except (SyntaxError, ValueError) as err:
+        raise SchemeError(err)
+    # Bind every name defined at the top level, as it will be when linked
+    env = create_global_frame()
+    procedures = []
+    for expr in exprs:
+        target, value = _defined(expr)
+        if target is None:
+            procedures.append(None)
+        elif value is None:
+            procedures.append(None)
+            env.define(target, None)
+        else:
+            scheme_eval(expr, env)
+            procedures.append(env.lookup(target))
+    lines = ['"""Compiled from {0} by python scheme.py --compile."""'.format(name),
+             '', 'import scheme_compiler', '']
+    forms = []
+    for i, (expr, procedure) in enumerate(zip(exprs, procedures)):
+        translator = procedure and scheme_jit.Translator(procedure)
+        run = translator and scheme_jit.translate(procedure, translator)
+        if run is None:
+            forms.append('    ({0}, None, None),'.format(_encode(expr)))
+            continue
+        links = sorted(translator.namespace)
+        lines.append('def _procedure_{0}({1}):'.format(i, ', '.join(links)))
+        lines.append('    # {0}'.format(_defined(expr)[0]))
+        lines.extend('    ' + line for line in run.splitlines())
+        lines.extend(['    return run', '', ''])
+        forms.append('    ({0}, _procedure_{1}, [{2}]),'.format(
+            _encode(expr), i, ', '.join(
+                _describe(translator.namespace[link], link, env)
+                for link in links)))
+    lines.append('FORMAT = {0}'.format(FORMAT))
+    lines.extend(['', 'FORMS = ['] + forms + [']', ''])
+    lines.append('def install(env):')
+    lines.append('    """Evaluate the expressions of {0} in the global frame '
+                 'ENV."""'.format(name))
+    lines.append('    scheme_compiler.install(FORMAT, FORMS, env)')
+    return '\n'.join(lines) + '\n'
+
+def _defined(expr):
+    """Return the name that EXPR defines and True if it defines a procedure
+    or None otherwise, or (None, None) if it is not a define form."""
+    if not isinstance(expr, Pair) or expr.first != 'define':
+        return None, None
+    if not isinstance(expr.rest, Pair):
+        return None, None
+    target, rest = expr.rest.first, expr.rest.rest
+    if isinstance(target, Pair) and scheme_symbolp(target.first):
+        return target.first, True
+    if not scheme_symbolp(target):
+        return None, None
+    if (isinstance(rest, Pair) and isinstance(rest.first, Pair) and
+            rest.first.first == 'lambda' and rest.rest is nil):
+        return target, True
+    return target, None
+
+def _describe(value, link, env):
+    """Return the source of a description of the VALUE of the name LINK in a
+    Translator namespace, which _resolve resolves in the global frame in which
+    the procedure is installed."""
+    if link == 'P':
+        return "('procedure',)"
+    elif link == '_lookup':
+        return "('lookup',)"
+    elif link in scheme_jit.RUNTIME:
+        return repr(('runtime', link))
+    elif link.startswith('c'):
+        name = [k for k, cell in env.cells.items() if cell is value][0]
+        return repr(('cell', name))
+    elif link.startswith('k'):
+        name = [k for k, cell in env.cells.items() if cell.value is value][0]
+        return repr(('builtin', name, value.fn.__name__))
+    elif link.startswith('q'):
+        return "('datum', {0})".format(_encode(value))
+    return repr(('value', value))
+
+def _encode(expr):
+    """Return the source of a Python value that _decode converts to the
+    Scheme value EXPR: a list for each Scheme list, a tuple of a list and
+    its last rest for each improper list, and a tuple of a list for each
+    vector."""
+    if isinstance(expr, Vector):
+        return '([{0}],)'.format(', '.join(_encode(item) for item in expr.items))
+    elif isinstance(expr, Pair) or expr is nil:
+        items = []
+        while isinstance(expr, Pair):
+            items.append(_encode(expr.first))
+            expr = expr.rest
+        items = '[{0}]'.format(', '.join(items))
+        return items if expr is nil else '({0}, {1})'.format(items, _encode(expr))
+    elif isinstance(expr, float) and (expr != expr or abs(expr) == float('inf')):
+        return 'float({0!r})'.format(repr(expr))
+    return repr(expr)
+
+def _decode(data):
+    """Return the Scheme value that DATA, from _encode, represents."""
+    if isinstance(data, tuple) and len(data) == 1:
+        return Vector([_decode(item) for item in data[0]])
+    elif isinstance(data, tuple):
+        items, result = data[0], _decode(data[1])
+    elif isinstance(data, list):
+        items, result = data, nil
+    else:
+        return data
+    for item in reversed(items):
+        result = Pair(_decode(item), result)
+    return result
+
+##############
+# Installing #
+##############
+
+def load_module(filename, env):
+    """Import the compiled module FILENAME and install it in the global frame
+    ENV."""
+    import importlib.util
+    name = os.path.splitext(os.path.basename(filename))[0]
+    spec = importlib.util.spec_from_file_location(name, filename)
+    if spec is None:
+        raise SchemeError('not a compiled module: {0}'.format(filename))
+    module = importlib.util.module_from_spec(spec)
+    try:
+        spec.loader.exec_module(module)
+    except (IOError, SyntaxError) as exc:
+        raise SchemeError(str(exc))
+    if not hasattr(module, 'install'):
+        raise SchemeError('not a compiled module: {0}'.format(filename))
+    module.install(env)
+
+def install(format, forms, env):
+    """Evaluate each expression of FORMS, a list of triples written by
+    compile_source, in the global frame ENV.  Each procedure that a
+    compiled expression defines will link its compiled code when called."""
+    if format != FORMAT:
+        raise SchemeError('compiled module is out of date; compile it again')
+    env = env.globals
+    for data, factory, links in forms:
+        expr = _decode(data)
+        value = scheme_eval(expr, env)
+        if factory is not None:
+            procedure = env.lookup(value)
+            if type(procedure) is LambdaProcedure:
+                procedure.compiled = _linker(procedure, factory, links)
+
+def _linker(procedure, factory, links):
+    """Return a function that links the compiled code of PROCEDURE, made by
+    FACTORY from the values of LINKS, and applies it to a Scheme list of
+    arguments, or interprets the call if a global name is not yet bound."""
+    def link(args):
+        values = [_resolve(link, procedure) for link in links]
+        if any(value is _UNBOUND for value in values):
+            frame = procedure.make_call_frame(args, procedure.env)
+            value = eval_all(procedure.body, frame)
+            release_frame(frame)
+            return value
+        arity = len(procedure.formals)
+        procedure.compiled = scheme_jit.entry(factory(*values), arity, procedure)
+        return procedure.compiled(args)
+    return link
+
+_UNBOUND = object()
+_NEVER = object()  # Guards compare builtins to this when one was redefined
+
+def _resolve(link, procedure):
+    """Return the value described by LINK for the compiled code of
+    PROCEDURE, or _UNBOUND."""
+    env, kind = procedure.env, link[0]
+    if kind == 'procedure':
+        return procedure
+    elif kind == 'lookup':
+        return env.lookup
+    elif kind == 'runtime':
+        return scheme_jit.RUNTIME[link[1]]
+    elif kind == 'cell':
+        cell = env.global_cell(link[1])
+        return _UNBOUND if cell is None else cell
+    elif kind == 'builtin':
+        cell = env.global_cell(link[1])
+        fn = getattr(scheme_builtins, link[2])
+        if (cell is None or not isinstance(cell.value, BuiltinProcedure) or
+                cell.value.fn is not fn):
+            return _NEVER
+        return cell.value
+    elif kind == 'datum':
+        return _decode(link[1])
+    return link[1]
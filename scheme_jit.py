@@ -0,0 +1,447 @@
+"""A just-in-time compiler that translates hot procedures to Python.
+
+    python scheme.py --jit program.scm
+
+With the compiler enabled, a procedure defined in the global frame is
+interpreted until it has been called JIT_THRESHOLD times (see scheme.py).  Then
+its body is translated to the source of a Python function, which is compiled
+and cached on the procedure, and scheme_apply calls that function from then on.
+Procedures that are seldom called are never translated.
+
+In compiled code, arithmetic on integers and comparisons of numbers are
+computed inline, and a call of a procedure to itself in a tail context becomes
+a jump to the start of a loop.  Each of these is guarded: it checks that the
+operator is still bound to the procedure that it was bound to when compiled and
+that the operands have the expected types, and otherwise it makes an ordinary
+call to the current value of the operator.  So redefining a name takes effect
+exactly as it does in the interpreter, even while a compiled procedure runs.
+
+Only bodies made of constants, variables, calls, and the forms in _FORMS are
+translated.  Definitions that eval or a mu procedure make in the frame of a
+compiled procedure are not visible to it.
+
+    >>> import scheme
+    >>> interpreter = scheme.Interpreter(jit=True)
+    >>> fib = interpreter.eval('''
+    ...     (define (fib n) (if (< n 2) n (+ (fib (- n 1)) (fib (- n 2)))))
+    ...     fib''')
+    >>> interpreter.eval('(fib 20)'), fib.compiled is not None
+    (6765, True)
+    >>> interpreter.eval('(fib 2.5)')
+    2
+    >>> interpreter.eval('(define (< x y) #t) (fib 20)')
+    20
+"""
+
+from __future__ import print_function  # Python 2 compatibility
+
+from scheme import (BuiltinProcedure, Frame, LambdaProcedure, Pair,
+                    SPECIAL_FORMS, SchemeError, check_form, check_procedure, nil,
+                    scheme_apply, scheme_eq, scheme_ge, scheme_gt, scheme_le,
+                    scheme_list, scheme_listp, scheme_lt, scheme_mul,
+                    scheme_add, scheme_sub, scheme_symbolp, scheme_zerop,
+                    self_evaluating)
+from scheme_optimize import SIMPLIFIED
+
+def compile_procedure(procedure):
+    """Compile PROCEDURE if it is a LambdaProcedure that can be translated.
+
+    >>> import scheme
+    >>> interpreter = scheme.Interpreter(jit=True)
+    >>> interpreter.eval('(define f (mu (x) (* x y))) (define y 2) '
+    ...                  '(define (g n) (if (= n 0) 0 (+ (f n) (g (- n 1))))) '
+    ...                  '(g 120)')
+    14520
+    """
+    if not _translatable(procedure):
+        return
+    translator = Translator(procedure)
+    source = translate(procedure, translator)
+    if source is None:
+        return
+    try:
+        code = compile(source, '<compiled {0}>'.format(procedure), 'exec')
+    except (SyntaxError, RecursionError, MemoryError):  # Too deeply nested
+        return
+    exec(code, translator.namespace)
+    run = translator.namespace['run']
+    procedure.compiled = entry(run, len(translator.formals), procedure)
+
+def translate(procedure, translator=None):
+    """Return the Python source of a function of the arguments of PROCEDURE
+    that evaluates its body, or None if it cannot be translated.  The names
+    that the source uses are bound in the namespace of TRANSLATOR.
+
+    >>> import scheme
+    >>> interpreter = scheme.Interpreter()
+    >>> print(translate(interpreter.eval('''
+    ...     (define (count n total) (if (= n 0) total (count (- n 1) (+ total n))))
+    ...     count''')))
+    def run(v0, v1):
+        while True:
+            t1 = c0.value
+            if t1 is not k0: _check(t1)
+            if t1 is k0 and type(v0) in _REAL:
+                t0 = v0 == 0
+            else:
+                t0 = _apply(t1, [v0, 0], P, n0, (v0, v1))
+            if t0 is not False:
+                return v1
+            else:
+                t2 = c1.value
+                if t2 is not P: _check(t2)
+                t4 = c2.value
+                if t4 is not k1: _check(t4)
+                if t4 is k1 and type(v0) is int:
+                    t3 = v0 - 1
+                else:
+                    t3 = _apply(t4, [v0, 1], P, n0, (v0, v1))
+                t6 = c3.value
+                if t6 is not k2: _check(t6)
+                if t6 is k2 and type(v1) is int and type(v0) is int:
+                    t5 = v1 + v0
+                else:
+                    t5 = _apply(t6, [v1, v0], P, n0, (v0, v1))
+                if t2 is P:
+                    v0, v1 = t3, t5
+                    continue
+                else:
+                    return _apply(t2, [t3, t5], P, n0, (v0, v1))
+    """
+    if not _translatable(procedure):
+        return None
+    try:
+        return (translator or Translator(procedure)).translate()
+    except (_Unsupported, SchemeError, RecursionError):
+        return None
+
+def _translatable(procedure):
+    """Return whether PROCEDURE is a LambdaProcedure defined in the global
+    frame, the only procedures that are translated."""
+    return (type(procedure) is LambdaProcedure and
+            procedure.env.parent is None)
+
+def entry(run, arity, procedure):
+    """Return a function that applies RUN to the values in a Scheme list of
+    ARITY arguments to PROCEDURE."""
+    def enter(args):
+        values, rest = [], args
+        while rest is not nil:
+            values.append(rest.first)
+            rest = rest.rest
+        if len(values) != arity:
+            procedure.make_call_frame(args, procedure.env)  # Raises an error
+        return run(*values)
+    return enter
+
+def _apply(operator, args, procedure, names, values):
+    """Apply OPERATOR to the Python list ARGS in a call from the compiled body
+    of PROCEDURE, in which NAMES are bound to VALUES."""
+    if isinstance(operator, BuiltinProcedure) and not operator.use_env:
+        return operator.call(args, None)
+    if isinstance(operator, LambdaProcedure):
+        return scheme_apply(operator, scheme_list(*args), procedure.env)
+    frame = Frame(procedure.env)  # For eval and mu procedures
+    for name, value in zip(names, values):
+        frame.define(name, value)
+    return scheme_apply(operator, scheme_list(*args), frame)
+
+_REAL = (int, float)
+
+# The values that compiled code refers to by these names, in every procedure
+RUNTIME = {'_REAL': _REAL, '_apply': _apply, '_check': check_procedure}
+
+# Inline translations of built-in procedures, by function and number of
+# operands, and the guard that each operand must pass
+_INLINE = {
+    (scheme_add, 2): ('{0} + {1}', 'type({0}) is int'),
+    (scheme_sub, 2): ('{0} - {1}', 'type({0}) is int'),
+    (scheme_sub, 1): ('-{0}', 'type({0}) is int'),
+    (scheme_mul, 2): ('{0} * {1}', 'type({0}) is int'),
+    (scheme_eq, 2): ('{0} == {1}', 'type({0}) in _REAL'),
+    (scheme_lt, 2): ('{0} < {1}', 'type({0}) in _REAL'),
+    (scheme_gt, 2): ('{0} > {1}', 'type({0}) in _REAL'),
+    (scheme_le, 2): ('{0} <= {1}', 'type({0}) in _REAL'),
+    (scheme_ge, 2): ('{0} >= {1}', 'type({0}) in _REAL'),
+    (scheme_zerop, 1): ('{0} == 0', 'type({0}) in _REAL'),
+}
+
+class _Unsupported(Exception):
+    """Raised for an expression that is not translated."""
+
+class Translator(object):
+    """Translates the body of a procedure to the source of a Python function.
+
+    Each expression is translated to statements that leave its value in a
+    Python variable, or that return it if TARGET is None, as it is for an
+    expression in a tail context.  Variables v0, v1, ... hold the values of
+    formal parameters and let bindings, t0, t1, ... hold intermediate values,
+    and other names refer to the values in self.namespace."""
+
+    def __init__(self, procedure):
+        self.procedure = procedure
+        self.env = procedure.env
+        self.namespace = dict(RUNTIME, P=procedure, _lookup=self.env.lookup)
+        self.names = {}  # Names in the namespace, by prefix and value or id
+        self.lines = []
+        self.counts = {}
+
+    def translate(self):
+        scope, formals = {}, self.procedure.formals
+        while formals is not nil:
+            if not isinstance(formals, Pair) or not scheme_symbolp(formals.first):
+                raise _Unsupported()
+            if formals.first in scope:
+                raise _Unsupported()
+            scope[formals.first] = self.fresh('v')
+            formals = formals.rest
+        self.formals = [scope[name] for name in scope]
+        self.emit(0, 'def run({0}):'.format(', '.join(self.formals)))
+        self.emit(1, 'while True:')
+        self.body(self.procedure.body, scope, 2, None)
+        return '\n'.join(self.lines)
+
+    def emit(self, indent, line):
+        self.lines.append('    ' * indent + line)
+
+    def fresh(self, prefix):
+        """Return a new variable name that starts with PREFIX."""
+        count = self.counts.get(prefix, 0)
+        self.counts[prefix] = count + 1
+        return prefix + str(count)
+
+    def constant(self, prefix, value):
+        """Return a name in the namespace that is bound to VALUE."""
+        key = (prefix, value if isinstance(value, tuple) else id(value))
+        if key not in self.names:
+            self.names[key] = self.fresh(prefix)
+            self.namespace[self.names[key]] = value
+        return self.names[key]
+
+    def finish(self, value, indent, target):
+        """Emit statements that store or return the Python expression VALUE."""
+        if target is None:
+            self.emit(indent, 'return ' + value)
+        elif target != value:
+            self.emit(indent, '{0} = {1}'.format(target, value))
+
+    def value(self, expr, scope, indent):
+        """Emit statements that evaluate EXPR and return a variable or literal
+        that holds its value."""
+        if scheme_symbolp(expr):
+            if expr in scope:
+                return scope[expr]
+            temp = self.fresh('t')
+            cell = self.env.global_cell(expr)
+            if cell is None:
+                self.emit(indent, '{0} = _lookup({1!r})'.format(temp, expr))
+            else:
+                self.emit(indent, '{0} = {1}.value'.format(
+                    temp, self.constant('c', cell)))
+            return temp
+        elif self_evaluating(expr):
+            if type(expr) in (bool, int) or expr is None:
+                return repr(expr)
+            return self.constant('q', expr)
+        temp = self.fresh('t')
+        self.result(expr, scope, indent, temp)
+        return temp
+
+    def result(self, expr, scope, indent, target):
+        """Emit statements that store the value of EXPR in TARGET, or return it
+        if TARGET is None."""
+        if not isinstance(expr, Pair):
+            self.finish(self.value(expr, scope, indent), indent, target)
+        elif not scheme_listp(expr):
+            raise _Unsupported()
+        elif scheme_symbolp(expr.first) and expr.first in SPECIAL_FORMS:
+            if expr.first not in _FORMS:
+                raise _Unsupported()
+            _FORMS[expr.first](self, expr.rest, scope, indent, target)
+        else:
+            self.call(expr, scope, indent, target)
+
+    def body(self, exprs, scope, indent, target):
+        """Emit statements for each expression in the Scheme list EXPRS, with
+        the value of the last stored in TARGET."""
+        while exprs.rest is not nil:
+            self.value(exprs.first, scope, indent)
+            exprs = exprs.rest
+        self.result(exprs.first, scope, indent, target)
+
+    def call(self, expr, scope, indent, target):
+        operator, operands = expr.first, _items(expr.rest)
+        known = inline = None
+        if scheme_symbolp(operator) and operator not in scope:
+            cell = self.env.global_cell(operator)
+            value = cell and cell.value
+            if value is self.procedure and len(operands) == len(self.formals):
+                known = 'P'
+            elif (isinstance(value, BuiltinProcedure) and
+                    (value.fn, len(operands)) in _INLINE):
+                known = self.constant('k', value)
+                inline = _INLINE[(value.fn, len(operands))]
+        procedure = self.value(operator, scope, indent)
+        if known is None:
+            self.emit(indent, '_check({0})'.format(procedure))
+        else:
+            self.emit(indent, 'if {0} is not {1}: _check({0})'.format(
+                procedure, known))
+        args = [self.value(operand, scope, indent) for operand in operands]
+        names = tuple(scope)
+        general = '_apply({0}, [{1}], P, {2}, {3})'.format(
+            procedure, ', '.join(args), self.constant('n', names),
+            _tuple([scope[name] for name in names]))
+        if known is None:
+            self.finish(general, indent, target)
+            return
+        self.emit(indent, 'if {0} is {1}{2}:'.format(procedure, known, ''.join(
+            ' and ' + inline[1].format(arg)
+            for arg in args if inline and not _literal(arg))))
+        if inline:
+            self.finish(inline[0].format(*args), indent + 1, target)
+        elif target is not None:
+            self.finish('run({0})'.format(', '.join(args)), indent + 1, target)
+        else:
+            if self.formals:
+                self.emit(indent + 1, '{0} = {1}'.format(
+                    ', '.join(self.formals), ', '.join(args)))
+            self.emit(indent + 1, 'continue')
+        self.emit(indent, 'else:')
+        self.finish(general, indent + 1, target)
+
+def _items(s):
+    items = []
+    while s is not nil:
+        items.append(s.first)
+        s = s.rest
+    return items
+
+def _literal(arg):
+    """Whether ARG is the source of an integer literal."""
+    return arg.lstrip('-').isdigit()
+
+def _truth(arg):
+    """Whether the value of ARG, a variable or literal, is a true value, or
+    None if it is a variable."""
+    if arg in ('True', 'False', 'None') or _literal(arg):
+        return arg != 'False'
+    return None
+
+def _tuple(args):
+    """The source of a tuple of ARGS."""
+    return '({0})'.format(args[0] + ',' if len(args) == 1 else ', '.join(args))
+
+#####################
+# Translating Forms #
+#####################
+
+# Each of the following functions takes a Translator and the arguments of its
+# result method, with the cdr of a special form in place of the expression.
+
+def _translate_if(self, rest, scope, indent, target):
+    check_form(rest, 2, 3)
+    test = self.value(rest.first, scope, indent)
+    truth = _truth(test)
+    if truth is None:
+        self.emit(indent, 'if {0} is not False:'.format(test))
+    if truth is not False:
+        self.result(rest.rest.first, scope, indent + (truth is None), target)
+    if truth is None:
+        self.emit(indent, 'else:')
+    if truth is not True:
+        alternative = indent + (truth is None)
+        if rest.rest.rest is nil:
+            self.finish('None', alternative, target)
+        else:
+            self.result(rest.rest.rest.first, scope, alternative, target)
+
+def _translate_and_or(ends, empty):
+    """Translate an and form, if ENDS is '', or an or form, if ENDS is 'not ',
+    which is EMPTY if it has no operands."""
+    def translate(self, rest, scope, indent, target):
+        if rest is nil:
+            self.finish(empty, indent, target)
+        while rest is not nil:
+            if rest.rest is nil:
+                self.result(rest.first, scope, indent, target)
+                break
+            value = self.value(rest.first, scope, indent)
+            truth = _truth(value)
+            if truth is None:
+                self.emit(indent, 'if {0} is {1}False:'.format(value, ends))
+                self.finish(value, indent + 1, target)
+                self.emit(indent, 'else:')
+                indent += 1
+            elif truth == (ends == 'not '):
+                self.finish(value, indent, target)
+                break
+            rest = rest.rest
+    return translate
+
+def _translate_cond(self, rest, scope, indent, target):
+    while rest is not nil:
+        clause = rest.first
+        check_form(clause, 1)
+        if clause.first == 'else':
+            if rest.rest is not nil:
+                raise _Unsupported()
+            test = 'True'
+        else:
+            test = self.value(clause.first, scope, indent)
+        truth = _truth(test)
+        if truth is None:
+            self.emit(indent, 'if {0} is not False:'.format(test))
+        if truth is not False:
+            inner = indent + (truth is None)
+            if clause.rest is nil:
+                self.finish(test, inner, target)
+            else:
+                self.body(clause.rest, scope, inner, target)
+        if truth is True:
+            return
+        if truth is None:
+            self.emit(indent, 'else:')
+            indent += 1
+        rest = rest.rest
+    self.finish('None', indent, target)
+
+def _translate_begin(self, rest, scope, indent, target):
+    check_form(rest, 1)
+    self.body(rest, scope, indent, target)
+
+def _translate_let(self, rest, scope, indent, target):
+    check_form(rest, 2)
+    bindings, inner = rest.first, dict(scope)
+    if not scheme_listp(bindings):
+        raise _Unsupported()
+    values = []
+    for binding in _items(bindings):
+        check_form(binding, 2, 2)
+        if not scheme_symbolp(binding.first) or binding.first in values:
+            raise _Unsupported()
+        values.append(binding.first)
+        value = self.value(binding.rest.first, scope, indent)
+        inner[binding.first] = self.fresh('v')
+        self.emit(indent, '{0} = {1}'.format(inner[binding.first], value))
+    self.body(rest.rest, inner, indent, target)
+
+def _translate_quote(self, rest, scope, indent, target):
+    check_form(rest, 1, 1)
+    self.finish(self.value(rest.first, {}, indent)
+                if self_evaluating(rest.first)
+                else self.constant('q', rest.first), indent, target)
+
+def _translate_simplified(self, rest, scope, indent, target):
+    self.result(rest.first.original, scope, indent, target)
+
+_FORMS = {
+    'and': _translate_and_or('', 'True'),
+    'begin': _translate_begin,
+    'cond': _translate_cond,
+    'if': _translate_if,
+    'let': _translate_let,
+    'or': _translate_and_or('not ', 'False'),
+    'quote': _translate_quote,
+    SIMPLIFIED: _translate_simplified,
+}
@@ -0,0 +1,360 @@
+"""An optimizer that simplifies Scheme expressions before they are evaluated.
+
+    python scheme.py --optimize program.scm
+
+Calls to pure built-in procedures (see scheme_builtins.pure) whose arguments
+are constants are evaluated in advance, and the branches of if, cond, and and
+or forms that a constant test rules out are removed.
+
+A simplified expression stays correct if a program later rebinds the name of a
+built-in procedure.  Each one records the procedures that its simplification
+assumed, and it evaluates the original expression instead whenever one of
+those names is bound to something else in the global frame, or has been bound
+in any local frame.
+
+    >>> import scheme
+    >>> env = scheme.create_global_frame()
+    >>> expr = optimize(scheme.read_line('(* 2 (+ 1 2.5))'), env)
+    >>> print(expr)
+    (* 2 (+ 1 2.5))
+    >>> expr.rest.first.simplified
+    7
+    >>> expr = optimize(scheme.read_line('(if (< 1 2) (* 2 3.5) (car 1))'), env)
+    >>> print(expr.rest.first.simplified)
+    (* 2 3.5)
+    >>> scheme.scheme_eval(expr, env)
+    7
+    >>> scheme.scheme_eval(scheme.read_line('(define (* x y) (+ x y))'), env)
+    '*'
+    >>> scheme.scheme_eval(expr, env)
+    5.5
+
+Branches that a constant test rules out are left as they are, and so are
+calls whose integer values could have more than MAX_FOLDED_BITS bits, which
+are evaluated only if they are reached:
+
+    >>> expr = optimize(scheme.read_line(
+    ...     '(define (f) (if #f (expt 2 (expt 2 40)) 1))'), env)
+    >>> scheme.scheme_eval(scheme.read_line('(begin (define (f) 0) (f))'), env)
+    0
+    >>> scheme.scheme_eval(expr, env), scheme.scheme_eval(scheme.read_line('(f)'), env)
+    ('f', 1)
+    >>> expr = optimize(scheme.read_line('(lambda () (expt 2 (expt 2 40)))'), env)
+    >>> call = expr.rest.rest.first
+    >>> isinstance(call, Simplified), call.rest.rest.first.rest.first.simplified
+    (False, 1099511627776)
+"""
+
+from __future__ import print_function  # Python 2 compatibility
+
+import numbers
+
+from scheme import (PURE, Pair, SPECIAL_FORMS, SchemeError, nil, scheme_eval,
+                    scheme_expt, scheme_falsep, scheme_listp, scheme_mul,
+                    scheme_symbolp, scheme_truep, self_evaluating)
+
+SIMPLIFIED = '#[simplified]'  # Not a valid symbol, so it cannot be read
+
+class Simplification(object):
+    """An expression ORIGINAL and an equivalent SIMPLIFIED expression, which is
+    valid while each name in ASSUMED is bound to the built-in procedure of the
+    Python function that it maps to."""
+
+    def __init__(self, original, simplified, assumed):
+        self.original = original
+        self.simplified = simplified
+        self.assumed = assumed
+        self.cells = (None, ())  # A global frame and the cells of ASSUMED
+
+    def choose(self, env):
+        """Return the simplified expression if it is valid in ENV, or else the
+        original expression."""
+        if not self.assumed:
+            return self.simplified
+        globals = env.globals
+        frame, cells = self.cells
+        if frame is not globals:
+            cells = [globals.global_cell(name) for name in self.assumed]
+            self.cells = (globals, cells)
+        for cell, fn in zip(cells, self.assumed.values()):
+            if (cell is None or cell.shadowed or
+                    getattr(cell.value, 'fn', None) is not fn):
+                return self.original
+        return self.simplified
+
+class Simplified(Pair):
+    """A special form that evaluates one of the expressions of a
+    Simplification.  It is displayed and serialized as the original."""
+
+    def __init__(self, simplification):
+        Pair.__init__(self, SIMPLIFIED, Pair(simplification, nil))
+
+    def __str__(self):
+        return str(self.rest.first.original)
+
+    def __repr__(self):
+        return repr(self.rest.first.original)
+
+    def __reduce_ex__(self, protocol):
+        return self.rest.first.original.__reduce_ex__(protocol)
+
+def do_simplified_form(expressions, env):
+    """Evaluate a simplified expression."""
+    return scheme_eval(expressions.first.choose(env), env)
+
+SPECIAL_FORMS[SIMPLIFIED] = do_simplified_form
+
+##############
+# Optimizing #
+##############
+
+class _Unknown(object):
+    """The value of an expression that is not a constant."""
+
+UNKNOWN = _Unknown()
+
+def optimize(expr, env):
+    """Return an expression equivalent to EXPR that may be simplified using the
+    built-in procedures bound in the global frame of ENV."""
+    expr, value, assumed = _simplify(expr, env.globals)
+    return expr
+
+def _simplify(expr, env):
+    """Return (EXPR', VALUE, ASSUMED) for EXPR, where EXPR' is equivalent to
+    EXPR as long as ASSUMED holds, and VALUE is its constant value, or UNKNOWN.
+    ASSUMED is a dictionary from names to Python functions of pure built-in
+    procedures."""
+    if self_evaluating(expr):
+        return expr, expr, {}
+    if not isinstance(expr, Pair) or not scheme_listp(expr):
+        return expr, UNKNOWN, {}
+    first, rest = expr.first, expr.rest
+    if scheme_symbolp(first) and first in SPECIAL_FORMS:
+        if first == 'quote' and rest is not nil:
+            return expr, rest.first, {}
+        simplify_form = _FORMS.get(first)
+        if simplify_form is None:
+            return expr, UNKNOWN, {}
+        return simplify_form(expr, env)
+    operands = _simplify_all(rest, env)
+    expr = Pair(_simplify(first, env)[0], _list(e for e, _, _ in operands))
+    procedure = _pure_procedure(first, env)
+    if procedure is None or any(v is UNKNOWN for _, v, _ in operands):
+        return expr, UNKNOWN, {}
+    values = [v for _, v, _ in operands]
+    if _result_bits(procedure.fn, values) > MAX_FOLDED_BITS:
+        return expr, UNKNOWN, {}
+    try:
+        value = procedure.apply(_list(values), env)
+    except (SchemeError, ArithmeticError, TypeError, ValueError, MemoryError):
+        return expr, UNKNOWN, {}
+    assumed = _merge([a for _, _, a in operands] + [{first: procedure.fn}])
+    return _guard(expr, _constant(value), assumed), value, assumed
+
+def _simplify_all(exprs, env):
+    """Simplify each expression in the Scheme list EXPRS."""
+    results = []
+    while isinstance(exprs, Pair):
+        results.append(_simplify(exprs.first, env))
+        exprs = exprs.rest
+    return results
+
+def _simplify_body(exprs, env):
+    """Return the Scheme list EXPRS with each expression simplified."""
+    if not scheme_listp(exprs):
+        return exprs
+    return _list(e for e, _, _ in _simplify_all(exprs, env))
+
+# The most bits in an integer value that a call is evaluated in advance to, so
+# that simplifying an expression takes about as long as reading it
+MAX_FOLDED_BITS = 1 << 16
+
+def _result_bits(fn, values):
+    """An upper bound on the bits in the value of the Python function FN of a
+    pure built-in procedure applied to VALUES, if it is an integer that can
+    be larger than all of VALUES, or else 0."""
+    integers = [v for v in values if isinstance(v, numbers.Integral)]
+    if fn is scheme_mul:
+        return sum(abs(v).bit_length() for v in integers)
+    if fn is scheme_expt and len(values) == 2 and len(integers) == 2:
+        base, power = values
+        if abs(base) > 1 and power > 0:
+            return power * abs(base).bit_length()
+    return 0
+
+def _pure_procedure(name, env):
+    """Return the pure built-in procedure bound to NAME in the global frame
+    ENV, or None."""
+    if not scheme_symbolp(name):
+        return None
+    cell = env.global_cell(name)
+    if cell is None or cell.shadowed:
+        return None
+    if getattr(cell.value, 'fn', None) not in PURE:
+        return None
+    return cell.value
+
+def _constant(value):
+    """An expression that evaluates to VALUE."""
+    if self_evaluating(value):
+        return value
+    return Pair('quote', Pair(value, nil))
+
+def _guard(original, simplified, assumed):
+    """An expression that evaluates SIMPLIFIED while ASSUMED holds, and
+    ORIGINAL otherwise."""
+    return Simplified(Simplification(original, simplified, assumed))
+
+def _merge(assumptions):
+    assumed = {}
+    for a in assumptions:
+        assumed.update(a)
+    return assumed
+
+def _list(values):
+    result = nil
+    for value in reversed(list(values)):
+        result = Pair(value, result)
+    return result
+
+#############################
+# Simplifying Special Forms #
+#############################
+
+# Each of the following functions takes a special form EXPR and the global
+# frame ENV and returns a triple as _simplify does.
+
+def _simplify_if(expr, env):
+    """Simplify an if form.  A branch that a constant test rules out is not
+    simplified."""
+    operands = list(_items(expr.rest))
+    if len(operands) not in (2, 3):
+        return expr, UNKNOWN, {}
+    test, test_value, assumed = _simplify(operands[0], env)
+    branches = operands[1:]
+    if test_value is UNKNOWN:
+        branches = [_simplify(e, env)[0] for e in branches]
+        return Pair('if', _list([test] + branches)), UNKNOWN, {}
+    taken = 0 if scheme_truep(test_value) else 1
+    if taken == len(branches):
+        expr = Pair('if', _list([test] + branches))
+        return _guard(expr, None, assumed), None, assumed
+    branch, value, branch_assumed = _simplify(branches[taken], env)
+    branches[taken] = branch
+    expr = Pair('if', _list([test] + branches))
+    assumed = _merge([assumed, branch_assumed])
+    return _guard(expr, branch, assumed), value, assumed
+
+def _simplify_and_or(expr, env):
+    """Simplify an and or an or form, removing constant operands that do not
+    end its evaluation and everything after one that does, which is not
+    simplified."""
+    operands = list(_items(expr.rest))
+    ends = scheme_falsep if expr.first == 'and' else scheme_truep
+    parts, kept, assumptions = [], [], []
+    for i, operand in enumerate(operands):
+        e, value, assumed = _simplify(operand, env)
+        parts.append(e)
+        if value is UNKNOWN:
+            kept.append((e, value))
+            continue
+        assumptions.append(assumed)
+        if ends(value) or i == len(operands) - 1:
+            kept.append((e, value))
+            break
+    expr = Pair(expr.first, _list(parts + operands[len(parts):]))
+    if len(kept) == len(operands):
+        return expr, UNKNOWN, {}
+    assumed = _merge(assumptions)
+    if len(kept) == 1:
+        simplified, value = kept[0]
+        return _guard(expr, simplified, assumed), value, assumed
+    simplified = Pair(expr.first, _list(e for e, _ in kept))
+    return _guard(expr, simplified, assumed), UNKNOWN, {}
+
+def _simplify_cond(expr, env):
+    """Simplify a cond form, removing clauses whose tests are constant false
+    values and everything after a clause whose test is a constant true value.
+    The clauses that are removed are not simplified."""
+    clauses, kept, assumptions = [], [], []
+    pruned = False
+    for clause in _items(expr.rest):
+        if not isinstance(clause, Pair) or not scheme_listp(clause):
+            return expr, UNKNOWN, {}
+        if pruned:
+            clauses.append(clause)
+            continue
+        if clause.first == 'else':
+            test, value, assumed = 'else', True, {}
+        else:
+            test, value, assumed = _simplify(clause.first, env)
+        if value is not UNKNOWN and scheme_falsep(value):
+            clauses.append(Pair(test, clause.rest))
+            assumptions.append(assumed)
+            continue
+        body = _simplify_body(clause.rest, env)
+        clauses.append(Pair(test, body))
+        if value is UNKNOWN:
+            kept.append(clauses[-1])
+            continue
+        assumptions.append(assumed)
+        if body is nil:
+            body = Pair(_constant(value), nil)
+        kept.append(Pair('else', body))
+        pruned = True
+    expr = Pair('cond', _list(clauses))
+    if not assumptions:
+        return expr, UNKNOWN, {}
+    if not kept:
+        simplified = None
+    elif len(kept) == 1 and kept[0].first == 'else':
+        simplified = Pair('begin', kept[0].rest)
+    else:
+        simplified = Pair('cond', _list(kept))
+    return _guard(expr, simplified, _merge(assumptions)), UNKNOWN, {}
+
+def _simplify_define(expr, env):
+    if not isinstance(expr.rest, Pair):
+        return expr, UNKNOWN, {}
+    target, body = expr.rest.first, expr.rest.rest
+    return Pair('define', Pair(target, _simplify_body(body, env))), UNKNOWN, {}
+
+def _simplify_lambda(expr, env):
+    if not isinstance(expr.rest, Pair):
+        return expr, UNKNOWN, {}
+    formals, body = expr.rest.first, expr.rest.rest
+    return Pair(expr.first, Pair(formals, _simplify_body(body, env))), UNKNOWN, {}
+
+def _simplify_let(expr, env):
+    if not isinstance(expr.rest, Pair) or not scheme_listp(expr.rest.first):
+        return expr, UNKNOWN, {}
+    bindings = []
+    for binding in _items(expr.rest.first):
+        if isinstance(binding, Pair) and isinstance(binding.rest, Pair):
+            binding = Pair(binding.first, _simplify_body(binding.rest, env))
+        bindings.append(binding)
+    body = _simplify_body(expr.rest.rest, env)
+    return Pair('let', Pair(_list(bindings), body)), UNKNOWN, {}
+
+def _simplify_sequence(expr, env):
+    """Simplify a form whose operands are all expressions."""
+    return Pair(expr.first, _simplify_body(expr.rest, env)), UNKNOWN, {}
+
+def _items(s):
+    while isinstance(s, Pair):
+        yield s.first
+        s = s.rest
+
+_FORMS = {
+    'and': _simplify_and_or,
+    'begin': _simplify_sequence,
+    'cond': _simplify_cond,
+    'cons-stream': _simplify_sequence,
+    'define': _simplify_define,
+    'delay': _simplify_sequence,
+    'if': _simplify_if,
+    'lambda': _simplify_lambda,
+    'let': _simplify_let,
+    'mu': _simplify_lambda,
+    'or': _simplify_and_or,
+}
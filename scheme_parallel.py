@@ -0,0 +1,212 @@
+"""Parallel evaluation of Scheme procedures on a pool of worker processes.
+
+(future PROC ARG ...) starts applying PROC to the ARGs on a worker process and
+returns a future, and (touch FUTURE) waits for its value.  (pmap PROC LIST)
+applies PROC to each element of LIST on the workers, sending the elements in
+chunks.  An optional third argument to pmap sets the number of elements per
+chunk; larger chunks amortize the cost of sending PROC for fine-grained work.
+
+Procedures and arguments are copied to the workers with scheme_pickle, and
+each worker starts from the bindings of the caller's global frame, so PROC may
+use anything that was defined or loaded before the call.  PROC should be pure:
+its side effects on a worker are not visible to the caller.  The workers are
+started again only after a new definition in the global frame, so they do not
+see later changes to the contents of global data, such as by vector-set!.
+
+    >>> import scheme
+    >>> interp = scheme.Interpreter()
+    >>> print(interp.eval('''
+    ...     (define (square x) (* x x))
+    ...     (define f (future square 7))
+    ...     f'''))
+    #[future (not touched)]
+    >>> print(interp.eval('(list (touch f) f)'))
+    (49 #[future (touched)])
+    >>> print(interp.eval('(pmap square (list 1 2 3 4 5))'))
+    (1 4 9 16 25)
+    >>> print(interp.eval('(define (square x) (+ x x)) (pmap square (list 1 2 3) 2)'))
+    (2 4 6)
+
+Source files are parsed on workers too: load-all reads and parses all of its
+files at once with parse_files, and then evaluates them in order.
+"""
+
+from __future__ import print_function  # Python 2 compatibility
+
+import os
+
+import scheme_pickle
+from scheme_builtins import SchemeError, check_type, scheme_integerp, scheme_listp
+from scheme_reader import Buffer, Pair, nil, scheme_read, tokenize_lines
+
+_worker_env = None  # The global frame of a worker process
+
+# Files whose total size is less than this many bytes are parsed without
+# starting workers, which would take longer than parsing them
+PARALLEL_PARSE_SIZE = 1 << 16
+
+def worker_count():
+    """The number of worker processes to start."""
+    return os.cpu_count() or 1
+
+def _init_worker(bindings):
+    """Start a worker whose global frame has the serialized BINDINGS."""
+    global _worker_env
+    import scheme
+    _worker_env = scheme.create_global_frame()
+    scheme_pickle.load_bindings(bindings, _worker_env)
+
+def _run_task(payload):
+    """Apply a procedure to each of a list of argument lists on a worker."""
+    return scheme_pickle.dumps(_apply_all(payload, _worker_env), _worker_env)
+
+def _apply_all(payload, env):
+    import scheme
+    procedure, arg_lists = scheme_pickle.loads(payload, env)
+    return [scheme.complete_apply(procedure, args, env) for args in arg_lists]
+
+def _get_pool(env):
+    """Return a pool whose workers share the global bindings of ENV, the global
+    frame that owns the pool.  A new pool is started if a global name has been
+    defined since the current one was."""
+    from concurrent.futures import ProcessPoolExecutor
+    pool = getattr(env, 'pool', None)
+    if pool is None or env.definitions != env.pool_definitions:
+        if pool is not None:
+            pool.shutdown(wait=False)
+        bindings = scheme_pickle.dump_bindings(env)
+        env.pool = ProcessPoolExecutor(worker_count(), initializer=_init_worker,
+                                       initargs=(bindings,))
+        env.pool_definitions = env.definitions
+    return env.pool
+
+def _submit(procedure, arg_lists, env):
+    """Start applying PROCEDURE to each of ARG_LISTS and return a function
+    that waits for the list of results."""
+    env = scheme_pickle.global_frame(env)
+    payload = scheme_pickle.dumps((procedure, arg_lists), env)
+    if _worker_env is not None:  # Workers do not start workers of their own
+        results = _apply_all(payload, env)
+        return lambda: results
+    future = _get_pool(env).submit(_run_task, payload)
+    def wait():
+        from concurrent.futures.process import BrokenProcessPool
+        try:
+            return scheme_pickle.loads(future.result(), env)
+        except BrokenProcessPool:
+            env.pool = None
+            raise SchemeError('a worker process terminated abruptly')
+    return wait
+
+class Future(object):
+    """The value of a procedure call that is evaluated on a worker process."""
+
+    def __init__(self, procedure, args, env):
+        self.wait = _submit(procedure, [args], env)
+
+    def value(self):
+        """Wait for and return the value of the call."""
+        if self.wait is not None:
+            self._value = self.wait()[0]
+            self.wait = None
+        return self._value
+
+    def __str__(self):
+        return '#[future ({0}touched)]'.format(
+            'not ' if self.wait is not None else '')
+
+def scheme_future(procedure, *args):
+    """Start applying PROCEDURE to ARGS on a worker.  The last of ARGS is the
+    environment of the call."""
+    import scheme
+    env = args[-1]
+    check_type(procedure, scheme.scheme_procedurep, 0, 'future')
+    arg_list = nil
+    for arg in reversed(args[:-1]):
+        arg_list = Pair(arg, arg_list)
+    return Future(procedure, arg_list, env)
+
+def scheme_touch(future, env):
+    check_type(future, lambda x: isinstance(x, Future), 0, 'touch')
+    return future.value()
+
+def scheme_pmap(procedure, s, *args):
+    """Map PROCEDURE over the Scheme list S on the workers.  ARGS has the form
+    (ENV) or (CHUNKSIZE, ENV)."""
+    import scheme
+    if len(args) not in (1, 2):
+        raise SchemeError('"pmap" given incorrect number of arguments: '
+                          '{0}'.format(len(args) + 1))
+    env = args[-1]
+    check_type(procedure, scheme.scheme_procedurep, 0, 'pmap')
+    check_type(s, scheme_listp, 1, 'pmap')
+    items = []
+    while s is not nil:
+        items.append(Pair(s.first, nil))
+        s = s.rest
+    if len(args) == 2:
+        chunksize = check_type(args[0], lambda x: scheme_integerp(x) and x > 0,
+                               2, 'pmap')
+    else:
+        chunksize = max(1, -(-len(items) // (worker_count() * 4)))
+    chunksize = int(chunksize)
+    waits = [_submit(procedure, items[i:i+chunksize], env)
+             for i in range(0, len(items), chunksize)]
+    results = [value for wait in waits for value in wait()]
+    result = nil
+    for value in reversed(results):
+        result = Pair(value, result)
+    return result
+
+def parse_files(filenames):
+    """Return a list of the forms of each of FILENAMES, as returned by
+    parse_file.  The files are parsed on worker processes if there are several
+    and they are large enough.
+
+    >>> import os, tempfile
+    >>> directory = tempfile.mkdtemp()
+    >>> filenames = [os.path.join(directory, name) for name in ('a.scm', 'b.scm')]
+    >>> for filename, source in zip(filenames, ['(define x 1)\\n"oops\\n(+ x 1)',
+    ...                                         '(car\\n(cdr']):
+    ...     with open(filename, 'w') as f:
+    ...         _ = f.write(source)
+    >>> for forms in parse_files(filenames):
+    ...     print([type(form).__name__ if isinstance(form, Exception) else str(form)
+    ...            for form in forms])
+    ['(define x 1)', 'ValueError', '(+ x 1)']
+    ['SyntaxError']
+    """
+    try:
+        size = sum(os.path.getsize(filename) for filename in filenames)
+    except OSError as exc:
+        raise SchemeError(str(exc))
+    if (len(filenames) < 2 or size < PARALLEL_PARSE_SIZE or worker_count() < 2
+            or _worker_env is not None):
+        return [parse_file(filename) for filename in filenames]
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(min(worker_count(), len(filenames))) as pool:
+        return list(pool.map(parse_file, filenames))
+
+def parse_file(filename):
+    """Return a list of the expressions in the file FILENAME.  A ValueError in
+    the list stands for a line with an invalid token, which was skipped, and a
+    SyntaxError at the end of the list stands for the end of the valid input."""
+    try:
+        with open(filename) as infile:
+            lines = infile.read().splitlines()
+    except IOError as exc:
+        return [SyntaxError(str(exc))]
+    lines = iter(lines)
+    forms, src = [], Buffer(tokenize_lines(lines), history=0)
+    while True:
+        try:
+            if src.current() is None:
+                return forms
+            forms.append(scheme_read(src))
+        except ValueError as err:
+            # The tokens end with the invalid line, so read on from the next
+            forms.append(err)
+            src = Buffer(tokenize_lines(lines), history=0)
+        except SyntaxError as err:
+            forms.append(err)
+            return forms
@@ -0,0 +1,125 @@
+"""The scheme_pickle module serializes Scheme values, including procedures
+together with the frames they close over.
+
+Two kinds of objects are saved by reference rather than by value, so that a
+value written by one interpreter can be loaded into another:
+
+  * The global frame, which is replaced by the global frame of the loader.
+  * Built-in procedures, which are saved by name and replaced by the loader's
+    built-in procedure of that name.
+"""
+
+from __future__ import print_function  # Python 2 compatibility
+
+import io
+import pickle
+
+_builtins = None
+
+def builtin_procedures():
+    """Return a dictionary from names to the standard built-in procedures."""
+    global _builtins
+    if _builtins is None:
+        import scheme
+        env = scheme.create_global_frame()
+        env.bindings.materialize()
+        _builtins = {}
+        for value in env.bindings.values():
+            if isinstance(value, scheme.BuiltinProcedure):
+                _builtins.setdefault(value.name, value)
+    return _builtins
+
+def global_frame(env):
+    """Return the global frame that ENV extends."""
+    while env.parent is not None:
+        env = env.parent
+    return env
+
+class SchemePickler(pickle.Pickler):
+    """A pickler that refers to the global frame of ENV and to built-in
+    procedures by name."""
+
+    def __init__(self, file, env):
+        pickle.Pickler.__init__(self, file, pickle.HIGHEST_PROTOCOL)
+        self.env = global_frame(env)
+        self.builtins = builtin_procedures()
+
+    def persistent_id(self, obj):
+        if obj is self.env:
+            return 'global'
+        if type(obj).__name__ == 'BuiltinProcedure':
+            builtin = self.builtins.get(obj.name)
+            if builtin is not None and builtin.fn is obj.fn:
+                return ('builtin', obj.name)
+        return None
+
+class SchemeUnpickler(pickle.Unpickler):
+    """An unpickler that resolves references made by a SchemePickler in the
+    global frame of ENV."""
+
+    def __init__(self, file, env):
+        pickle.Unpickler.__init__(self, file)
+        self.env = global_frame(env)
+        self.builtins = builtin_procedures()
+
+    def persistent_load(self, pid):
+        if pid == 'global':
+            return self.env
+        kind, name = pid
+        if kind == 'builtin' and name in self.builtins:
+            return self.builtins[name]
+        raise pickle.UnpicklingError('unknown reference: {0}'.format(pid))
+
+def dump(value, file, env):
+    """Write VALUE to the binary FILE, relative to environment ENV."""
+    SchemePickler(file, env).dump(value)
+
+def load(file, env):
+    """Read a value from the binary FILE into environment ENV."""
+    return SchemeUnpickler(file, env).load()
+
+def dumps(value, env):
+    """Return VALUE serialized as bytes, relative to environment ENV.
+
+    >>> import scheme
+    >>> env = scheme.create_global_frame()
+    >>> square = scheme.scheme_eval(scheme.read_line('(lambda (x) (* x x))'), env)
+    >>> other = scheme.create_global_frame()
+    >>> copy = loads(dumps(square, env), other)
+    >>> copy.env is other
+    True
+    >>> scheme.complete_apply(copy, scheme.read_line('(7)'), other)
+    49
+    """
+    file = io.BytesIO()
+    dump(value, file, env)
+    return file.getvalue()
+
+def loads(data, env):
+    """Return the value serialized in the bytes DATA, loaded into ENV."""
+    return load(io.BytesIO(data), env)
+
+def dump_bindings(env, omitted=None):
+    """Serialize the bindings of the global frame of ENV.  Bindings whose
+    values cannot be serialized are omitted, and their names are appended to
+    the list OMITTED if it is given."""
+    bindings = global_frame(env).bindings
+    try:
+        return dumps(dict(bindings), env)
+    except (pickle.PicklingError, TypeError, AttributeError):
+        picklable = {}
+        for name, value in bindings.items():
+            try:
+                dumps(value, env)
+            except (pickle.PicklingError, TypeError, AttributeError):
+                if omitted is not None:
+                    omitted.append(name)
+                continue
+            picklable[name] = value
+        return dumps(picklable, env)
+
+def load_bindings(data, env):
+    """Define the bindings serialized in DATA in the global frame of ENV."""
+    env = global_frame(env)
+    for name, value in loads(data, env).items():
+        env.define(name, value)
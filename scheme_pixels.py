@@ -0,0 +1,178 @@
+"""An off-screen framebuffer for the pixel procedure.
+
+    python scheme.py --pixels-png image.png [--screen-size 800x600] program.scm
+
+Each call to pixel fills a box of the framebuffer, a bytearray of red, green
+and blue bytes for each screen pixel, rather than calling Tk once per screen
+pixel.  On a display, the pixels written since the last flush are copied to a
+Tk image every FLUSH_INTERVAL calls, on (pixelflush), and on (exitonclick),
+with one Tk call for each run of written pixels (or for each rectangle of
+identical runs on adjacent rows).  In headless mode there is no display: the
+framebuffer is written to a PNG file on (exitonclick), which is called when
+the program ends.
+
+    >>> fb = Framebuffer(4, 3)
+    >>> fb.fill(1, 1, 2, rgb('#ff0000'))
+    >>> fb.pixels[3 * (4 + 1):3 * (4 + 3)].hex()
+    'ff0000ff0000'
+    >>> fb.rectangles()
+    [(1, 1, 2, 2)]
+    >>> png(fb)[:8]
+    b'\\x89PNG\\r\\n\\x1a\\n'
+"""
+
+from __future__ import print_function  # Python 2 compatibility
+
+import struct
+import zlib
+
+FLUSH_INTERVAL = 4096  # Calls to pixel between flushes to a display
+SCREEN_SIZE = (800, 600)  # The default width and height of a headless screen
+
+class Framebuffer(object):
+    """WIDTH by HEIGHT screen pixels, which are white until written.  Row 0
+    is the top of the screen."""
+
+    def __init__(self, width, height, image=None):
+        self.width, self.height = width, height
+        self.pixels = bytearray(b'\xff' * (3 * width * height))
+        self.written = bytearray(width * height)  # 1 for each written pixel
+        self.dirty = {}  # Rows written since the last flush: [first, last]
+        self.image = image  # A Tk PhotoImage, or None if headless
+        self.calls = 0  # Calls to fill since the last flush
+
+    def fill(self, x, y, size, color):
+        """Fill the SIZE by SIZE box of screen pixels whose lower left corner
+        is X pixels right of and Y pixels above the lower left corner of the
+        screen with COLOR, a bytes object of red, green and blue.  Pixels on
+        the left and bottom edges and beyond the screen are not drawn."""
+        self.calls += 1
+        left, right = max(x, 1), min(x + size, self.width)
+        if left >= right:
+            return
+        row_bytes = color * (right - left)
+        for row in range(max(self.height - y - size + 1, 1),
+                         min(self.height - y + 1, self.height)):
+            start = row * self.width
+            self.pixels[3 * (start + left):3 * (start + right)] = row_bytes
+            self.written[start + left:start + right] = b'\x01' * (right - left)
+            span = self.dirty.get(row)
+            if span is None:
+                self.dirty[row] = [left, right - 1]
+            else:
+                span[0], span[1] = min(span[0], left), max(span[1], right - 1)
+
+    def runs(self, row):
+        """The (first, end) columns of each run of written pixels in the dirty
+        span of ROW."""
+        first, last = self.dirty[row]
+        written, start = self.written, row * self.width
+        runs, column = [], first
+        while column <= last:
+            if written[start + column]:
+                end = column
+                while end <= last and written[start + end]:
+                    end += 1
+                runs.append((column, end))
+                column = end
+            else:
+                column += 1
+        return runs
+
+    def rectangles(self):
+        """Return the rectangles (column, row, width, height) covering the
+        pixels written since the last flush, and mark them flushed."""
+        rectangles = []
+        for row in sorted(self.dirty):
+            runs = self.runs(row)
+            last = rectangles[-1] if rectangles else None
+            if (len(runs) == 1 and last is not None and last[1] + last[3] == row
+                    and (last[0], last[0] + last[2]) == runs[0]):
+                rectangles[-1] = last[:3] + (last[3] + 1,)
+                continue
+            rectangles.extend((a, row, b - a, 1) for a, b in runs)
+        self.dirty = {}
+        self.calls = 0
+        return rectangles
+
+    def flush(self):
+        """Copy the pixels written since the last flush to the Tk image."""
+        if self.image is None or not self.dirty:
+            return
+        for column, row, width, height in self.rectangles():
+            rows = []
+            for r in range(row, row + height):
+                start = 3 * (r * self.width + column)
+                digits = self.pixels[start:start + 3 * width].hex()
+                rows.append('{' + ' '.join(
+                    '#' + digits[i:i + 6] for i in range(0, len(digits), 6)) + '}')
+            self.image.put(' '.join(rows), to=(column, row))
+
+def png(framebuffer, alpha=False):
+    """Return the contents of a PNG file of the pixels of FRAMEBUFFER.  If
+    ALPHA, pixels that have not been written are transparent."""
+    width, height = framebuffer.width, framebuffer.height
+    pixels = framebuffer.pixels
+    if alpha:
+        rgba = bytearray(4 * width * height)
+        for channel in range(3):
+            rgba[channel::4] = pixels[channel::3]
+        rgba[3::4] = framebuffer.written.translate(_OPACITY)
+        pixels = rgba
+    stride = len(pixels) // height
+    data = b''.join(b'\x00' + bytes(pixels[row * stride:(row + 1) * stride])
+                    for row in range(height))
+    def chunk(kind, body):
+        crc = zlib.crc32(kind + body) & 0xffffffff
+        return struct.pack('>I', len(body)) + kind + body + struct.pack('>I', crc)
+    header = struct.pack('>IIBBBBB', width, height, 8, 6 if alpha else 2, 0, 0, 0)
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header) +
+            chunk(b'IDAT', zlib.compress(data, 6)) + chunk(b'IEND', b''))
+
+_OPACITY = bytes([0, 255]) + bytes(254)  # Maps written flags to alpha
+
+def write_png(framebuffer, filename):
+    """Write the pixels of FRAMEBUFFER to a PNG file named FILENAME."""
+    with open(filename, 'wb') as outfile:
+        outfile.write(png(framebuffer))
+
+##########
+# Colors #
+##########
+
+# Named colors as Tk 8.6 defines them.  Other names are looked up by Tk when
+# there is a display.
+NAMED_COLORS = {
+    'black': '#000000', 'white': '#ffffff', 'red': '#ff0000',
+    'green': '#008000', 'lime': '#00ff00', 'blue': '#0000ff',
+    'yellow': '#ffff00', 'cyan': '#00ffff', 'magenta': '#ff00ff',
+    'gray': '#808080', 'grey': '#808080', 'orange': '#ffa500',
+    'purple': '#800080', 'brown': '#a52a2a', 'pink': '#ffc0cb',
+    'navy': '#000080', 'maroon': '#800000', 'olive': '#808000',
+    'teal': '#008080', 'silver': '#c0c0c0', 'gold': '#ffd700',
+}
+
+_colors = {}
+
+def rgb(color, widget=None):
+    """Return the red, green and blue bytes of the Tk COLOR, a name or a
+    hexadecimal string, or None if it is unknown.  Names that are not in
+    NAMED_COLORS are looked up with the Tk WIDGET if there is one."""
+    value = _colors.get(color)
+    if value is None:
+        name = NAMED_COLORS.get(color.lower(), color)
+        if name.startswith('#') and len(name) in (4, 7, 10, 13):
+            n = (len(name) - 1) // 3
+            try:
+                value = bytes(int(name[1 + i * n:1 + (i + 1) * n], 16) * 255 //
+                              (16 ** n - 1) for i in range(3))
+            except ValueError:
+                value = None
+        elif widget is not None:
+            try:
+                value = bytes(c // 257 for c in widget.winfo_rgb(name))
+            except Exception:  # tkinter.TclError, for an unknown color
+                value = None
+        if value is not None:
+            _colors[color] = value
+    return value
@@ -0,0 +1,315 @@
+"""Output ports, to which display, print and newline write, and input ports,
+from which read parses data.
+
+Each global frame has a current output port, which starts as a port to the
+standard output.  Ports buffer what is written to them, so that a program that
+displays many small values writes them to the file in a few large strings.  A
+port is flushed when SIZE characters are pending, after each newline if it is
+line-buffered (as the standard output is in an interactive session), when it
+is flushed or closed explicitly, after each expression evaluated by the
+read-eval-print loop, and when Python exits.
+
+String ports collect their output in memory instead:
+
+    >>> import scheme
+    >>> interpreter = scheme.Interpreter()
+    >>> interpreter.eval('''
+    ...     (define port (open-output-string))
+    ...     (display "x = " port)
+    ...     (print 3 port)
+    ...     (get-output-string port)''')
+    '"x = 3\\\\n"'
+    >>> interpreter.eval('(with-output-to-string (lambda () (display (list 1 2))))')
+    '"(1 2)"'
+
+An input port reads the lines of its file only as they are needed to parse the
+next datum, so file->stream makes a stream of the data in a file of any size
+that a program can walk in constant memory.
+
+    >>> interpreter.eval('''
+    ...     (define port (open-input-string "(1 2) x 3"))
+    ...     (list (read port) (read port))''')
+    Pair(Pair(1, Pair(2, nil)), Pair('x', nil))
+    >>> interpreter.eval('(list (read port) (eof-object? (read port)))')
+    Pair(3, Pair(True, nil))
+"""
+
+from __future__ import print_function  # Python 2 compatibility
+
+import atexit
+import io
+import json
+import sys
+import weakref
+
+from buffer import Buffer
+from scheme_builtins import SchemeError, builtin, check_type, scheme_stringp
+from scheme_reader import Pair, nil, repl_str, scheme_read
+from scheme_tokens import tokenize_lines
+import scheme
+
+BUFFER_SIZE = 1 << 16  # Characters pending before a port is flushed
+
+_ports = weakref.WeakSet()  # Every open port, flushed at exit
+
+class OutputPort(object):
+    """A port that writes to the Python text file FILE, or to sys.stdout as it
+    is when the port is flushed if FILE is None."""
+
+    def __init__(self, file=None, line_buffered=False, size=BUFFER_SIZE):
+        self.file = file
+        self.line_buffered = line_buffered
+        self.size = size
+        self.pending, self.length = [], 0
+        self.closed = False
+        _ports.add(self)
+
+    def __str__(self):
+        return '#[output-port]'
+
+    def write(self, s):
+        """Write the string S, which is flushed with the rest of the pending
+        output once SIZE characters are pending or, if SELF is line-buffered,
+        once S contains a newline."""
+        if self.closed:
+            raise SchemeError('cannot write to a closed port')
+        self.pending.append(s)
+        self.length += len(s)
+        if self.length >= self.size or (self.line_buffered and '\n' in s):
+            self.flush()
+
+    def flush(self):
+        """Write all pending output to the file."""
+        if self.pending:
+            file = sys.stdout if self.file is None else self.file
+            file.write(''.join(self.pending))
+            self.pending, self.length = [], 0
+            file.flush()
+
+    def close(self):
+        """Flush SELF and close its file.  A port to the standard output is
+        only flushed, so that it stays open for the read-eval-print loop.
+
+        >>> import scheme
+        >>> scheme.Interpreter().eval('(close-port (current-output-port)) 1')
+        1
+        """
+        if self.file is None:
+            self.flush()
+        elif not self.closed:
+            self.flush()
+            self.file.close()
+            self.closed = True
+            _ports.discard(self)
+
+class StringPort(OutputPort):
+    """A port that collects its output in a string."""
+
+    def __init__(self):
+        OutputPort.__init__(self, io.StringIO())
+
+    def close(self):
+        self.flush()
+        self.closed = True
+        _ports.discard(self)
+
+    def getvalue(self):
+        """Return everything written to SELF as a Python string."""
+        self.flush()
+        return self.file.getvalue()
+
+class InputPort(object):
+    """A port that reads data from the Python text file FILE."""
+
+    def __init__(self, file):
+        self.file = file
+        self.buffer = Buffer(tokenize_lines(file))
+        self.closed = False
+
+    def __str__(self):
+        return '#[input-port]'
+
+    def read(self):
+        """Parse and return the next datum, or EOF if none remain."""
+        if self.closed:
+            raise SchemeError('cannot read from a closed port')
+        try:
+            if self.buffer.current() is None:
+                return EOF
+            return scheme_read(self.buffer)
+        except (SyntaxError, ValueError) as err:
+            raise SchemeError(err)
+
+    def close(self):
+        """Close the file of SELF."""
+        if not self.closed:
+            self.file.close()
+            self.closed = True
+
+class EofObject(object):
+    """The value that read returns at the end of a file."""
+
+    def __str__(self):
+        return '#[eof]'
+
+    def __reduce__(self):
+        return 'EOF'
+
+EOF = EofObject()
+
+@atexit.register
+def _flush_ports():
+    for port in list(_ports):
+        port.flush()
+
+def output_port(env):
+    """Return the current output port of ENV."""
+    return env.globals.output
+
+def _port(args, name):
+    """Return the port given as the last of ARGS, which are followed by an
+    environment, or the current output port of that environment."""
+    args, env = args[:-1], args[-1]
+    if len(args) > 1:
+        raise SchemeError('too many arguments to {0}'.format(name))
+    elif args:
+        return check_type(args[0], scheme_output_portp, 1, name)
+    return output_port(env)
+
+#####################
+# Output Procedures #
+#####################
+
+def scheme_display(val, *args):
+    port = _port(args, 'display')
+    if scheme_stringp(val):
+        val = eval(val)
+    port.write(repl_str(val))
+
+def scheme_print(val, *args):
+    port = _port(args, 'print')
+    port.write(repl_str(val))
+    port.write('\n')
+
+def scheme_newline(*args):
+    _port(args, 'newline').write('\n')
+
+def scheme_flush_output(*args):
+    _port(args, 'flush-output').flush()
+
+def scheme_current_output_port(env):
+    return output_port(env)
+
+def scheme_with_output_to_string(thunk, env):
+    """Apply THUNK to no arguments with a new string port as the current
+    output port of ENV, and return the Scheme string written to it."""
+    port, previous = StringPort(), env.globals.output
+    env.globals.output = port
+    try:
+        scheme.complete_apply(thunk, nil, env)
+    finally:
+        env.globals.output = previous
+    return json.dumps(port.getvalue())
+
+def scheme_file_to_stream(source, env):
+    """Return a stream of the data in SOURCE, the name of a file or an input
+    port.  Each datum is read when the stream before it is forced.
+
+    >>> import os, scheme, tempfile
+    >>> filename = os.path.join(tempfile.mkdtemp(), 'data.scm')
+    >>> with open(filename, 'w') as f:
+    ...     _ = f.write('(a 1)\\n(b 2) (c 3)\\n')
+    >>> interpreter = scheme.Interpreter()
+    >>> print(interpreter.eval('(define s (file->stream "{0}")) s'.format(filename)))
+    ((a 1) . #[promise (not forced)])
+    >>> interpreter.eval('(car (cdr-stream (cdr-stream s)))')
+    Pair('c', Pair(3, nil))
+    """
+    if scheme_stringp(source):
+        source = scheme_open_input_file(source)
+    check_type(source, scheme_input_portp, 0, 'file->stream')
+    return _stream(source, env.globals)
+
+def _stream(port, env):
+    """Return a stream of the data that remain in PORT, which is closed at
+    its end.  The rest of the stream is a promise to call a built-in
+    procedure that reads the next datum, in the global frame ENV."""
+    datum = port.read()
+    if datum is EOF:
+        port.close()
+        return nil
+    rest = scheme.BuiltinProcedure(lambda: _stream(port, env),
+                                   name='file->stream')
+    call = Pair(Pair('quote', Pair(rest, nil)), nil)
+    return Pair(datum, scheme.Promise(call, env))
+
+@builtin("output-port?")
+def scheme_output_portp(x):
+    return isinstance(x, OutputPort)
+
+@builtin("open-output-string")
+def scheme_open_output_string():
+    return StringPort()
+
+@builtin("get-output-string")
+def scheme_get_output_string(port):
+    check_type(port, lambda x: isinstance(x, StringPort), 0, 'get-output-string')
+    return json.dumps(port.getvalue())
+
+@builtin("open-output-file")
+def scheme_open_output_file(filename):
+    check_type(filename, scheme_stringp, 0, 'open-output-file')
+    try:
+        return OutputPort(open(eval(filename), 'w'))
+    except IOError as exc:
+        raise SchemeError(str(exc))
+
+@builtin("close-output-port")
+def scheme_close_output_port(port):
+    check_type(port, scheme_output_portp, 0, 'close-output-port')
+    port.close()
+
+####################
+# Input Procedures #
+####################
+
+@builtin("input-port?")
+def scheme_input_portp(x):
+    return isinstance(x, InputPort)
+
+@builtin("open-input-file")
+def scheme_open_input_file(filename):
+    check_type(filename, scheme_stringp, 0, 'open-input-file')
+    try:
+        return InputPort(open(eval(filename)))
+    except IOError as exc:
+        raise SchemeError(str(exc))
+
+@builtin("open-input-string")
+def scheme_open_input_string(s):
+    check_type(s, scheme_stringp, 0, 'open-input-string')
+    return InputPort(io.StringIO(eval(s)))
+
+@builtin("read")
+def scheme_read_datum(port):
+    check_type(port, scheme_input_portp, 0, 'read')
+    return port.read()
+
+@builtin("eof-object")
+def scheme_eof_object():
+    return EOF
+
+@builtin("eof-object?")
+def scheme_eof_objectp(x):
+    return x is EOF
+
+@builtin("close-input-port")
+def scheme_close_input_port(port):
+    check_type(port, scheme_input_portp, 0, 'close-input-port')
+    port.close()
+
+@builtin("close-port")
+def scheme_close_port(port):
+    check_type(port, lambda x: scheme_input_portp(x) or scheme_output_portp(x),
+               0, 'close-port')
+    port.close()
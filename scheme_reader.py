@@ -22,7 +22,6 @@ import numbers
 from ucb import main, trace, interact
 from scheme_tokens import tokenize_lines, DELIMITERS
 from buffer import Buffer, InputReader, LineReader
-import scheme
 
 # Pairs and Scheme lists
 
@@ -36,6 +35,14 @@ class Pair(object):
     (1 2)
     >>> print(s.map(lambda x: x+4))
     (5 6)
+
+    Lists are walked with loops, so long lists can be compared and printed.
+
+    >>> big = _make_list(range(10 ** 6))
+    >>> big == _make_list(range(10 ** 6)), big == _make_list(range(5))
+    (True, False)
+    >>> len(big), repr(big).endswith('Pair(999999, nil' + ')' * 10 ** 6)
+    (1000000, True)
     """
     def __init__(self, first, rest):
         from scheme_builtins import scheme_valid_cdrp, SchemeError
@@ -46,7 +53,11 @@ class Pair(object):
         self.rest = rest
 
     def __repr__(self):
-        return 'Pair({0}, {1})'.format(repr(self.first), repr(self.rest))
+        parts, rest = [], self
+        while isinstance(rest, Pair):
+            parts.append('Pair({0}, '.format(repr(rest.first)))
+            rest = rest.rest
+        return ''.join(parts) + repr(rest) + ')' * len(parts)
 
     def __str__(self):
         s = '(' + repl_str(self.first)
@@ -67,27 +78,62 @@ class Pair(object):
             raise TypeError('length attempted on improper list')
         return n
 
+    def __reduce_ex__(self, protocol):
+        """Pickle a list as its elements, so that long lists do not exhaust
+        the recursion limit of pickle.  Cyclic lists are pickled pair by pair."""
+        items, rest, seen = [], self, set()
+        while isinstance(rest, Pair):
+            if id(rest) in seen:
+                return object.__reduce_ex__(self, protocol)
+            seen.add(id(rest))
+            items.append(rest.first)
+            rest = rest.rest
+        return _make_list, (items, rest)
+
     def __eq__(self, p):
-        if not isinstance(p, Pair):
-            return False
-        return self.first == p.first and self.rest == p.rest
+        s = self
+        while isinstance(s, Pair):
+            if not isinstance(p, Pair) or not s.first == p.first:
+                return False
+            s, p = s.rest, p.rest
+        return s == p
 
     def map(self, fn):
-        """Return a Scheme list after mapping Python function FN to SELF."""
-        mapped = fn(self.first)
-        if self.rest is nil or isinstance(self.rest, Pair):
-            return Pair(mapped, self.rest.map(fn))
-        else:
+        """Return a Scheme list after mapping Python function FN to SELF.
+
+        The result is built front to back, so the length of SELF is not
+        limited by the recursion limit.
+
+        >>> s = _make_list(range(10 ** 6))
+        >>> t = s.map(lambda x: x * 2)
+        >>> len(t), t.first, t.rest.first
+        (1000000, 0, 2)
+        """
+        head = last = Pair(fn(self.first), nil)
+        rest = self.rest
+        while isinstance(rest, Pair):
+            last.rest = Pair(fn(rest.first), nil)
+            last, rest = last.rest, rest.rest
+        if rest is not nil:
             raise TypeError('ill-formed list (cdr is a promise)')
+        return head
 
     def flatmap(self, fn):
-        """Return a Scheme list after flatmapping Python function FN to SELF."""
+        """Return a Scheme list after flatmapping Python function FN to SELF.
+
+        >>> s = _make_list(range(10 ** 6))
+        >>> t = s.flatmap(lambda x: Pair(x, Pair(x, nil)))
+        >>> len(t)
+        2000000
+        """
         from scheme_builtins import scheme_append
-        mapped = fn(self.first)
-        if self.rest is nil or isinstance(self.rest, Pair):
-            return scheme_append(mapped, self.rest.flatmap(fn))
-        else:
+        mapped, rest = [fn(self.first)], self.rest
+        while isinstance(rest, Pair):
+            mapped.append(fn(rest.first))
+            rest = rest.rest
+        if rest is not nil:
             raise TypeError('ill-formed list (cdr is a promise)')
+        return scheme_append(*mapped)
 
 
 class nil(object):
@@ -108,8 +154,42 @@ class nil(object):
     def flatmap(self, fn):
         return self
 
+    def __reduce__(self):
+        return 'nil'
+
 nil = nil() # Assignment hides the nil class; there is only one instance
 
+class Vector(object):
+    """A vector has one instance attribute: items, a Python list of its
+    elements, so that each element is accessed in constant time.
+
+    >>> v = Vector([1, Pair(2, nil), True])
+    >>> v
+    Vector([1, Pair(2, nil), True])
+    >>> print(v)
+    #(1 (2) #t)
+    """
+    def __init__(self, items):
+        self.items = items
+
+    def __repr__(self):
+        return 'Vector({0})'.format(repr(self.items))
+
+    def __str__(self):
+        return '#(' + ' '.join(repl_str(item) for item in self.items) + ')'
+
+    def __len__(self):
+        return len(self.items)
+
+    def __eq__(self, v):
+        return isinstance(v, Vector) and self.items == v.items
+
+def _make_list(items, rest=nil):
+    """Return a Scheme list of ITEMS that ends with REST."""
+    for item in reversed(items):
+        rest = Pair(item, rest)
+    return rest
+
 # Scheme list parser
 
 # Quotation markers
@@ -128,6 +208,8 @@ def scheme_read(src):
     True
     >>> scheme_read(Buffer(tokenize_lines(['(+ 1 2)'])))
     Pair('+', Pair(1, Pair(2, nil)))
+    >>> scheme_read(Buffer(tokenize_lines(['#(1 (2) #(a))'])))
+    Vector([1, Pair(2, nil), Vector(['a'])])
     """
     if src.current() is None:
         raise EOFError
@@ -140,6 +222,14 @@ def scheme_read(src):
         # BEGIN PROBLEM 1
         return read_tail(src)
         # END PROBLEM 1
+    elif val == '#(':
+        items = []
+        while src.current() != ')':
+            if src.current() is None:
+                raise SyntaxError('unexpected end of file')
+            items.append(scheme_read(src))
+        src.pop_first()
+        return Vector(items)
     elif val in quotes:
         # BEGIN PROBLEM 6
         "*** YOUR CODE HERE ***"
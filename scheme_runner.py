@@ -0,0 +1,260 @@
+"""A parallel runner for Scheme test files annotated with "; expect" comments.
+
+A test file such as tests.scm is split into cases.  Each case is the source
+that precedes a group of "; expect" lines, and those lines give the output
+that evaluating the case should print.  Cases are divided into contiguous
+shards that run on a pool of worker processes.  Each shard starts from a fresh
+global frame and first replays the top-level definitions of all earlier cases,
+including those in top-level begin forms, so that definitions are carried
+forward as in a serial run.  Only definitions are replayed: other side effects
+of an earlier case, such as mutating a defined list with set-car! or writing a
+file, are not, so a case that depends on them may fail when it runs in a
+different shard.  Use one shard (--shards 1) for such files.
+"""
+
+from __future__ import print_function  # Python 2 compatibility
+
+import re
+import sys
+import time
+
+import scheme
+import scheme_ports
+from scheme_reader import (Buffer, Pair, buffer_lines, repl_str, scheme_read,
+                           tokenize_lines)
+from ucb import main
+
+EXPECT = re.compile(r'^\s*;\s*expect\s(.*)$')
+DEFINITION_FORMS = ('define', 'define-macro')
+
+class Case(object):
+    """A test case: the source LINES that start at line number LINENO of FILE,
+    the output lines EXPECTED from running them, and the DEFINITIONS (source
+    strings of top-level define forms) that later cases depend on."""
+
+    def __init__(self, file, lineno, lines, expected):
+        self.file = file
+        self.lineno = lineno
+        self.lines = lines
+        self.expected = expected
+        self.definitions = []
+
+    @property
+    def name(self):
+        return '{0}:{1}'.format(self.file, self.lineno)
+
+    @property
+    def summary(self):
+        """The last non-blank, non-comment line of source in this case."""
+        for line in reversed(self.lines):
+            line = line.strip()
+            if line and not line.startswith(';'):
+                return line
+        return ''
+
+class Result(object):
+    """The outcome of running the INDEX-th case of a file."""
+
+    def __init__(self, index, actual, elapsed, passed):
+        self.index = index
+        self.actual = actual
+        self.elapsed = elapsed
+        self.passed = passed
+
+def parse_cases(lines, file='<input>'):
+    """Split the source LINES of an expect-annotated file into Cases.  Parsing
+    stops at a top-level (exit), which ends a test file.
+
+    >>> cases = parse_cases(['(define x 2)', '; expect x', '',
+    ...                      '(* x 3)', '; expect 6', '(exit)', '1'])
+    >>> [(c.lineno, c.lines, c.expected) for c in cases]
+    [(1, ['(define x 2)'], ['x']), (4, ['(* x 3)'], ['6'])]
+    >>> cases[0].definitions, cases[1].definitions
+    (['(define x 2)'], [])
+    """
+    cases, source, expected, start = [], [], [], 1
+    for lineno, line in enumerate(lines, 1):
+        line = line.rstrip('\n')
+        match = EXPECT.match(line)
+        if match:
+            expected.extend(s.strip() for s in match.group(1).split(' ; '))
+            continue
+        if expected:
+            cases.append(Case(file, start, source, expected))
+            source, expected, start = [], [], lineno
+        if line.strip() == '(exit)':
+            break
+        source.append(line)
+    else:
+        if expected:
+            cases.append(Case(file, start, source, expected))
+    for case in cases:
+        case.definitions = _definitions(case.lines)
+        while case.lines and not case.lines[0].strip():
+            case.lines.pop(0)
+            case.lineno += 1
+    return cases
+
+def _definitions(lines):
+    """Return the source of each top-level definition in LINES, including
+    those nested in top-level begin forms.
+
+    >>> _definitions(['(begin (define x 1) (begin (define-macro (m) 2)))',
+    ...               '(define (f) x) (display x) (begin (print x))'])
+    ['(define x 1)', '(define-macro (m) 2)', '(define (f) x)']
+    """
+    definitions = []
+    def collect(expr):
+        if not isinstance(expr, Pair):
+            return
+        if expr.first in DEFINITION_FORMS:
+            definitions.append(repl_str(expr))
+        elif expr.first == 'begin':
+            body = expr.rest
+            while isinstance(body, Pair):
+                collect(body.first)
+                body = body.rest
+    try:
+        src = Buffer(tokenize_lines(lines))
+        while src.current() is not None:
+            collect(scheme_read(src))
+    except (SyntaxError, ValueError, EOFError):
+        pass
+    return definitions
+
+def check_output(expected, actual):
+    """Return whether the ACTUAL lines of output end with the EXPECTED lines.
+    Output printed before them, such as the names of unannotated definitions,
+    is ignored.  An expected line of "Error" matches any error message.
+
+    >>> check_output(['1', 'Error'], ['f', '1', 'Error: unknown identifier: x'])
+    True
+    >>> check_output(['1', '2'], ['2'])
+    False
+    """
+    if len(expected) > len(actual):
+        return False
+    for e, a in zip(expected, actual[len(actual) - len(expected):]):
+        if e != a and not (e == 'Error' and a.startswith('Error')):
+            return False
+    return True
+
+def _evaluate(lines, env, quiet):
+    """Run LINES of source through the read-eval-print loop in ENV and return
+    the non-blank lines that it prints."""
+    out, lines = scheme_ports.StringPort(), list(lines)
+    previous, env.output = env.output, out
+    def next_line():
+        return buffer_lines(lines, None)
+    try:
+        scheme.read_eval_print_loop(next_line, env, quiet=quiet)
+    finally:
+        env.output = previous
+    return [line.strip() for line in out.getvalue().splitlines() if line.strip()]
+
+def run_shard(cases, indices):
+    """Run the cases at INDICES (ascending) in a fresh global frame, replaying
+    the definitions of every skipped case first.  Returns a list of Results.
+
+    >>> cases = parse_cases(['(begin (define x 3) (define y x))', '; expect y',
+    ...                      '(* y 2)', '; expect 6'])
+    >>> [(r.actual, r.passed) for r in run_shard(cases, [1])]
+    [(['6'], True)]
+    """
+    env = scheme.create_global_frame()
+    results, done = [], 0
+    for index in indices:
+        prelude = [d for case in cases[done:index] for d in case.definitions]
+        if prelude:
+            _evaluate(prelude, env, True)
+        case = cases[index]
+        start = time.time()
+        actual = _evaluate(case.lines, env, False)
+        elapsed = time.time() - start
+        results.append(Result(index, actual, elapsed,
+                              check_output(case.expected, actual)))
+        done = index + 1
+    return results
+
+def _run_shard(args):
+    return run_shard(*args)
+
+def make_shards(n, count):
+    """Split range(N) into at most COUNT contiguous, nearly equal shards.
+
+    >>> make_shards(7, 3)
+    [[0, 1, 2], [3, 4], [5, 6]]
+    """
+    count = max(1, min(n, count))
+    size, extra = divmod(n, count)
+    shards, start = [], 0
+    for k in range(count):
+        end = start + size + (k < extra)
+        shards.append(list(range(start, end)))
+        start = end
+    return shards
+
+def run_cases(cases, jobs=1, shards=None):
+    """Run CASES on JOBS worker processes and return Results in case order."""
+    shards = make_shards(len(cases), shards or jobs * 2)
+    if jobs <= 1 or len(shards) <= 1:
+        batches = [run_shard(cases, indices) for indices in shards]
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(jobs) as pool:
+            batches = list(pool.map(_run_shard,
+                                    [(cases, indices) for indices in shards]))
+    return sorted((r for batch in batches for r in batch),
+                  key=lambda r: r.index)
+
+def report(cases, results, elapsed, verbose=False, slowest=5, jobs=1,
+           out=sys.stdout):
+    """Print per-case outcomes, a summary, and the SLOWEST cases to OUT."""
+    failed = 0
+    for result in results:
+        case = cases[result.index]
+        if not result.passed:
+            failed += 1
+            print('FAILED', case.name, file=out)
+            print('    expected:', ' ; '.join(case.expected), file=out)
+            print('    actual:  ', ' ; '.join(result.actual), file=out)
+        elif verbose:
+            print('ok    ', case.name, '({0:.1f} ms)'.format(
+                result.elapsed * 1000), file=out)
+    print('{0} cases: {1} passed, {2} failed in {3:.2f}s ({4} {5})'.format(
+        len(results), len(results) - failed, failed, elapsed, jobs,
+        'worker' if jobs == 1 else 'workers'), file=out)
+    if slowest:
+        print('Slowest cases:', file=out)
+        for result in sorted(results, key=lambda r: -r.elapsed)[:slowest]:
+            case = cases[result.index]
+            print('  {0:8.1f} ms  {1}  {2}'.format(
+                result.elapsed * 1000, case.name, case.summary), file=out)
+    return failed
+
+@main
+def run(*argv):
+    import argparse
+    import os
+    parser = argparse.ArgumentParser(
+        description='Run Scheme files annotated with "; expect" comments')
+    parser.add_argument('files', nargs='+', help='Scheme test files')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1,
+                        help='number of worker processes')
+    parser.add_argument('--shards', type=int, default=None,
+                        help='number of shards per file (default: 2 per job)')
+    parser.add_argument('--slowest', type=int, default=5,
+                        help='number of slowest cases to report')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='report passing cases too')
+    args = parser.parse_args()
+
+    failed = 0
+    for file in args.files:
+        with open(file) as infile:
+            cases = parse_cases(infile.readlines(), file)
+        start = time.time()
+        results = run_cases(cases, args.jobs, args.shards)
+        failed += report(cases, results, time.time() - start, args.verbose,
+                         args.slowest, args.jobs)
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,252 @@
+"""An asyncio server that evaluates Scheme for many concurrent clients.
+
+    python scheme.py --serve 127.0.0.1:8765 [-i prelude.scm] [--image FILE]
+    python scheme.py --serve /tmp/scheme.sock
+
+Each client connection is a session with its own global frame, which starts
+as a copy of the environment that the server was started with, so files and
+images are loaded once rather than once per client.  Requests and responses
+are JSON objects, one per line.  A request holds Scheme source, and optionally
+a "timeout" in seconds that may only shorten the server's time limit:
+
+    {"id": 1, "source": "(define x 2) (* x 3)"}
+    {"id": 1, "values": ["x", "6"], "output": "", "error": null}
+
+Evaluation happens on a single interpreter thread.  An evaluation that exceeds
+its time limit is interrupted and answered with an error.  The interrupt takes
+effect only between Python bytecodes, so a single long operation in C, such as
+(expt 7 100000000) or the product of two huge integers, runs to completion
+first, and every session waits for it.  Serve only clients that are trusted
+not to send such requests.
+
+Each session has at most one request in progress, and at most MAX_PENDING
+requests wait for the interpreter thread at a time; clients beyond that are not
+read from until there is room, so that the operating system applies
+backpressure.
+"""
+
+from __future__ import print_function  # Python 2 compatibility
+
+import asyncio
+import ctypes
+import json
+import queue
+import sys
+import threading
+
+import scheme
+import scheme_pickle
+import scheme_ports
+from scheme_builtins import SchemeError
+from scheme_reader import repl_str
+
+MAX_REQUEST = 1 << 20  # Longest request line, in bytes
+MAX_PENDING = 64
+
+class TimeLimitExceeded(SchemeError):
+    """Raised in the interpreter thread when an evaluation runs too long."""
+
+    def __str__(self):
+        return 'time limit exceeded'
+
+class Session(object):
+    """A client session, whose global frame is loaded from BINDINGS."""
+
+    def __init__(self, bindings):
+        self.interpreter = scheme.Interpreter()
+        scheme_pickle.load_bindings(bindings, self.interpreter.env)
+        self.closed = False
+
+    def evaluate(self, source):
+        """Evaluate all expressions in the string SOURCE and return a response
+        with their values and everything that they printed."""
+        values, error, out = [], None, scheme_ports.StringPort()
+        self.interpreter.env.output = out
+        try:
+            for expr in self.interpreter.parse(source):
+                result = self.interpreter.eval(scheme.Program([expr]))
+                if result is not None:
+                    values.append(repl_str(result))
+        except (SchemeError, ValueError, RuntimeError) as err:
+            if isinstance(err, RecursionError):
+                error = 'maximum recursion depth exceeded'
+            else:
+                error = str(err)
+        except EOFError:  # (exit)
+            self.closed = True
+        return {'values': values, 'output': out.getvalue(), 'error': error}
+
+class InterpreterThread(threading.Thread):
+    """The thread on which all evaluation happens, one job at a time."""
+
+    def __init__(self):
+        threading.Thread.__init__(self, daemon=True)
+        self.jobs = queue.Queue()
+        self.lock = threading.Lock()
+        self.current = None
+
+    def submit(self, fn, *args):
+        """Run FN(*ARGS) on this thread and return an asyncio future."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.jobs.put((fn, args, future, loop))
+        return future
+
+    def interrupt(self, future):
+        """Raise TimeLimitExceeded in the job for FUTURE if it is running."""
+        with self.lock:
+            if self.current is not None and self.current[2] is future:
+                ctypes.pythonapi.PyThreadState_SetAsyncExc(
+                    ctypes.c_ulong(self.ident),
+                    ctypes.py_object(TimeLimitExceeded))
+
+    def run(self):
+        while True:
+            job = self.jobs.get()
+            fn, args, future, loop = job
+            result, error = None, TimeLimitExceeded()
+            try:
+                try:
+                    with self.lock:
+                        self.current = job
+                    result, error = fn(*args), None
+                except Exception as err:
+                    error = err
+                finally:
+                    self.finish()
+            except TimeLimitExceeded:  # Delivered after its job had finished
+                self.finish()
+            loop.call_soon_threadsafe(_resolve, future, result, error)
+
+    def finish(self):
+        """End the current job, discarding an interrupt not yet delivered."""
+        with self.lock:
+            self.current = None
+            ctypes.pythonapi.PyThreadState_SetAsyncExc(
+                ctypes.c_ulong(self.ident), None)
+
+def _resolve(future, result, error):
+    if future.cancelled():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+class Server(object):
+    """Serves sessions whose global frames start from the bindings of ENV.
+
+    >>> async def session(*requests):
+    ...     server = Server(scheme.create_global_frame(), timeout=0.5)
+    ...     host = '127.0.0.1'
+    ...     listener = await asyncio.start_server(server.handle, host, 0)
+    ...     port = listener.sockets[0].getsockname()[1]
+    ...     reader, writer = await asyncio.open_connection(host, port)
+    ...     for request in requests:
+    ...         writer.write(request.encode('utf-8') + b'\\n')
+    ...         reply = json.loads(await reader.readline())
+    ...         print(reply['id'], reply.get('values'), reply['error'])
+    ...     await reader.read()  # The server closes the session after (exit)
+    ...     writer.close()
+    ...     await writer.wait_closed()
+    ...     listener.close()
+    ...     await listener.wait_closed()
+    >>> asyncio.run(session(
+    ...     '{"id": 1, "source": "(define x 2)"}',
+    ...     '{"id": 2, "timeout": 0.1, "source": "(define (f n) (if (= n 0) 0 '
+    ...     '(+ (f (- n 1)) (f (- n 1))))) (f 40)"}',
+    ...     '{"id": 3, "source": 4}',
+    ...     '{"id": 4, "source": "(sqrt -1)"}',
+    ...     '{"id": 5, "source": "(* x 3) (exit)"}'))
+    1 ['x'] None
+    2 ['f'] time limit exceeded
+    3 None bad request: source must be a string
+    4 [] math domain error
+    5 ['6'] None
+    """
+
+    def __init__(self, env, timeout=10, max_pending=MAX_PENDING):
+        self.bindings = scheme_pickle.dump_bindings(env)
+        self.timeout = timeout
+        self.thread = InterpreterThread()
+        self.thread.start()
+        self.pending = asyncio.Semaphore(max_pending)
+
+    async def run(self, fn, *args, timeout=None):
+        """Run FN(*ARGS) on the interpreter thread within TIMEOUT seconds."""
+        async with self.pending:
+            future = self.thread.submit(fn, *args)
+            done, _ = await asyncio.wait({future}, timeout=timeout)
+            if not done:
+                self.thread.interrupt(future)
+            return await future
+
+    async def handle(self, reader, writer):
+        """Serve one client session."""
+        try:
+            session = await self.run(Session, self.bindings)
+            while not session.closed:
+                try:
+                    line = await reader.readline()
+                except ValueError:  # The request exceeded MAX_REQUEST
+                    await self.respond(writer, {'error': 'request too long'})
+                    break
+                if not line:
+                    break
+                response = await self.request(session, line)
+                await self.respond(writer, response)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def request(self, session, line):
+        """Evaluate one request LINE in SESSION and return the response."""
+        request = None
+        try:
+            request = json.loads(line)
+            source = request['source']
+            if not isinstance(source, str):
+                raise TypeError('source must be a string')
+            timeout = min(float(request.get('timeout', self.timeout)),
+                          self.timeout)
+        except (ValueError, KeyError, TypeError, AttributeError) as err:
+            response = {'error': 'bad request: {0}'.format(err)}
+        else:
+            try:
+                response = await self.run(session.evaluate, source,
+                                          timeout=timeout)
+            except Exception as err:  # A response is owed for every request
+                response = {'values': [], 'output': '', 'error': str(err)}
+        if isinstance(request, dict) and 'id' in request:
+            response['id'] = request['id']
+        return response
+
+    async def respond(self, writer, response):
+        writer.write(json.dumps(response).encode('utf-8') + b'\n')
+        await writer.drain()
+
+async def _serve(address, env, timeout, max_pending):
+    server = Server(env, timeout, max_pending)
+    if ':' in address:
+        host, port = address.rsplit(':', 1)
+        listener = await asyncio.start_server(server.handle, host, int(port),
+                                              limit=MAX_REQUEST)
+    else:
+        listener = await asyncio.start_unix_server(server.handle, address,
+                                                   limit=MAX_REQUEST)
+    print('Serving Scheme sessions on', address, file=sys.stderr)
+    async with listener:
+        await listener.serve_forever()
+
+def serve(address, env, timeout=10, max_pending=MAX_PENDING):
+    """Serve sessions that start from the global frame of ENV on ADDRESS, which
+    is either HOST:PORT or the path of a Unix socket."""
+    try:
+        asyncio.run(_serve(address, env, timeout, max_pending))
+    except KeyboardInterrupt:
+        pass
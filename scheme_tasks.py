@@ -0,0 +1,521 @@
+"""Evaluation of Scheme programs as tasks with step and memory budgets.
+
+A Task evaluates a program with a stepping evaluator, which mirrors scheme_eval
+but counts each evaluation of an expression as a step.  Evaluation is written
+as Python generators, so a task that runs out of steps in the middle of an
+expression is suspended where it stands and can later be resumed.
+
+A Scheduler interleaves many tasks in one thread.  It runs each ready task for
+a slice of steps in turn.  A task may also have a fuel budget (a total number
+of steps) and a memory budget (a number of allocated blocks, as counted by
+sys.getallocatedblocks, that the task may retain).  A task that exhausts a
+budget is suspended, not killed, and continues after its budget is raised.
+
+    >>> import scheme
+    >>> env = scheme.create_global_frame()
+    >>> scheduler = Scheduler(slice=100)
+    >>> fact = scheduler.spawn('''
+    ...     (define (fact n) (if (= n 0) 1 (* n (fact (- n 1)))))
+    ...     (fact 10)''', env, fuel=100)
+    >>> scheduler.run()
+    >>> fact.state, fact.steps
+    ('suspended', 100)
+    >>> scheduler.resume(fact, fuel=1000)
+    >>> scheduler.run()
+    >>> fact.state, fact.value, fact.steps
+    ('done', 3628800, 150)
+
+A task whose evaluation raises an error fails, and keeps the error.
+
+    >>> bad = scheduler.spawn('(expt 0.0 -1)', env)
+    >>> scheduler.run()
+    >>> bad.state, str(bad.error)
+    ('failed', '0.0 cannot be raised to a negative power')
+
+Tasks are also the green threads of Scheme programs: (spawn THUNK) schedules a
+task that calls THUNK on the scheduler of the global frame, and a task ends its
+slice early at (yield) or when it receives from an empty channel.
+
+    >>> interpreter = scheme.Interpreter()
+    >>> interpreter.eval('''
+    ...     (define c (make-channel))
+    ...     (spawn (lambda () (channel-send c (* 6 (channel-receive c)))))
+    ...     (yield)
+    ...     (channel-send c 7)
+    ...     (yield)
+    ...     (channel-receive c)''')
+    42
+"""
+
+from __future__ import print_function  # Python 2 compatibility
+
+import collections
+import sys
+
+from scheme import (BuiltinProcedure, Channel, Continuation,
+                    ContinuationInvoked, Pair, Program, Promise, SPECIAL_FORMS,
+                    SchemeError, check_form, check_formals, check_procedure,
+                    check_type, closure_env, complete_apply, nil, repl_str, scheme_call_cc,
+                    scheme_cdr_stream, scheme_channel_receive,
+                    scheme_dynamic_wind, scheme_eval, scheme_filter,
+                    scheme_force, scheme_listp, scheme_map, scheme_procedurep,
+                    scheme_reduce, scheme_spawn, scheme_symbolp, scheme_truep,
+                    scheme_yield, self_evaluating)
+from scheme_optimize import SIMPLIFIED
+import scheme
+
+DEFAULT_SLICE = 1000
+
+READY, BLOCKED, SUSPENDED = 'ready', 'blocked', 'suspended'
+DONE, FAILED = 'done', 'failed'
+
+class _Signal(object):
+    """Yielded by the stepping evaluator to end the slice of a task."""
+
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return self.name
+
+OUT_OF_STEPS = _Signal('OUT_OF_STEPS')  # The slice is used up
+YIELD = _Signal('YIELD')                # The task yields to other tasks
+BLOCK = _Signal('BLOCK')                # The task waits to be woken
+
+class Task(object):
+    """The evaluation of PROGRAM (a Program, source string, or expression) in
+    environment ENV, with optional FUEL and MEMORY budgets.  PROGRAM may also
+    be a procedure of no arguments, which the task calls."""
+
+    def __init__(self, program, env, fuel=None, memory=None):
+        if scheme_procedurep(program):
+            self._gen = self._apply(program, nil, env)
+        else:
+            if isinstance(program, str):
+                program = scheme.Interpreter(env).parse(program)
+            if not isinstance(program, Program):
+                program = Program([program])
+            self._gen = self._eval_sequence(program.expressions, env)
+        self.env = env
+        env.capture()
+        self.scheduler = None
+        self.fuel = fuel
+        self.memory = memory
+        self.steps = 0
+        self.allocated = 0
+        self.state = READY
+        self.reason = None
+        self.value = None
+        self.error = None
+        self.budget = 0
+
+    def __str__(self):
+        return '#[task ({0})]'.format(self.state)
+
+    def run(self, steps):
+        """Run for at most STEPS steps, within the fuel and memory budgets.
+        Returns the state of the task afterward."""
+        if self.state != READY:
+            return self.state
+        if self.fuel is not None:
+            steps = min(steps, self.fuel - self.steps)
+        self.budget = steps
+        blocks = sys.getallocatedblocks()
+        try:
+            if self._gen.send(None) is BLOCK:
+                self.state = BLOCKED
+        except StopIteration as stop:
+            self.state, self.value = DONE, stop.value
+        except (SchemeError, RuntimeError, ValueError) as err:
+            if isinstance(err, RecursionError):
+                err = SchemeError('maximum recursion depth exceeded')
+            self.state, self.error = FAILED, err
+        except ContinuationInvoked as err:  # Of a call/cc in another task
+            self.state, self.error = FAILED, SchemeError(str(err))
+        except EOFError:  # (exit) ends the program as well as the task
+            self.state = DONE
+            raise
+        except Exception as err:  # Raised by a built-in, such as expt
+            self.state, self.error = FAILED, SchemeError(str(err))
+        self.steps += steps - max(self.budget, 0)
+        self.allocated += sys.getallocatedblocks() - blocks
+        if self.state == READY:
+            if self.fuel is not None and self.steps >= self.fuel:
+                self.state, self.reason = SUSPENDED, 'fuel'
+            elif self.memory is not None and self.allocated > self.memory:
+                self.state, self.reason = SUSPENDED, 'memory'
+        return self.state
+
+    # The stepping evaluator.  Each method is a generator that returns the
+    # value of its expression, and yields a _Signal to end the slice.
+
+    def _eval(self, expr, env):
+        self.budget -= 1
+        while self.budget < 0:
+            yield OUT_OF_STEPS
+            self.budget -= 1  # Charge the step to the slice that takes it
+        if scheme_symbolp(expr):
+            return env.lookup(expr)
+        elif self_evaluating(expr):
+            return expr
+        if not scheme_listp(expr):
+            raise SchemeError('malformed list: {0}'.format(repl_str(expr)))
+        first, rest = expr.first, expr.rest
+        if scheme_symbolp(first) and first in SPECIAL_FORMS:
+            form = _FORMS.get(first)
+            if form is None:  # Forms that evaluate no subexpressions
+                return SPECIAL_FORMS[first](rest, env)
+            return (yield from form(self, rest, env))
+        operator = yield from self._eval(first, env)
+        check_procedure(operator)
+        args = []
+        while rest is not nil:
+            args.append((yield from self._eval(rest.first, env)))
+            rest = rest.rest
+        return (yield from self._apply(operator, _list(args), env))
+
+    def _apply(self, procedure, args, env):
+        check_procedure(procedure)
+        if isinstance(procedure, BuiltinProcedure):
+            stepping = _BUILTINS.get(procedure.fn)
+            if stepping is None:
+                return procedure.apply(args, env)
+            if not scheme_listp(args):
+                raise SchemeError('arguments are not in a list: {0}'.format(args))
+            python_args = []
+            while args is not nil:
+                python_args.append(args.first)
+                args = args.rest
+            if procedure.use_env:
+                python_args.append(env)
+            try:
+                gen = stepping(self, *python_args)
+            except TypeError:
+                raise SchemeError('incorrect number of arguments were passed '
+                                  'into the function: {0}'.format(procedure.fn))
+            return (yield from gen)
+        new_env = procedure.make_call_frame(args, env)
+        return (yield from self._eval_sequence(procedure.body, new_env))
+
+    def _eval_sequence(self, expressions, env):
+        """Evaluate a Scheme list or Python list of EXPRESSIONS in ENV and
+        return the value of the last."""
+        value = None
+        if isinstance(expressions, list):
+            expressions = _list(expressions)
+        while expressions is not nil:
+            value = yield from self._eval(expressions.first, env)
+            expressions = expressions.rest
+        return value
+
+    def _force(self, promise):
+        if promise.expression is not None:
+            value = yield from self._eval(promise.expression, promise.env)
+            if not (value is nil or isinstance(value, Pair)):
+                raise SchemeError("result of forcing a promise should be a pair "
+                                  "or nil, but was %s" % value)
+            promise.value = value
+            promise.expression = promise.env = None
+        return promise.value
+
+def _list(values):
+    result = nil
+    for value in reversed(values):
+        result = Pair(value, result)
+    return result
+
+########################
+# Stepping special forms
+########################
+
+def _do_define_form(task, expressions, env):
+    check_form(expressions, 2)
+    target = expressions.first
+    if scheme_symbolp(target):
+        check_form(expressions, 2, 2)
+        value = yield from task._eval(expressions.rest.first, env)
+        env.define(target, value)
+        return target
+    return SPECIAL_FORMS['define'](expressions, env)
+
+def _do_begin_form(task, expressions, env):
+    check_form(expressions, 1)
+    return (yield from task._eval_sequence(expressions, env))
+
+def _do_if_form(task, expressions, env):
+    check_form(expressions, 2, 3)
+    if scheme_truep((yield from task._eval(expressions.first, env))):
+        return (yield from task._eval(expressions.rest.first, env))
+    elif len(expressions) == 3:
+        return (yield from task._eval(expressions.rest.rest.first, env))
+
+def _do_and_form(task, expressions, env):
+    value = True
+    while expressions is not nil:
+        value = yield from task._eval(expressions.first, env)
+        if expressions.rest is nil:
+            return value
+        if not scheme_truep(value):
+            return False
+        expressions = expressions.rest
+    return value
+
+def _do_or_form(task, expressions, env):
+    value = False
+    while expressions is not nil:
+        value = yield from task._eval(expressions.first, env)
+        if expressions.rest is nil or scheme_truep(value):
+            return value
+        expressions = expressions.rest
+    return value
+
+def _do_cond_form(task, expressions, env):
+    while expressions is not nil:
+        clause = expressions.first
+        check_form(clause, 1)
+        if clause.first == 'else':
+            test = True
+            if expressions.rest != nil:
+                raise SchemeError('else must be last')
+        else:
+            test = yield from task._eval(clause.first, env)
+        if scheme_truep(test):
+            if clause.rest == nil:
+                return test
+            return (yield from task._eval_sequence(clause.rest, env))
+        expressions = expressions.rest
+
+def _do_let_form(task, expressions, env):
+    check_form(expressions, 2)
+    bindings = expressions.first
+    if not scheme_listp(bindings):
+        raise SchemeError('bad bindings list in let form')
+    names, values = [], []
+    while bindings is not nil:
+        binding = bindings.first
+        check_form(binding, 2, 2)
+        names.append(binding.first)
+        values.append((yield from task._eval(binding.rest.first, env)))
+        bindings = bindings.rest
+    formals = _list(names)
+    check_formals(formals)
+    let_env = env.make_child_frame(formals, _list(values))
+    return (yield from task._eval_sequence(expressions.rest, let_env))
+
+def _do_quasiquote_form(task, expressions, env):
+    def quasiquote_item(val, level):
+        if not isinstance(val, Pair):
+            return val
+        if val.first == 'unquote':
+            level -= 1
+            if level == 0:
+                check_form(val.rest, 1, 1)
+                return (yield from task._eval(val.rest.first, env))
+        elif val.first == 'quasiquote':
+            level += 1
+        items = []
+        while isinstance(val, Pair):
+            items.append((yield from quasiquote_item(val.first, level)))
+            val = val.rest
+        return _list(items)
+    check_form(expressions, 1, 1)
+    return (yield from quasiquote_item(expressions.first, 1))
+
+def _do_simplified_form(task, expressions, env):
+    return (yield from task._eval(expressions.first.choose(env), env))
+
+def _do_cons_stream_form(task, expressions, env):
+    check_form(expressions, 2, 2)
+    first = yield from task._eval(expressions.first, env)
+    promise_env = closure_env(expressions.rest, nil, expressions.rest, env)
+    return Pair(first, Promise(expressions.rest.first, promise_env))
+
+_FORMS = {
+    'and': _do_and_form,
+    'begin': _do_begin_form,
+    'cond': _do_cond_form,
+    'cons-stream': _do_cons_stream_form,
+    'define': _do_define_form,
+    'if': _do_if_form,
+    'let': _do_let_form,
+    'or': _do_or_form,
+    'quasiquote': _do_quasiquote_form,
+    SIMPLIFIED: _do_simplified_form,
+}
+
+#############################
+# Stepping built-in procedures
+#############################
+
+# Built-in procedures that apply Scheme procedures or evaluate expressions are
+# replaced by generators, so that the steps they take are counted too.
+
+def _eval_builtin(task, expr, env):
+    return (yield from task._eval(expr, env))
+
+def _apply_builtin(task, procedure, args, env):
+    return (yield from task._apply(procedure, args, env))
+
+def _map_builtin(task, fn, s, env):
+    check_type(fn, scheme_procedurep, 0, 'map')
+    check_type(s, scheme_listp, 1, 'map')
+    values = []
+    while s is not nil:
+        values.append((yield from task._apply(fn, Pair(s.first, nil), env)))
+        s = s.rest
+    return _list(values)
+
+def _filter_builtin(task, fn, s, env):
+    check_type(fn, scheme_procedurep, 0, 'filter')
+    check_type(s, scheme_listp, 1, 'filter')
+    values = []
+    while s is not nil:
+        if (yield from task._apply(fn, Pair(s.first, nil), env)):
+            values.append(s.first)
+        s = s.rest
+    return _list(values)
+
+def _reduce_builtin(task, fn, s, env):
+    check_type(fn, scheme_procedurep, 0, 'reduce')
+    check_type(s, lambda x: x is not nil, 1, 'reduce')
+    check_type(s, scheme_listp, 1, 'reduce')
+    value, s = s.first, s.rest
+    while s is not nil:
+        value = yield from task._apply(fn, _list([value, s.first]), env)
+        s = s.rest
+    return value
+
+def _force_builtin(task, x):
+    check_type(x, lambda x: type(x).__name__ == 'Promise', 0, 'promise')
+    return (yield from task._force(x))
+
+def _cdr_stream_builtin(task, x):
+    check_type(x, lambda x: isinstance(x, Pair) and
+               type(x.rest).__name__ == 'Promise', 0, 'cdr-stream')
+    return (yield from task._force(x.rest))
+
+def _call_cc_builtin(task, procedure, env):
+    check_type(procedure, scheme_procedurep, 0, 'call/cc')
+    continuation = Continuation()
+    try:
+        return (yield from task._apply(procedure, Pair(continuation, nil), env))
+    except ContinuationInvoked as invoked:
+        if invoked.continuation is not continuation:
+            raise
+        return invoked.value
+    finally:
+        continuation.active = False
+
+def _dynamic_wind_builtin(task, before, thunk, after, env):
+    for i, procedure in enumerate((before, thunk, after)):
+        check_type(procedure, scheme_procedurep, i, 'dynamic-wind')
+    yield from task._apply(before, nil, env)
+    try:
+        value = yield from task._apply(thunk, nil, env)
+    except Exception:  # Not GeneratorExit, when a suspended task is discarded
+        yield from task._apply(after, nil, env)
+        raise
+    yield from task._apply(after, nil, env)
+    return value
+
+def _spawn_builtin(task, thunk, env):
+    check_type(thunk, scheme_procedurep, 0, 'spawn')
+    yield from ()  # Spawning takes no steps
+    return task.scheduler.spawn(thunk, env)
+
+def _yield_builtin(task, env):
+    yield YIELD
+
+def _channel_receive_builtin(task, channel, env):
+    check_type(channel, lambda x: isinstance(x, Channel), 0, 'channel-receive')
+    while not channel.items:
+        channel.receivers.append(task)
+        yield BLOCK
+    return channel.items.popleft()
+
+_BUILTINS = {
+    scheme_eval: _eval_builtin,
+    complete_apply: _apply_builtin,
+    scheme_map: _map_builtin,
+    scheme_filter: _filter_builtin,
+    scheme_reduce: _reduce_builtin,
+    scheme_force: _force_builtin,
+    scheme_cdr_stream: _cdr_stream_builtin,
+    scheme_call_cc: _call_cc_builtin,
+    scheme_dynamic_wind: _dynamic_wind_builtin,
+    scheme_spawn: _spawn_builtin,
+    scheme_yield: _yield_builtin,
+    scheme_channel_receive: _channel_receive_builtin,
+}
+
+#############
+# Scheduling
+#############
+
+class Scheduler(object):
+    """Runs many tasks in one thread, giving each ready task SLICE steps in
+    turn."""
+
+    def __init__(self, slice=DEFAULT_SLICE):
+        self.slice = slice
+        self.ready = collections.deque()
+        self.running = None
+
+    def spawn(self, program, env, fuel=None, memory=None):
+        """Create a Task for PROGRAM in ENV and schedule it."""
+        task = Task(program, env, fuel, memory)
+        task.scheduler = self
+        self.ready.append(task)
+        return task
+
+    def wake(self, task):
+        """Schedule a blocked TASK again."""
+        if task.state == BLOCKED:
+            task.state = READY
+            self.ready.append(task)
+
+    def resume(self, task, fuel=None, memory=None):
+        """Raise the budgets of a TASK to FUEL steps and MEMORY blocks and
+        schedule it again if it was suspended."""
+        if fuel is not None:
+            task.fuel = fuel
+        if memory is not None:
+            task.memory = memory
+        if task.state == SUSPENDED:
+            task.state, task.reason = READY, None
+            self.ready.append(task)
+
+    def run_slice(self):
+        """Run the next ready task for one slice.  Returns the task, or None if
+        no task is ready or a task is already running."""
+        if not self.ready or self.running is not None:
+            return None
+        task = self.running = self.ready.popleft()
+        try:
+            if task.run(self.slice) == READY:
+                self.ready.append(task)
+        finally:
+            self.running = None
+        return task
+
+    def run_round(self):
+        """Run each task that is ready for one slice."""
+        for _ in range(len(self.ready)):
+            self.run_slice()
+
+    def run(self, steps=None):
+        """Run ready tasks until none is ready, or about STEPS steps have been
+        taken in total."""
+        taken = 0
+        while self.ready and self.running is None and (
+                steps is None or taken < steps):
+            before = self.ready[0].steps
+            taken += self.run_slice().steps - before
+
+def scheduler(env):
+    """Return the scheduler of tasks spawned in the global frame of ENV."""
+    while env.parent is not None:
+        env = env.parent
+    if getattr(env, 'scheduler', None) is None:
+        env.scheduler = Scheduler()
+    return env.scheduler
@@ -5,7 +5,8 @@ of tokens.  A token may be:
   * A number (represented as an int or float)
   * A boolean (represented as a bool)
   * A symbol (represented as a string)
-  * A delimiter, including parentheses, dots, and single quotes
+  * A delimiter, including parentheses, dots, single quotes, and the #( that
+    begins a vector
 
 This file also includes some features of Scheme that have not been addressed
 in the course, such as Scheme strings.
@@ -17,7 +18,6 @@ from ucb import main
 import itertools
 import string
 import sys
-import tokenize
 
 _NUMERAL_STARTS = set(string.digits) | set('+-.')
 _SYMBOL_CHARS = (set('!$%&*/:<=>?@^_~') | set(string.ascii_lowercase) |
@@ -26,7 +26,7 @@ _STRING_DELIMS = set('"')
 _WHITESPACE = set(' \t\n\r')
 _SINGLE_CHAR_TOKENS = set("()[]'`")
 _TOKEN_END = _WHITESPACE | _SINGLE_CHAR_TOKENS | _STRING_DELIMS | {',', ',@'}
-DELIMITERS = _SINGLE_CHAR_TOKENS | {'.', ',', ',@'}
+DELIMITERS = _SINGLE_CHAR_TOKENS | {'.', ',', ',@', '#('}
 
 def valid_symbol(s):
     """Returns whether s is a well-formed symbol."""
@@ -52,7 +52,7 @@ def next_candidate_token(line, k):
             if c == ']': c = ')'
             if c == '[': c = '('
             return c, k+1
-        elif c == '#':  # Boolean values #t and #f
+        elif c == '#':  # Boolean values #t and #f, and vectors #(
             return line[k:k+2], min(k+2, len(line))
         elif c == ',': # Unquote; check for @
             if k+1 < len(line) and line[k+1] == '@':
@@ -61,6 +61,7 @@ def next_candidate_token(line, k):
         elif c in _STRING_DELIMS:
             if k+1 < len(line) and line[k+1] == c: # No triple quotes in Scheme
                 return c+c, k+2
+            import tokenize
             line_bytes = (bytes(line[k:], encoding='utf-8'),)
             gen = tokenize.tokenize(iter(line_bytes).__next__)
             next(gen) # Throw away encoding token
@@ -0,0 +1,285 @@
+"""A turtle that records its drawing, for turtle graphics without a display.
+
+    python scheme.py --headless-turtle drawing.svg [--screen-size 800x600] program.scm
+
+A Recorder has the methods of the turtle module that the turtle procedures of
+scheme_builtins call, and takes its place in an interpreter whose graphics
+have a turtle_output file.  Rather than animating a window, it keeps a log of
+the lines, fills and pixel images drawn, in the order in which Tk would stack
+them, and renders the log in one pass on (exitonclick), which is called when
+the program ends: to SVG, or to PNG if the output file name ends with .png.
+Moves and circles follow the turtle module's own geometry, in logo mode.
+
+    >>> r = Recorder()
+    >>> r.mode('logo')
+    >>> r.color('red')
+    >>> r.begin_fill()
+    >>> r.forward(10)
+    >>> r.right(90)
+    >>> r.forward(10)
+    >>> r.end_fill()
+    >>> print(r.svg(20, 20))  # doctest: +NORMALIZE_WHITESPACE
+    <svg xmlns="http://www.w3.org/2000/svg" width="20" height="20" viewBox="-10 -10 20 20">
+    <rect x="-10" y="-10" width="20" height="20" fill="#ffffff"/>
+    <polygon points="0,0 0,-10 10,-10" fill="#ff0000" fill-rule="evenodd"/>
+    <polyline points="0,0 0,-10 10,-10" fill="none" stroke="#ff0000" stroke-width="1" stroke-linecap="round" stroke-linejoin="round"/>
+    </svg>
+"""
+
+from __future__ import print_function  # Python 2 compatibility
+
+import base64
+import math
+
+import scheme_builtins
+import scheme_pixels
+
+class Recorder(object):
+    """A headless turtle that logs what it draws on a screen of SIZE, to be
+    written to the file OUTPUT.  The log holds lists ['line', COLOR, POINTS],
+    ['fill', COLOR, POINTS] and ['image', FRAMEBUFFER], where COLOR is a
+    hexadecimal string."""
+
+    def __init__(self, output=None, size=scheme_pixels.SCREEN_SIZE):
+        self.output, self.size = output, size
+        self.background = '#ffffff'
+        self.reset()
+
+    def reset(self):
+        """Clear the drawing and return the turtle to its starting state."""
+        self.x = self.y = 0.0
+        self.angle = 90.0  # Counterclockwise from east, so facing north
+        self.drawing = True
+        self.pencolor = self.fillcolor = '#000000'
+        self.log = [entry for entry in getattr(self, 'log', ())
+                    if entry[0] == 'image']
+        self.line = None  # The points of the line being drawn
+        self.fill = None  # The fill entry being outlined
+
+    def _color(self, color):
+        value = scheme_pixels.rgb(color)
+        if value is None:
+            raise scheme_builtins.SchemeError('unknown color: ' + color)
+        return '#' + value.hex()
+
+    def _goto(self, x, y):
+        if self.drawing:
+            if self.line is None:
+                self.line = [(self.x, self.y)]
+                self.log.append(['line', self.pencolor, self.line])
+            self.line.append((x, y))
+        if self.fill is not None:
+            self.fill[2].append((x, y))
+        self.x, self.y = x, y
+
+    # Methods of the turtle module
+
+    def title(self, text):
+        pass
+
+    def mode(self, mode):
+        self.reset()
+
+    def forward(self, distance):
+        radians = math.radians(self.angle)
+        self._goto(self.x + distance * math.cos(radians),
+                   self.y + distance * math.sin(radians))
+
+    def backward(self, distance):
+        self.forward(-distance)
+
+    def left(self, angle):
+        self.angle = (self.angle + angle) % 360
+
+    def right(self, angle):
+        self.left(-angle)
+
+    def circle(self, radius, extent=None):
+        """Draw an arc as the turtle module does, as a regular polygon."""
+        if extent is None:
+            extent = 360
+        frac = abs(extent) / 360.0
+        steps = 1 + int(min(11 + abs(radius) / 6.0, 59.0) * frac)
+        w = 1.0 * extent / steps
+        w2 = 0.5 * w
+        l = 2.0 * radius * math.sin(math.radians(w2))
+        if radius < 0:
+            l, w, w2 = -l, -w, -w2
+        self.left(w2)
+        for _ in range(steps):
+            self.forward(l)
+            self.left(w)
+        self.left(-w2)
+
+    def setposition(self, x, y):
+        self._goto(x, y)
+
+    def setheading(self, heading):
+        self.angle = (90 - heading) % 360
+
+    def penup(self):
+        self.drawing, self.line = False, None
+
+    def pendown(self):
+        self.drawing = True
+
+    def showturtle(self):
+        pass
+
+    def hideturtle(self):
+        pass
+
+    def speed(self, speed):
+        pass
+
+    def clear(self):
+        self.log = [entry for entry in self.log if entry[0] == 'image']
+        self.line = self.fill = None
+
+    def color(self, color):
+        self.pencolor = self.fillcolor = self._color(color)
+        self.line = None
+
+    def bgcolor(self, color):
+        self.background = self._color(color)
+
+    def begin_fill(self):
+        if self.fill is None:
+            self.fill = ['fill', None, []]
+            self.log.append(self.fill)
+        self.fill[2] = [(self.x, self.y)]
+        self.line = None
+
+    def end_fill(self):
+        if self.fill is not None:
+            self.fill[1] = self.fillcolor
+            if len(self.fill[2]) <= 2:
+                self.log.remove(self.fill)
+            self.fill = None
+
+    def exitonclick(self):
+        """Write the drawing to the output file."""
+        width, height = self.size
+        if self.output.lower().endswith('.png'):
+            scheme_pixels.write_png(self.raster(width, height), self.output)
+        else:
+            with open(self.output, 'w') as outfile:
+                outfile.write(self.svg(width, height))
+
+    def getcanvas(self):
+        return self
+
+    def winfo_width(self):
+        return self.size[0]
+
+    def winfo_height(self):
+        return self.size[1]
+
+    def add_image(self, framebuffer):
+        """Draw the pixels of FRAMEBUFFER that are written, now or later, over
+        what has been drawn so far."""
+        self.log.append(['image', framebuffer])
+        self.line = None
+
+    # Rendering
+
+    def entries(self):
+        """The entries of the log that are drawn."""
+        return [entry for entry in self.log if entry[0] == 'image' or
+                (entry[1] is not None and len(entry[2]) > 1)]
+
+    def svg(self, width, height):
+        """Return an SVG document of the drawing on a WIDTH by HEIGHT
+        screen centered on the origin."""
+        left, top = -(width // 2), -(height // 2)
+        lines = ['<svg xmlns="http://www.w3.org/2000/svg" width="{0}" '
+                 'height="{1}" viewBox="{2} {3} {0} {1}">'.format(
+                     width, height, left, top),
+                 '<rect x="{0}" y="{1}" width="{2}" height="{3}" '
+                 'fill="{4}"/>'.format(left, top, width, height, self.background)]
+        for entry in self.entries():
+            if entry[0] == 'image':
+                data = base64.b64encode(scheme_pixels.png(entry[1], True))
+                lines.append('<image x="{0}" y="{1}" width="{2}" height="{3}" '
+                             'href="data:image/png;base64,{4}"/>'.format(
+                                 left, top, entry[1].width, entry[1].height,
+                                 data.decode('ascii')))
+            elif entry[0] == 'fill':
+                lines.append('<polygon points="{0}" fill="{1}" '
+                             'fill-rule="evenodd"/>'.format(
+                                 _points(entry[2]), entry[1]))
+            else:
+                lines.append('<polyline points="{0}" fill="none" stroke="{1}" '
+                             'stroke-width="1" stroke-linecap="round" '
+                             'stroke-linejoin="round"/>'.format(
+                                 _points(entry[2]), entry[1]))
+        lines.append('</svg>')
+        return '\n'.join(lines) + '\n'
+
+    def raster(self, width, height):
+        """Return a scheme_pixels.Framebuffer of the drawing on a WIDTH by
+        HEIGHT screen centered on the origin."""
+        framebuffer = scheme_pixels.Framebuffer(width, height)
+        framebuffer.pixels[:] = bytes.fromhex(self.background[1:]) * (width * height)
+        def screen(point):
+            return point[0] + width // 2, height // 2 - point[1]
+        for entry in self.entries():
+            if entry[0] == 'image':
+                _composite(framebuffer, entry[1])
+                continue
+            color = bytes.fromhex(entry[1][1:])
+            points = [screen(p) for p in entry[2]]
+            if entry[0] == 'fill':
+                _fill_polygon(framebuffer, points, color)
+            else:
+                for start, end in zip(points, points[1:]):
+                    _draw_line(framebuffer, start, end, color)
+        return framebuffer
+
+def _points(points):
+    return ' '.join('{0:g},{1:g}'.format(round(x, 2) + 0.0, round(-y, 2) + 0.0)
+                    for x, y in points)
+
+def _plot(framebuffer, column, row, color):
+    if 0 <= column < framebuffer.width and 0 <= row < framebuffer.height:
+        start = 3 * (row * framebuffer.width + column)
+        framebuffer.pixels[start:start + 3] = color
+
+def _draw_line(framebuffer, start, end, color):
+    """Plot the pixels of a line of width 1 from START to END."""
+    (x0, y0), (x1, y1) = start, end
+    steps = int(max(abs(x1 - x0), abs(y1 - y0))) + 1
+    for i in range(steps + 1):
+        t = i / steps
+        _plot(framebuffer, int(round(x0 + (x1 - x0) * t)),
+              int(round(y0 + (y1 - y0) * t)), color)
+
+def _fill_polygon(framebuffer, points, color):
+    """Fill the polygon with vertices POINTS by the even-odd rule, sampling
+    each pixel at its center."""
+    edges = list(zip(points, points[1:] + points[:1]))
+    rows = [y for _, y in points]
+    for row in range(max(int(min(rows)), 0),
+                     min(int(math.ceil(max(rows))) + 1, framebuffer.height)):
+        y = row + 0.5
+        crossings = sorted(x0 + (y - y0) * (x1 - x0) / (y1 - y0)
+                           for (x0, y0), (x1, y1) in edges
+                           if (y0 <= y) != (y1 <= y))
+        for a, b in zip(crossings[::2], crossings[1::2]):
+            first = max(int(math.ceil(a - 0.5)), 0)
+            end = min(int(math.ceil(b - 0.5)), framebuffer.width)
+            if first < end:
+                start = 3 * (row * framebuffer.width + first)
+                framebuffer.pixels[start:start + 3 * (end - first)] = color * (end - first)
+
+def _composite(framebuffer, image):
+    """Copy the written pixels of the framebuffer IMAGE, which is centered on
+    FRAMEBUFFER, into FRAMEBUFFER."""
+    left = (framebuffer.width - image.width) // 2
+    top = (framebuffer.height - image.height) // 2
+    for row in range(image.height):
+        for column in range(image.width):
+            if image.written[row * image.width + column]:
+                start = 3 * (row * image.width + column)
+                _plot(framebuffer, left + column, top + row,
+                      image.pixels[start:start + 3])
@@ -2,12 +2,10 @@
 
 from __future__ import print_function
 
-import code
 import functools
-import inspect
 import re
-import signal
 import sys
+import threading
 
 
 def main(fn):
@@ -21,12 +19,12 @@ def main(fn):
 
     Use this instead of the typical __name__ == "__main__" predicate.
     """
-    if inspect.stack()[1][0].f_locals['__name__'] == '__main__':
+    if sys._getframe(1).f_locals['__name__'] == '__main__':
         args = sys.argv[1:] # Discard the script name from command line
         fn(*args) # Call the main function
     return fn
 
-_PREFIX = ''
+_PREFIX = threading.local()  # The indentation of each thread's trace, in .text
 def trace(fn):
     """A decorator that prints a function's name, its arguments, and its return
     values each time the function is called. For example,
@@ -37,17 +35,16 @@ def trace(fn):
     """
     @functools.wraps(fn)
     def wrapped(*args, **kwds):
-        global _PREFIX
         reprs = [repr(e) for e in args]
         reprs += [repr(k) + '=' + repr(v) for k, v in kwds.items()]
         log('{0}({1})'.format(fn.__name__, ', '.join(reprs)) + ':')
-        _PREFIX += '    '
+        _PREFIX.text = _prefix() + '    '
         try:
             result = fn(*args, **kwds)
-            _PREFIX = _PREFIX[:-4]
+            _PREFIX.text = _prefix()[:-4]
         except Exception as e:
             log(fn.__name__ + ' exited via exception')
-            _PREFIX = _PREFIX[:-4]
+            _PREFIX.text = _prefix()[:-4]
             raise
         # Here, print out the return value.
         log('{0}({1}) -> {2}'.format(fn.__name__, ', '.join(reprs), result))
@@ -55,13 +52,19 @@ def trace(fn):
     return wrapped
 
 
+def _prefix():
+    return getattr(_PREFIX, 'text', '')
+
+
 def log(message):
     """Print an indented message (used with trace)."""
-    print(_PREFIX + re.sub('\n', '\n' + _PREFIX, str(message)))
+    prefix = _prefix()
+    print(prefix + re.sub('\n', '\n' + prefix, str(message)))
 
 
 def log_current_line():
     """Print information about the current line of code."""
+    import inspect
     frame = inspect.stack()[1]
     log('Current line: File "{f[1]}", line {f[2]}, in {f[3]}'.format(f=frame))
 
@@ -75,6 +78,10 @@ def interact(msg=None):
       <Control>-Z <Enter> exits the interactive session and returns to normal
       execution.
     """
+    import code
+    import inspect
+    import signal
+
     # evaluate commands in current namespace
     frame = inspect.currentframe().f_back
     namespace = frame.f_globals.copy()